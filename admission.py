@@ -0,0 +1,100 @@
+# admission.py
+# Admission control for reservations: floods from one Telegram ID or one IP, and attempts on
+# numbers already known to be taken, are turned away before the request touches the database.
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import request
+from werkzeug.utils import import_string
+
+from metrics import ADMISSION_DECISIONS
+from ticket_store import cached_availability_bitmap
+
+Rejection = namedtuple('Rejection', ['reason', 'retry_after'])
+
+
+# ---------------- Token Buckets ----------------
+class TokenBucketLimiter:
+    """
+    In-process token buckets keyed by string, least recently used evicted past
+    `max_keys`. A shared backend (ADMISSION_BACKEND) only needs the same hit().
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def hit(self, key, rate, burst):
+        """Takes a token from `key`'s bucket. Returns 0 if allowed, else the seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# ---------------- Admission ----------------
+def client_ip(trusted_hops):
+    """The caller's address; behind `trusted_hops` proxies, the one the outermost trusted proxy saw."""
+    route = request.access_route
+    if trusted_hops and len(route) >= trusted_hops:
+        return route[-trusted_hops]
+    return request.remote_addr
+
+
+class AdmissionControl:
+    """Checks run, in order, without a database query: per-IP bucket, per-user bucket, cached availability."""
+
+    def __init__(self, limiter, config):
+        self.limiter = limiter
+        self.config = config
+
+    def check(self, draw_id, ticket_numbers, user_telegram_id):
+        """None to admit the attempt, else a Rejection. Every decision is counted by outcome."""
+        if not self.config['ADMISSION_ENABLED']:
+            return None
+        config = self.config
+        checks = (
+            ('rate_limited_ip', f"ip:{client_ip(config['TRUSTED_PROXY_HOPS'])}",
+             config['ADMISSION_IP_RATE'], config['ADMISSION_IP_BURST']),
+            ('rate_limited_user', f"tg:{user_telegram_id}", config['ADMISSION_USER_RATE'], config['ADMISSION_USER_BURST']),
+        )
+        for reason, key, rate, burst in checks:
+            retry_after = self.limiter.hit(key, rate, burst)
+            if retry_after:
+                return self.reject(reason, retry_after)
+
+        # Every number already taken in this worker's recent bitmap: answer as the database would
+        bitmap = cached_availability_bitmap(draw_id, config['ADMISSION_AVAILABILITY_MAX_AGE_SECONDS'])
+        if bitmap is not None and all(
+                1 <= n <= len(bitmap) * 8 and bitmap[(n - 1) >> 3] & (1 << ((n - 1) & 7)) for n in ticket_numbers):
+            return self.reject('taken', 0.0)
+        ADMISSION_DECISIONS.inc(1, 'admitted')
+        return None
+
+    def reject(self, reason, retry_after):
+        ADMISSION_DECISIONS.inc(1, reason)
+        return Rejection(reason, retry_after)
+
+
+def init_admission(flask_app):
+    factory = flask_app.config.get('ADMISSION_BACKEND')
+    limiter = import_string(factory)(flask_app) if factory else TokenBucketLimiter(flask_app.config['ADMISSION_MAX_KEYS'])
+    admission = AdmissionControl(limiter, flask_app.config)
+    flask_app.extensions['admission'] = admission
+    return admission
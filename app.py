@@ -1,31 +1,50 @@
 import os
-import random
+import math
 import asyncio
+import mimetypes
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Blueprint, current_app
+import click
+
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, Blueprint, current_app, abort,
+                   send_from_directory, Response, stream_with_context)
 from flask_login import LoginManager, login_user, current_user, logout_user, login_required
 from flask_wtf.csrf import generate_csrf
+from sqlalchemy.orm import joinedload
 
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from models import db, bcrypt, AdminUser, Draw, Ticket, Winner, init_login_manager
-from forms import AdminLoginForm, CreateDrawForm, CSRFOnlyForm
+from models import (db, bcrypt, AdminUser, Draw, Ticket, Winner, WinnerSnapshot, TicketEvent, PaymentProof,
+                    init_login_manager, upgrade_schema)
+from forms import AdminLoginForm, CreateDrawForm, CSRFOnlyForm, TicketFilterForm, ExportForm
+from notifications import enqueue_notification, NotificationDispatcher
+from draw_engine import assign_new_seed, execute_draw, verify_draw, winner_feed, DrawError
+from ticket_store import (generate_tickets, start_background_generation, mark_tickets_changed,
+                          ticket_page, reserve_tickets, release_ticket, review_payments, clear_draw_tickets,
+                          encode_grid, changes_since, pending_reservation_count, lock_draws)
+from payment_proofs import store_proof_file, make_thumbnail, record_payment_proof, proofs_for_tickets
+from exports import export_chunks, export_filename
+from draw_archive import start_background_purge, resume_purges, archive_finished_draws, archive_draw
+from db_pool import engine_options, init_engine_profile, pool_snapshot
+from metrics import init_metrics, timed_handler, ADMISSION_DECISIONS
+from admission import init_admission
+from response_cache import init_response_cache, cached_page, draw_page_key, all_draws_key
+from rendering import init_rendering, ticket_grid_fragment
 import config
 
 # Load environment variables
 load_dotenv()
 
 # Global Telegram bot application
-#application = None
-# Global Telegram bot
-telegram_app = None
+application = None
 # ---------------- Telegram Handlers ----------------
 # ---------------- Telegram Bot Commands ----------------
+@timed_handler
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Detect environment for correct web app URL
     web_app_url = os.getenv("https://telegram-lottery.onrender.com", "http://127.0.0.1:5000")
@@ -38,46 +57,125 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
-async def my_tickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_telegram_id = str(update.effective_user.id)
-    with current_app.app_context():
-        tickets = Ticket.query.filter_by(user_telegram_id=user_telegram_id).order_by(Ticket.reserved_at.desc()).all()
-        if not tickets:
-            await update.message.reply_text("You have no tickets reserved or approved yet.")
-            return
-        response_text = "🎟️ *Your Tickets:*\n"
-        for ticket in tickets:
-            draw_name = ticket.draw.name
-            status_emoji = {
-                "pending_payment": "⏳",
-                "approved": "✅",
-                "available": "🎫"
-            }.get(ticket.status, "❔")
-            response_text += f"{status_emoji} *Draw:* {draw_name}, Ticket #{ticket.ticket_number} (*{ticket.status}*)\n"
-            if ticket.status == 'pending_payment' and ticket.reserved_at:
-                expiry_time = ticket.reserved_at + timedelta(
-                    hours=current_app.config.get('TICKET_RESERVATION_EXPIRY_HOURS', 24)
-                )
-                response_text += f"   ⏰ Expires: {expiry_time.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
-        await update.message.reply_text(response_text, parse_mode="Markdown")
+# Bot handlers run on the bot's event loop: database work goes to this pool, each call in its own app context
+bot_db_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BOT_DB_WORKERS', 8)), thread_name_prefix='bot-db')
+TICKETS_PER_PAGE = 15
 
+async def run_in_app_context(flask_app, func, *args):
+    def call():
+        with flask_app.app_context():
+            try:
+                return func(*args)
+            finally:
+                db.session.remove()
+    return await asyncio.get_running_loop().run_in_executor(bot_db_executor, call)
+
+def load_user_tickets(user_telegram_id, page):
+    """One page of a user's tickets with their draws eager-loaded, as plain tuples."""
+    query = Ticket.query.options(joinedload(Ticket.draw))\
+                        .filter(Ticket.user_telegram_id == user_telegram_id)
+    total = query.count()
+    tickets = query.order_by(Ticket.reserved_at.desc(), Ticket.id.desc())\
+                   .offset((page - 1) * TICKETS_PER_PAGE)\
+                   .limit(TICKETS_PER_PAGE)\
+                   .all()
+    expiry_hours = current_app.config.get('TICKET_RESERVATION_EXPIRY_HOURS', 24)
+    rows = []
+    for ticket in tickets:
+        expires_at = None
+        if ticket.status == 'pending_payment' and ticket.reserved_at:
+            expires_at = ticket.reserved_at + timedelta(hours=expiry_hours)
+        rows.append((ticket.draw.name, ticket.ticket_number, ticket.status, expires_at))
+    return total, rows
+
+def format_user_tickets(total, rows, page):
+    pages = max((total + TICKETS_PER_PAGE - 1) // TICKETS_PER_PAGE, 1)
+    response_text = f"🎟️ *Your Tickets* (page {page}/{pages}, {total} total):\n"
+    for draw_name, ticket_number, status, expires_at in rows:
+        status_emoji = {
+            "pending_payment": "⏳",
+            "approved": "✅",
+            "won": "🏆",
+            "available": "🎫"
+        }.get(status, "❔")
+        response_text += f"{status_emoji} *Draw:* {draw_name}, Ticket #{ticket_number} (*{status}*)\n"
+        if expires_at:
+            response_text += f"   ⏰ Expires: {expires_at.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
+
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"my_tickets:{page - 1}"))
+    if page < pages:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"my_tickets:{page + 1}"))
+    return response_text, (InlineKeyboardMarkup([buttons]) if buttons else None)
+
+@timed_handler
+async def my_tickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_telegram_id = update.effective_user.id
+    page = int(context.args[0]) if context.args and context.args[0].isdigit() else 1
+    page = max(page, 1)
+    total, rows = await run_in_app_context(context.bot_data['flask_app'], load_user_tickets, user_telegram_id, page)
+    if not total:
+        await update.message.reply_text("You have no tickets reserved or approved yet.")
+        return
+    response_text, keyboard = format_user_tickets(total, rows, page)
+    await update.message.reply_text(response_text, parse_mode="Markdown", reply_markup=keyboard)
+
+@timed_handler
+async def my_tickets_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    page = max(int(query.data.split(':', 1)[1]), 1)
+    total, rows = await run_in_app_context(context.bot_data['flask_app'], load_user_tickets, query.from_user.id, page)
+    if not total:
+        await query.edit_message_text("You have no tickets reserved or approved yet.")
+        return
+    response_text, keyboard = format_user_tickets(total, rows, page)
+    await query.edit_message_text(response_text, parse_mode="Markdown", reply_markup=keyboard)
+
+def format_proof_reply(linked, first_received):
+    if first_received:
+        text = (f"⚠️ This screenshot was already sent on {first_received.strftime('%Y-%m-%d %H:%M')} UTC. "
+                "An admin will check it before approving anything.\n")
+    else:
+        text = "📸 Payment screenshot received.\n"
+    if linked:
+        text += "It was attached to: " + ', '.join(f"Ticket #{number} ({draw_name})" for draw_name, number in linked)
+        text += "\nAn admin will review it shortly."
+    else:
+        text += "You have no tickets awaiting payment, so it was not attached to any ticket. Reserve on the web app first."
+    return text
+
+@timed_handler
+async def payment_proof_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stores a payment screenshot (photo or image file) and attaches it to the sender's pending tickets."""
+    flask_app = context.bot_data['flask_app']
+    message = update.message
+    if message.photo:
+        attachment, extension = message.photo[-1], '.jpg'  # Largest size Telegram made
+    else:
+        attachment = message.document
+        extension = mimetypes.guess_extension(attachment.mime_type or '') or '.bin'
+    if attachment.file_size and attachment.file_size > flask_app.config['PAYMENT_PROOF_MAX_BYTES']:
+        await message.reply_text("That file is too large. Please send the screenshot as a photo.")
+        return
+
+    telegram_file = await context.bot.get_file(attachment.file_id)
+    data = bytes(await telegram_file.download_as_bytearray())
+    # Hashing and disk writes off the event loop, thumbnails in the process pool
+    sha256, storage_path = await asyncio.to_thread(store_proof_file, flask_app.config['PAYMENT_PROOF_DIR'],
+                                                   data, extension)
+    thumbnail_path = await make_thumbnail(flask_app, sha256, storage_path)
+    linked, first_received = await run_in_app_context(
+        flask_app, record_payment_proof, update.effective_user.id, update.effective_user.username,
+        sha256, storage_path, thumbnail_path, len(data), attachment.file_unique_id)
+    await message.reply_text(format_proof_reply(linked, first_received))
+
+@timed_handler
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Unknown command. Use /start or /my_tickets.")
 
 
-def setup_telegram_bot():
-    global telegram_app
-    TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not TOKEN:
-        print("⚠️ TELEGRAM_BOT_TOKEN not set in .env")
-        return None
-    telegram_app = Application.builder().token(TOKEN).build()
-    telegram_app.add_handler(CommandHandler("start", start_command))
-    telegram_app.add_handler(CommandHandler("my_tickets", my_tickets_command))
-    telegram_app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
-    return telegram_app
-
-
 # ---------------- Admin Blueprint ----------------
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin', template_folder='templates/admin')
 
@@ -85,7 +183,7 @@ admin_bp = Blueprint('admin', __name__, url_prefix='/admin', template_folder='te
 @login_required
 def dashboard():
     draws = Draw.query.order_by(Draw.created_at.desc()).all()
-    return render_template('admin_dashboard.html', draws=draws)
+    return render_template('admin_dashboard.html', draws=draws, export_form=ExportForm(formdata=None))
 
 @admin_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -116,18 +214,23 @@ def create_draw():
         new_draw = Draw(
             name=form.name.data,
             total_tickets=form.total_tickets.data,
-            ticket_price=form.ticket_price.data
+            ticket_price=form.ticket_price.data,
+            sparse_tickets=current_app.config['TICKET_STORAGE_MODE'] == 'sparse',
+            prize_tiers=form.prize_tiers.data.replace(' ', '')
         )
+        assign_new_seed(new_draw)
         db.session.add(new_draw)
         db.session.commit()
 
-        # Create tickets for this draw
-        for i in range(1, new_draw.total_tickets + 1):
-            ticket = Ticket(draw_id=new_draw.id, ticket_number=i, status='available')
-            db.session.add(ticket)
-        db.session.commit()
-
-        flash(f'Draw "{new_draw.name}" created successfully with {new_draw.total_tickets} tickets!', 'success')
+        # Create tickets for this draw (chunked bulk insert, background thread for big draws)
+        if new_draw.sparse_tickets:
+            flash(f'Draw "{new_draw.name}" created successfully with {new_draw.total_tickets} tickets!', 'success')
+        elif new_draw.total_tickets > current_app.config['BACKGROUND_TICKET_GENERATION_THRESHOLD']:
+            start_background_generation(new_draw.id)
+            flash(f'Draw "{new_draw.name}" created. Generating {new_draw.total_tickets} tickets in the background...', 'info')
+        else:
+            generate_tickets(new_draw.id)
+            flash(f'Draw "{new_draw.name}" created successfully with {new_draw.total_tickets} tickets!', 'success')
         return redirect(url_for('admin.dashboard'))
     return render_template('admin_create_draw.html', form=form)
 
@@ -135,18 +238,74 @@ def create_draw():
 @login_required
 def draw_details(draw_id):
     draw = Draw.query.get_or_404(draw_id)
-    all_tickets = Ticket.query.filter_by(draw_id=draw.id).order_by(Ticket.ticket_number).all()
-    winners = Winner.query.filter_by(draw_id=draw.id).order_by(Winner.place).all()
+    filter_form = TicketFilterForm(formdata=request.args)
+    filters = {}
+    if filter_form.validate():
+        filters = {name: field.data for name, field in filter_form._fields.items() if field.data}
+    tickets, has_previous, has_next = ticket_page(
+        draw.id, filters,
+        after=request.args.get('after', type=int),
+        before=request.args.get('before', type=int),
+        per_page=current_app.config['ADMIN_TICKETS_PER_PAGE'],
+    )
+    # Keep the raw filter values in the pagination links
+    filter_args = {name: request.args[name] for name in filter_form._fields if request.args.get(name)}
+    winners = Winner.query.options(joinedload(Winner.ticket))\
+                          .filter_by(draw_id=draw.id)\
+                          .order_by(Winner.place)\
+                          .all()
     csrf_form = CSRFOnlyForm()
-    return render_template('admin_draw_details.html', draw=draw, tickets=all_tickets, winners=winners, csrf_form=csrf_form)
+    return render_template('admin_draw_details.html', draw=draw, tickets=tickets, winners=winners, csrf_form=csrf_form,
+                           filter_form=filter_form, filter_args=filter_args,
+                           has_previous=has_previous, has_next=has_next,
+                           proofs=proofs_for_tickets(draw.id, tickets))
+
+@admin_bp.route('/payment_proof/<int:proof_id>')
+@login_required
+def payment_proof_file(proof_id):
+    proof = PaymentProof.query.get_or_404(proof_id)
+    path = proof.thumbnail_path if request.args.get('thumbnail') and proof.thumbnail_path else proof.storage_path
+    return send_from_directory(current_app.config['PAYMENT_PROOF_DIR'], path, max_age=86400)
+
+@admin_bp.route('/export')
+@login_required
+def export():
+    form = ExportForm(formdata=request.args)
+    if not form.validate():
+        return jsonify(errors=form.errors), 400
+    filters = {name: field.data for name, field in form._fields.items() if field.data and name not in ('kind', 'format')}
+    kind, fmt = form.kind.data, form.format.data
+    # Rows are written as they are read, so the download starts at once and the worker never holds the result set
+    return Response(stream_with_context(export_chunks(kind, fmt, filters)),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{export_filename(kind, fmt, filters)}"',
+                             'X-Accel-Buffering': 'no'})
+
+def ticket_changes_refused(draw_id):
+    """
+    Why an admin may not change this draw's tickets and payments right now, or None. Locks the
+    draw until the commit first (ticket_store.lock_draws), so it cannot be executed meanwhile.
+    """
+    draw = lock_draws([draw_id])[draw_id]
+    if draw.is_drawn:
+        # verify_draw re-picks winners by offset into the approved tickets, so that set is frozen once drawn
+        return 'This draw has been executed; its tickets and payments can no longer change.'
+    if draw.purge_state:
+        # Its counters are already zeroed and its rows are about to be purged (see clear_draw_tickets)
+        return 'This draw is being reset or deleted; its tickets and payments can no longer change.'
+    return None
 
 @admin_bp.route('/approve_payment/<int:ticket_id>', methods=['POST'])
 @login_required
 def approve_payment(ticket_id):
     ticket = Ticket.query.get_or_404(ticket_id)
-    if ticket.status == 'pending_payment':
+    refused = ticket_changes_refused(ticket.draw_id)
+    if refused:
+        flash(refused, 'warning')
+    elif ticket.status == 'pending_payment':
         ticket.status = 'approved'
         ticket.approved_at = datetime.utcnow()
+        mark_tickets_changed(ticket.draw_id, [(ticket.ticket_number, 'approved')], pending_payment=-1, approved=1)
         db.session.commit()
         flash(f'Ticket #{ticket.ticket_number} approved.', 'success')
     else:
@@ -157,16 +316,81 @@ def approve_payment(ticket_id):
 @login_required
 def reject_payment(ticket_id):
     ticket = Ticket.query.get_or_404(ticket_id)
-    if ticket.status == 'pending_payment':
-        ticket.status = 'available'
-        ticket.user_telegram_id = None
-        ticket.user_username = None
-        ticket.reserved_at = None
+    draw_id, ticket_number = ticket.draw_id, ticket.ticket_number
+    refused = ticket_changes_refused(ticket.draw_id)
+    if refused:
+        flash(refused, 'warning')
+    elif ticket.status == 'pending_payment':
+        release_ticket(ticket)
         db.session.commit()
-        flash(f'Ticket #{ticket.ticket_number} reverted to available.', 'info')
+        flash(f'Ticket #{ticket_number} reverted to available.', 'info')
     else:
         flash('Ticket is not in pending status.', 'warning')
-    return redirect(url_for('admin.draw_details', draw_id=ticket.draw_id))
+    return redirect(url_for('admin.draw_details', draw_id=draw_id))
+
+@admin_bp.route('/cache_stats')
+@login_required
+def cache_stats():
+    cache = current_app.extensions.get('response_cache')
+    return jsonify(enabled=cache is not None, **(cache.snapshot() if cache else {}))
+
+@admin_bp.route('/admission')
+@login_required
+def admission_stats():
+    limiter = current_app.extensions['admission'].limiter
+    decisions = {outcome: count for (outcome,), count in ADMISSION_DECISIONS.values().items()}
+    return jsonify(enabled=current_app.config['ADMISSION_ENABLED'], decisions=decisions,
+                   tracked_keys=len(limiter) if hasattr(limiter, '__len__') else None)
+
+@admin_bp.route('/db_pool')
+@login_required
+def db_pool_stats():
+    return jsonify(pool_snapshot(current_app, db))
+
+@admin_bp.route('/payments/bulk', methods=['POST'])
+@login_required
+def bulk_review_payments():
+    """
+    Approve or reject many pending payments at once. Accepts JSON or form data:
+    action=approve|reject plus any of ticket_ids, draw_id, user_telegram_id
+    ("all pending for this draw / user"). Returns a compact JSON summary.
+    """
+    if not CSRFOnlyForm().validate_on_submit():
+        return jsonify(ok=False, error='Invalid CSRF token.'), 400
+    data = request.get_json(silent=True) or request.form
+
+    ticket_ids = data.getlist('ticket_ids') if hasattr(data, 'getlist') else data.get('ticket_ids')
+    try:
+        ticket_ids = [int(ticket_id) for ticket_id in ticket_ids] if ticket_ids else None
+        draw_id = int(data['draw_id']) if data.get('draw_id') else None
+        user_telegram_id = int(data['user_telegram_id']) if data.get('user_telegram_id') else None
+    except (TypeError, ValueError):
+        return jsonify(ok=False, error='ticket_ids, draw_id and user_telegram_id must be integers.'), 400
+
+    try:
+        rows = review_payments(data.get('action'), ticket_ids=ticket_ids, draw_id=draw_id,
+                               user_telegram_id=user_telegram_id)
+    except ValueError as e:
+        return jsonify(ok=False, error=str(e)), 400
+
+    # One confirmation per user and draw rather than one per ticket
+    per_user = {}
+    for row in rows:
+        per_user.setdefault((row.user_telegram_id, row.draw_id), []).append(row.ticket_number)
+    draw_names = dict(db.session.query(Draw.id, Draw.name).filter(Draw.id.in_({row.draw_id for row in rows})).all())
+    for (chat_id, row_draw_id), numbers in per_user.items():
+        numbers = sorted(numbers)
+        tickets = ', '.join(f"#{n}" for n in numbers[:20]) + (f" and {len(numbers) - 20} more" if len(numbers) > 20 else '')
+        if data.get('action') == 'approve':
+            text = f"✅ Your payment for Ticket(s) {tickets} in Draw '{draw_names[row_draw_id]}' has been approved. Good luck!"
+        else:
+            text = (f"❌ Your payment for Ticket(s) {tickets} in Draw '{draw_names[row_draw_id]}' could not be confirmed. "
+                    "The ticket(s) are available again.")
+        enqueue_notification(chat_id, text)
+    db.session.commit()
+
+    return jsonify(ok=True, action=data.get('action'), count=len(rows),
+                   tickets=[[row.id, row.draw_id, row.ticket_number] for row in rows])
 
 @admin_bp.route('/draw_execute/<int:draw_id>', methods=['POST'])
 @login_required
@@ -176,43 +400,21 @@ def draw_execute(draw_id):
         flash('Draw already executed!', 'info')
         return redirect(url_for('admin.draw_details', draw_id=draw.id))
 
-    approved_tickets = Ticket.query.filter_by(draw_id=draw.id, status='approved').all()
-    if len(approved_tickets) < 1:
-        flash('No approved tickets to draw winners!', 'danger')
+    try:
+        results = execute_draw(draw)
+    except DrawError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
         return redirect(url_for('admin.draw_details', draw_id=draw.id))
 
-    total_prize_pool = draw.ticket_price * len(approved_tickets)
-    prize_distribution = [0.4, 0.2, 0.1]  # 40%, 20%, 10%
-    num_winners = min(3, len(approved_tickets))
-    selected_winners = random.sample(approved_tickets, num_winners)
-
-    for idx, ticket in enumerate(selected_winners, start=1):
-        prize_amount = round(total_prize_pool * prize_distribution[idx - 1], 2)
-        winner = Winner(
-            place=idx,
-            prize_amount=prize_amount,
-            ticket_id=ticket.id,
-            draw_id=draw.id,
-            won_at=datetime.utcnow()
+    for winner, ticket in results:
+        # Telegram notification (sent by the dispatcher once this commit lands)
+        enqueue_notification(
+            ticket.user_telegram_id,
+            f"🎉 Congratulations! You won ${winner.prize_amount:.2f} in the draw '{draw.name}'!\n"
+            f"Your ticket: #{ticket.ticket_number}\n"
+            f"Place: {ordinal_suffix(winner.place)}"
         )
-        db.session.add(winner)
-
-        # Telegram notification
-        if ticket.user_telegram_id and application:
-            try:
-                message = (
-                    f"🎉 Congratulations! You won ${prize_amount:.2f} in the draw '{draw.name}'!\n"
-                    f"Your ticket: #{ticket.ticket_number}\n"
-                    f"Place: {idx}{ordinal_suffix(idx)}"
-                )
-                asyncio.run_coroutine_threadsafe(
-                    application.bot.send_message(chat_id=int(ticket.user_telegram_id), text=message),
-                    asyncio.get_event_loop()
-                )
-            except Exception as e:
-                print(f"Failed to send Telegram message to {ticket.user_telegram_id}: {e}")
-
-    draw.is_drawn = True
     db.session.commit()
     flash('🎉 Draw executed successfully! Winners selected.', 'success')
     return redirect(url_for('admin.draw_details', draw_id=draw.id))
@@ -223,7 +425,12 @@ def draw_execute(draw_id):
 def delete_ticket(ticket_id):
     ticket = Ticket.query.get_or_404(ticket_id)
     draw_id = ticket.draw_id
-    db.session.delete(ticket)
+    refused = ticket_changes_refused(ticket.draw_id)
+    if refused:
+        flash(refused, 'warning')
+        return redirect(url_for('admin.draw_details', draw_id=draw_id))
+    # Sparse draws drop the row; dense draws keep one row per number, so it goes back to available
+    release_ticket(ticket)
     db.session.commit()
     flash(f'Ticket #{ticket.ticket_number} deleted successfully.', 'info')
     return redirect(url_for('admin.draw_details', draw_id=draw_id))
@@ -233,7 +440,9 @@ def delete_winner(winner_id):
     winner = Winner.query.get_or_404(winner_id)
     draw_id = winner.draw_id
     try:
+        WinnerSnapshot.query.filter_by(winner_id=winner.id).delete(synchronize_session=False)
         db.session.delete(winner)
+        mark_tickets_changed(draw_id)  # Version bump so cached public pages drop the winner
         db.session.commit()
         flash(f'Winner for ticket #{winner.ticket.ticket_number} deleted successfully.', 'success')
     except Exception as e:
@@ -244,15 +453,26 @@ def delete_winner(winner_id):
 @login_required
 def reset_draw(draw_id):
     draw = Draw.query.get_or_404(draw_id)
+    if draw.purge_state:
+        # A purge interrupted by a restart picks up where it stopped; a running one keeps its lease
+        start_background_purge(draw.id)
+        flash(f'Draw "{draw.name}" is still being cleared; its background purge was resumed if it had stopped.', 'info')
+        return redirect(url_for('admin.draw_details', draw_id=draw.id))
     try:
-        # Delete winners first
+        # Delete winners first (a handful of rows)
+        WinnerSnapshot.query.filter_by(draw_id=draw.id).delete(synchronize_session=False)
         Winner.query.filter_by(draw_id=draw.id).delete(synchronize_session=False)
-        # Delete tickets
-        Ticket.query.filter_by(draw_id=draw.id).delete(synchronize_session=False)
+        # Close the draw; its tickets are deleted in the background, in batches
+        clear_draw_tickets(draw)
         draw.is_drawn = False
         draw.draw_time = None
+        draw.approved_at_draw = None
+        # The old seed has been revealed, so the rerun needs a fresh commitment
+        assign_new_seed(draw)
         db.session.commit()
-        flash(f'✅ Draw "{draw.name}" has been reset. All tickets and winners deleted.', 'success')
+        # Reopens the draw when done; dense draws get their available rows back
+        start_background_purge(draw.id)
+        flash(f'✅ Draw "{draw.name}" is being reset. Winners deleted; tickets are cleared in the background.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error resetting draw: {e}', 'danger')
@@ -263,13 +483,15 @@ def delete_draw(draw_id):
     draw = Draw.query.get_or_404(draw_id)
     try:
         # Delete winners
+        WinnerSnapshot.query.filter_by(draw_id=draw.id).delete(synchronize_session=False)
         Winner.query.filter_by(draw_id=draw.id).delete(synchronize_session=False)
-        # Delete tickets
-        Ticket.query.filter_by(draw_id=draw.id).delete(synchronize_session=False)
-        # Delete the draw itself
-        db.session.delete(draw)
+        # Hide the draw everywhere; tickets, change log and finally the draw go in the background
+        draw.purge_state = 'deleting'
+        draw.is_drawn = False
+        mark_tickets_changed(draw.id)
         db.session.commit()
-        flash(f'✅ Draw "{draw.name}" and all related tickets/winners have been deleted.', 'success')
+        start_background_purge(draw.id)
+        flash(f'✅ Draw "{draw.name}" and its winners have been deleted; tickets are cleared in the background.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting draw: {e}', 'danger')
@@ -281,42 +503,162 @@ def delete_draw(draw_id):
 public_bp = Blueprint('public', __name__, template_folder='templates/public')
 
 @public_bp.route('/')
+@cached_page(lambda: all_draws_key('home'))
 def home():
-    active_draws = Draw.query.filter_by(is_active=True, is_drawn=False).order_by(Draw.created_at.desc()).all()
-    drawn_draws = Draw.query.filter_by(is_drawn=True).order_by(Draw.created_at.desc()).all()
+    active_draws = Draw.query.filter_by(is_active=True, is_drawn=False, purge_state=None).order_by(Draw.created_at.desc()).all()
+    drawn_draws = Draw.query.filter_by(is_drawn=True, purge_state=None).order_by(Draw.created_at.desc()).all()
     return render_template('home.html', draws=active_draws, drawn_draws=drawn_draws)
 
+def parse_reservation_form(form):
+    """(ticket_numbers, user_telegram_id, user_username, error) from a reservation form; no database access."""
+    # One or more numbers: repeated ticket_number fields and/or "3, 17, 42"
+    raw_numbers = ','.join(form.getlist('ticket_number'))
+    user_telegram_id = form.get('user_telegram_id')
+    user_username = form.get('user_username')
+
+    if not (raw_numbers.strip(', ') and user_telegram_id and user_username):
+        return [], None, None, ("All fields required.", "warning")
+    try:
+        ticket_numbers = sorted({int(n) for n in raw_numbers.split(',') if n.strip()})
+    except ValueError:
+        return [], None, None, ("Ticket unavailable.", "danger")
+
+    max_tickets = current_app.config['MAX_TICKETS_PER_RESERVATION']
+    if len(ticket_numbers) > max_tickets:
+        return [], None, None, (f"You can reserve at most {max_tickets} tickets at once.", "warning")
+    return ticket_numbers, user_telegram_id, user_username, None
+
+def admit_reservation(draw_id, form):
+    """
+    Admission control, before the draw is even loaded. Returns None to go on,
+    else (Rejection, ticket numbers). Form errors are left to process_reservation.
+    """
+    ticket_numbers, user_telegram_id, _, error = parse_reservation_form(form)
+    admission = current_app.extensions.get('admission')
+    if error or admission is None:
+        return None
+    rejection = admission.check(draw_id, ticket_numbers, user_telegram_id.strip())
+    return (rejection, ticket_numbers) if rejection else None
+
+def rejection_messages(rejection, ticket_numbers):
+    if rejection.reason == 'taken':
+        # Already taken as far as this worker knows: the same answer the database would give
+        return reservation_messages([], ticket_numbers)
+    return [(f"Too many attempts. Please wait {math.ceil(rejection.retry_after)} seconds and try again.", "warning")]
+
+def process_reservation(draw, form):
+    """
+    Parses and applies a reservation form. Returns (reserved, unavailable, error)
+    where error is a (message, category) pair when the form itself was invalid.
+    """
+    ticket_numbers, user_telegram_id, user_username, error = parse_reservation_form(form)
+    if error:
+        return [], [], error
+    if draw.purge_state:
+        return [], [], ("This draw is being reset. Please try again in a few minutes.", "warning")
+
+    max_pending = current_app.config['MAX_PENDING_RESERVATIONS_PER_USER']
+    if user_telegram_id.strip().isdigit():
+        pending = pending_reservation_count(draw.id, int(user_telegram_id))
+        if pending + len(ticket_numbers) > max_pending:
+            ADMISSION_DECISIONS.inc(1, 'pending_cap')
+            return [], [], (f"You already have {pending} unpaid tickets in this draw (limit {max_pending}). "
+                            "Please pay for them or wait for them to expire.", "warning")
+
+    reserved = reserve_tickets(draw, ticket_numbers, user_telegram_id, user_username)
+    unavailable = [n for n in ticket_numbers if n not in reserved]
+    return reserved, unavailable, None
+
+def reservation_messages(reserved, unavailable):
+    messages = []
+    if reserved:
+        numbers_text = ', '.join(f"#{n}" for n in reserved)
+        messages.append((f"Ticket {numbers_text} ስለመረጡ እናመሰግናለን፣እባክዎ ክፍያ በ ቴሌብር 0929467615(Temesgen) ገቢ ካደረጉ በኃላ Screenshot ይላኩልን.", "success"))
+    if unavailable:
+        messages.append((f"Ticket {', '.join(f'#{n}' for n in unavailable)} unavailable.", "danger"))
+    return messages
+
 @public_bp.route('/draw/<int:draw_id>', methods=['GET', 'POST'])
+@cached_page(draw_page_key)
 def draw_public_details(draw_id):
+    if request.method == 'POST':
+        rejected = admit_reservation(draw_id, request.form)
+        if rejected:
+            for message, category in rejection_messages(*rejected):
+                flash(message, category)
+            return redirect(url_for('public.draw_public_details', draw_id=draw_id))
     draw = Draw.query.get_or_404(draw_id)
+    if draw.purge_state == 'deleting':
+        abort(404)
     if request.method == 'POST':
-        ticket_number = request.form.get('ticket_number')
-        user_telegram_id = request.form.get('user_telegram_id')
-        user_username = request.form.get('user_username')
-
-        if not (ticket_number and user_telegram_id and user_username):
-            flash("All fields required.", "warning")
+        reserved, unavailable, error = process_reservation(draw, request.form)
+        if error:
+            flash(*error)
             return redirect(url_for('public.draw_public_details', draw_id=draw.id))
+        for message, category in reservation_messages(reserved, unavailable):
+            flash(message, category)
 
-        ticket = Ticket.query.filter_by(draw_id=draw.id, ticket_number=ticket_number, status='available').first()
-        if ticket:
-            ticket.status = 'pending_payment'
-            ticket.user_telegram_id = user_telegram_id
-            ticket.user_username = user_username
-            ticket.reserved_at = datetime.utcnow()
-            db.session.commit()
-            flash(f"Ticket #{ticket_number} ስለመረጡ እናመሰግናለን፣እባክዎ ክፍያ በ ቴሌብር 0929467615(Temesgen) ገቢ ካደረጉ በኃላ Screenshot ይላኩልን.", "success")
-        else:
-            flash("Ticket unavailable.", "danger")
-
-    tickets = Ticket.query.filter_by(draw_id=draw.id).order_by(Ticket.ticket_number).all()
     winners = Winner.query.filter_by(draw_id=draw.id).order_by(Winner.place).all()
-    return render_template('draw_public_details.html', draw=draw, tickets=tickets, winners=winners)
+    return render_template('draw_public_details.html', draw=draw, ticket_grid=ticket_grid_fragment(draw),
+                           winners=winners)
+
+@public_bp.route('/draw/<int:draw_id>/reserve', methods=['POST'])
+def draw_reserve_json(draw_id):
+    rejected = admit_reservation(draw_id, request.form)
+    if rejected:
+        rejection, ticket_numbers = rejected
+        if rejection.reason == 'taken':
+            return jsonify(ok=False, reserved=[], unavailable=ticket_numbers,
+                           messages=rejection_messages(rejection, ticket_numbers))
+        return jsonify(ok=False, messages=rejection_messages(rejection, ticket_numbers)), 429, \
+            {'Retry-After': str(math.ceil(rejection.retry_after))}
+    draw = Draw.query.get_or_404(draw_id)
+    reserved, unavailable, error = process_reservation(draw, request.form)
+    if error:
+        return jsonify(ok=False, messages=[error]), 400
+    return jsonify(ok=bool(reserved), reserved=reserved, unavailable=unavailable,
+                   messages=reservation_messages(reserved, unavailable))
+
+@public_bp.route('/draw/<int:draw_id>/grid.json')
+def draw_grid_json(draw_id):
+    draw = Draw.query.get_or_404(draw_id)
+    return jsonify(
+        draw_id=draw.id,
+        version=draw.tickets_version,
+        total=draw.total_tickets,
+        counts=draw.get_status_counts(),
+        runs=encode_grid(draw),
+    )
+
+@public_bp.route('/draw/<int:draw_id>/changes.json')
+def draw_changes_json(draw_id):
+    draw = Draw.query.get_or_404(draw_id)
+    since = request.args.get('since', 0, type=int)
+    version, changes = changes_since(draw, since)
+    if changes is None:
+        return jsonify(version=version, reload=True)
+    return jsonify(version=version, counts=draw.get_status_counts(), changes=changes)
 
 @public_bp.route('/winners')
+@cached_page(lambda: all_draws_key('winners'))
 def public_winners():
-    draws_with_winners = Draw.query.filter_by(is_drawn=True).order_by(Draw.draw_time.desc()).limit(10).all()
-    return render_template('public_winners.html', draws=draws_with_winners)
+    # First page server-rendered from the snapshot table; the rest is infinite scroll over /winners.json
+    winners, next_cursor = winner_feed(limit=current_app.config['WINNERS_PER_PAGE'])
+    return render_template('public_winners.html', winners=winners, next_cursor=next_cursor)
+
+@public_bp.route('/winners.json')
+def public_winners_json():
+    winners, next_cursor = winner_feed(request.args.get('cursor'), limit=current_app.config['WINNERS_PER_PAGE'])
+    return jsonify(next_cursor=next_cursor, winners=[{
+        'draw_id': w.draw_id,
+        'draw_name': w.draw_name,
+        'draw_time': w.draw_time.strftime('%Y-%m-%d %H:%M'),
+        'place': w.place,
+        'place_label': ordinal_suffix(w.place),
+        'prize_amount': round(w.prize_amount, 2),
+        'ticket_number': w.ticket_number,
+        'username': w.masked_username,
+    } for w in winners])
 
 
 # ---------------- Flask App Factory ----------------
@@ -332,27 +674,25 @@ def ordinal_suffix(value):
         return value
 
 def create_app():
-    global application
     app = Flask(__name__)
     app.config.from_object(config.Config)
 
-    from models import db, bcrypt, AdminUser
+    from models import db, bcrypt, migrate, AdminUser
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
     db.init_app(app)
+    init_engine_profile(app, db)
+    init_metrics(app, db)
     bcrypt.init_app(app)
+    migrate.init_app(app, db)
 
     login_manager = LoginManager(app)
     login_manager.login_view = 'admin.login'
     login_manager.login_message_category = 'info'
     init_login_manager(login_manager)
 
-    # Telegram bot setup
-    TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
-    if TOKEN:
-        from telegram.ext import Application
-        application = Application.builder().token(TOKEN).build()
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("my_tickets", my_tickets_command))
-        application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    init_response_cache(app)
+    init_admission(app)
+    init_rendering(app)
 
     # Register Blueprints
     app.register_blueprint(public_bp)
@@ -361,24 +701,239 @@ def create_app():
     # Jinja filters
     app.jinja_env.filters['ordinal'] = ordinal_suffix
 
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Apply database migrations and create the default admin (run once per deploy)."""
+        init_database(app)
+
+    @app.cli.command('seed-admin')
+    def seed_admin_command():
+        """Create the default admin user if it does not exist yet."""
+        seed_default_admin(app)
+
+    @app.cli.command('recount-tickets')
+    def recount_tickets_command():
+        """Rebuild the per-draw ticket counters from the ticket table."""
+        # Archived draws keep their counters; their claimed tickets only live in the archive now
+        draw_ids = [draw_id for (draw_id,) in db.session.query(Draw.id).filter(Draw.archived_at.is_(None)).all()]
+        Draw.recount_status_counts(draw_ids)
+        db.session.commit()
+        print(f"Recounted tickets for {len(draw_ids)} draws.")
+
+    @app.cli.command('compile-templates')
+    def compile_templates_command():
+        """Compile every template into the Jinja bytecode cache, so new workers start warm."""
+        if app.jinja_env.bytecode_cache is None:
+            raise click.ClickException("JINJA_BYTECODE_CACHE_DIR is empty: the bytecode cache is disabled.")
+        names = app.jinja_env.list_templates(extensions=('html',))
+        for name in names:
+            app.jinja_env.get_template(name)
+        print(f"Compiled {len(names)} templates into {app.config['JINJA_BYTECODE_CACHE_DIR']}.")
+
+    @app.cli.command('verify-draw')
+    @click.argument('draw_id', type=int)
+    def verify_draw_command(draw_id):
+        """Recompute a drawn draw's winners from its revealed seed."""
+        draw = db.get_or_404(Draw, draw_id)
+        if verify_draw(draw):
+            print(f"Draw {draw_id}: commitment and winners verified.")
+        else:
+            raise click.ClickException(f"Draw {draw_id} could not be verified.")
+
+    @app.cli.command('export')
+    @click.argument('kind', type=click.Choice(['tickets', 'payments', 'winners']))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv')
+    @click.option('--draw-id', type=int, default=None)
+    @click.option('--created-from', type=click.DateTime(), default=None, help='Draws created from (UTC).')
+    @click.option('--created-to', type=click.DateTime(), default=None, help='Draws created until (UTC).')
+    @click.option('--status', type=click.Choice(['pending_payment', 'approved', 'won']), default=None)
+    @click.option('--approved-from', type=click.DateTime(), default=None)
+    @click.option('--approved-to', type=click.DateTime(), default=None)
+    @click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='File (default: stdout).')
+    def export_command(kind, fmt, output, **filters):
+        """Stream tickets, payments or winners as CSV/NDJSON, one draw or many."""
+        for chunk in export_chunks(kind, fmt, {name: value for name, value in filters.items() if value}):
+            output.write(chunk)
+
+    @app.cli.command('archive-draws')
+    @click.option('--draw-id', type=int, default=None, help='Archive this drawn draw now, whatever its age.')
+    def archive_draws_command(draw_id):
+        """Move claimed tickets of finished draws into compressed archives."""
+        if draw_id is not None:
+            archived = [(draw_id, archive_draw(draw_id))]
+        else:
+            archived = archive_finished_draws(app)
+        for archived_id, ticket_count in archived:
+            print(f"Draw {archived_id}: archived {ticket_count} claimed tickets.")
+        print(f"Archived {len(archived)} draws.")
+
+    @app.cli.command('purge-draws')
+    def purge_draws_command():
+        """Finish resets/deletes whose background purge was interrupted."""
+        resumed = resume_purges()
+        for draw_id, removed in resumed:
+            print(f"Draw {draw_id}: purged {removed} tickets.")
+        print(f"Finished {len(resumed)} purges.")
+
+    @app.cli.command('check-boot-time')
+    @click.option('--budget', type=float, default=None, help='Seconds allowed (default: BOOT_TIME_BUDGET_SECONDS).')
+    @click.option('--module', default='asgi', help='Module a worker imports at boot.')
+    def check_boot_time_command(budget, module):
+        """Import the app in a fresh interpreter with -X importtime; fail over the budget."""
+        import sys
+        import time
+        import subprocess
+        budget = budget or app.config['BOOT_TIME_BUDGET_SECONDS']
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise click.ClickException(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+        # "import time: self [us] | cumulative | imported package"; two extra spaces per nesting level
+        direct_imports = []
+        for line in result.stderr.splitlines():
+            parts = line.split('|')
+            if line.startswith('import time:') and len(parts) == 3 and parts[1].strip().isdigit():
+                name = parts[2].rstrip()
+                if len(name) - len(name.lstrip()) == 3:
+                    direct_imports.append((int(parts[1]) / 1e6, name.strip()))
+        print(f"Slowest imports of {module}:")
+        for seconds, name in sorted(direct_imports, reverse=True)[:10]:
+            print(f"   {seconds:6.3f}s  {name}")
+        print(f"import {module}: {elapsed:.2f}s (budget {budget:.2f}s)")
+        if elapsed > budget:
+            raise click.ClickException(f"Worker boot took {elapsed:.2f}s, over the {budget:.2f}s budget.")
+
+    @app.cli.command('check-query-plans')
+    @click.option('--verbose', is_flag=True, help='Print every plan, not just the failures.')
+    def check_query_plans_command(verbose):
+        """EXPLAIN the hot queries; fail if any of them scans a whole table."""
+        from query_plans import check_query_plans
+        failures = 0
+        for name, plan, scans in check_query_plans():
+            if scans:
+                failures += 1
+                print(f"❌ {name}: sequential scan on {', '.join(scans)}")
+            else:
+                print(f"✅ {name}")
+            if scans or verbose:
+                print(f"   {plan}")
+        if failures:
+            raise click.ClickException(f"{failures} hot queries regressed to a sequential scan.")
+
+    @app.cli.command('check-pool')
+    @click.option('--threads', type=int, default=32, help='Concurrent clients (more than the pool holds).')
+    @click.option('--requests', 'per_thread', type=int, default=50, help='Requests per client.')
+    def check_pool_command(threads, per_thread):
+        """Hammer the public pages from many threads; fail if any request could not get a connection."""
+        import time
+        import threading
+        draw_ids = [draw_id for (draw_id,) in db.session.query(Draw.id).limit(5).all()]
+        db.session.remove()
+        paths = ['/', '/winners'] + [f'/draw/{draw_id}' for draw_id in draw_ids]
+        cache = app.extensions.pop('response_cache', None)  # Every request must reach the database
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client_loop(offset):
+            client = app.test_client()
+            for i in range(per_thread):
+                started = time.perf_counter()
+                try:
+                    status = client.get(paths[(offset + i) % len(paths)]).status_code
+                except Exception as e:
+                    status = repr(e)
+                with lock:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if status != 200:
+                        errors.append(status)
+
+        workers = [threading.Thread(target=client_loop, args=(n,)) for n in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        if cache is not None:
+            app.extensions['response_cache'] = cache
+
+        latencies.sort()
+        stats = pool_snapshot(app, db)
+        print(f"{len(latencies)} requests from {threads} threads in {elapsed:.1f}s "
+              f"(p50 {latencies[len(latencies) // 2]:.0f} ms, p95 {latencies[int(len(latencies) * 0.95)]:.0f} ms)")
+        print(f"pool: {stats['status']}")
+        print(f"peak checked out {stats.get('peak_checked_out')}, timeouts {stats.get('timeouts')}, "
+              f"avg wait {stats.get('avg_wait_ms')} ms, max wait {stats.get('wait_ms_max')} ms")
+        if errors or stats.get('timeouts'):
+            raise click.ClickException(f"{len(errors)} failed requests (e.g. {errors[:3]}), "
+                                       f"{stats.get('timeouts', 0)} pool timeouts.")
+
     @app.context_processor
     def inject_global_vars():
         return dict(datetime=datetime, timedelta=timedelta, csrf_token=generate_csrf, config=app.config)
 
-    # --- Auto-create database tables and default admin (important for Render) ---
-    with app.app_context():
-        db.create_all()
-        if not AdminUser.query.filter_by(username='admin').first():
-            admin_pass = app.config.get('ADMIN_PASSWORD', 'admin123')
-            admin_user = AdminUser(username='admin', password_raw=admin_pass)
-            db.session.add(admin_user)
-            db.session.commit()
-            print(f'✅ Default admin created: username=admin password={admin_pass}')
+    # An in-memory development database only exists inside this process, so it cannot be set up by `flask init-db`
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:///:memory:'):
+        with app.app_context():
+            init_database(app)
 
     return app
 
 
 
+def seed_default_admin(flask_app):
+    if not AdminUser.query.filter_by(username='admin').first():
+        admin_pass = flask_app.config.get('ADMIN_PASSWORD', 'admin123')
+        admin_user = AdminUser(username='admin', password_raw=admin_pass)
+        db.session.add(admin_user)
+        db.session.commit()
+        print(f'✅ Default admin created: username=admin password={admin_pass}')
+
+
+def init_database(flask_app):
+    """Migrations plus the default admin. One-shot per deploy (`flask init-db`), never on import."""
+    upgrade_schema()
+    seed_default_admin(flask_app)
+
+
+def build_telegram_application(flask_app):
+    """Builds the bot Application with its handlers, or None without TELEGRAM_BOT_TOKEN."""
+    token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    if not token:
+        return None
+
+    async def start_notification_dispatcher(bot_app):
+        # Drain the notification outbox on the bot's own event loop
+        bot_app.create_task(NotificationDispatcher(flask_app, bot_app.bot).run_forever())
+
+    builder = Application.builder().token(token)\
+                         .concurrent_updates(flask_app.config['TELEGRAM_CONCURRENT_UPDATES'])\
+                         .post_init(start_notification_dispatcher)
+    if flask_app.config.get('TELEGRAM_API_BASE_URL'):
+        builder = builder.base_url(flask_app.config['TELEGRAM_API_BASE_URL'])
+    if flask_app.config.get('TELEGRAM_API_FILE_URL'):
+        builder = builder.base_file_url(flask_app.config['TELEGRAM_API_FILE_URL'])
+    bot_app = builder.build()
+    bot_app.bot_data['flask_app'] = flask_app
+    bot_app.add_handler(CommandHandler("start", start_command))
+    bot_app.add_handler(CommandHandler("my_tickets", my_tickets_command))
+    bot_app.add_handler(CallbackQueryHandler(my_tickets_page_callback, pattern=r'^my_tickets:\d+$'))
+    bot_app.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, payment_proof_handler))
+    bot_app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    return bot_app
+
+
+def get_telegram_application():
+    """The bot Application for this process, built on first use rather than at import."""
+    global application
+    if application is None:
+        application = build_telegram_application(app)
+    return application
+
+
 # ---------------- Run App ----------------
 # ---------------- Create and Run ----------------
 app = create_app()  # ✅ Required for Render (Gunicorn looks for this)
@@ -386,15 +941,19 @@ app = create_app()  # ✅ Required for Render (Gunicorn looks for this)
 if __name__ == '__main__':
     #app = create_app()
 
-    # Start Telegram bot in a background thread
-    if application:
+    with app.app_context():
+        init_database(app)
+
+    # Start Telegram bot in a background thread (dev server only; `uvicorn asgi:app` runs it in-process)
+    application = get_telegram_application()
+    if application and app.config['TELEGRAM_MODE'] == 'polling':
         import asyncio
         import threading
 
         def start_bot():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-            loop.run_until_complete(application.run_polling())
+            application.run_polling(stop_signals=None, close_loop=False)
 
         threading.Thread(target=start_bot, daemon=True).start()
         print("✅ Telegram bot started in background")
@@ -0,0 +1,120 @@
+# asgi.py
+# Async entry point: `uvicorn asgi:app`
+# One process serves the live ticket stream (/draw/<id>/events), the Telegram
+# webhook and the Flask app (through WsgiToAsgi), and runs the bot on the same event loop.
+import hmac
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+from telegram import Update
+
+from app import app as flask_app, get_telegram_application
+from live import DrawBroadcaster, live_app, send_plain
+from notifications import NotificationDispatcher
+
+flask_app.config['LIVE_UPDATES'] = True
+
+broadcaster = DrawBroadcaster(flask_app, poll_interval=flask_app.config['LIVE_POLL_SECONDS'])
+http_app = live_app(broadcaster, WsgiToAsgi(flask_app))
+WEBHOOK_PATH = flask_app.config['TELEGRAM_WEBHOOK_PATH']
+
+
+# ---------------- Telegram Bot Lifecycle ----------------
+async def start_bot():
+    bot_app = get_telegram_application()
+    mode = flask_app.config['TELEGRAM_MODE']
+    if bot_app is None or mode == 'off':
+        return
+    await bot_app.initialize()
+    await bot_app.start()  # processes bot_app.update_queue with concurrent_updates
+    bot_app.create_task(NotificationDispatcher(flask_app, bot_app.bot).run_forever())
+
+    if mode == 'webhook':
+        webhook_url = flask_app.config.get('TELEGRAM_WEBHOOK_URL')
+        if webhook_url:
+            await bot_app.bot.set_webhook(
+                url=webhook_url.rstrip('/') + WEBHOOK_PATH,
+                secret_token=flask_app.config.get('TELEGRAM_WEBHOOK_SECRET'),
+                allowed_updates=Update.ALL_TYPES,
+            )
+        print(f"✅ Telegram bot running in webhook mode on {WEBHOOK_PATH}")
+    else:
+        await bot_app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        print("✅ Telegram bot running in polling mode")
+
+
+async def stop_bot():
+    bot_app = get_telegram_application()
+    if bot_app is None or not bot_app.running:
+        return
+    if bot_app.updater and bot_app.updater.running:
+        await bot_app.updater.stop()
+    await bot_app.stop()
+    await bot_app.shutdown()
+
+
+async def telegram_webhook(scope, receive, send):
+    bot_app = get_telegram_application()
+    if bot_app is None or flask_app.config['TELEGRAM_MODE'] != 'webhook':
+        await send_plain(send, 404, b'Not found')
+        return
+
+    headers = dict(scope.get('headers') or [])
+    expected_secret = flask_app.config.get('TELEGRAM_WEBHOOK_SECRET')
+    if expected_secret:
+        given_secret = headers.get(b'x-telegram-bot-api-secret-token', b'')
+        if not hmac.compare_digest(given_secret, expected_secret.encode('utf-8')):
+            await send_plain(send, 403, b'Forbidden')
+            return
+
+    # Updates are a few KB (files arrive as file_ids); refuse anything bigger before buffering it
+    max_bytes = flask_app.config['TELEGRAM_WEBHOOK_MAX_BYTES']
+    content_length = headers.get(b'content-length', b'')
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        await send_plain(send, 413, b'Payload too large')
+        return
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > max_bytes:
+            await send_plain(send, 413, b'Payload too large')
+            return
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    body = b''.join(chunks)
+    try:
+        update = Update.de_json(json.loads(body), bot_app.bot)
+    except (ValueError, TypeError, KeyError):
+        await send_plain(send, 400, b'Bad update')
+        return
+
+    # Acknowledge immediately; the application processes queued updates concurrently
+    await bot_app.update_queue.put(update)
+    await send_plain(send, 200, b'ok')
+
+
+# ---------------- ASGI App ----------------
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                broadcaster.start()
+                await start_bot()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await stop_bot()
+                await broadcaster.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == WEBHOOK_PATH:
+        await telegram_webhook(scope, receive, send)
+        return
+
+    await http_app(scope, receive, send)
@@ -11,7 +11,123 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///:memory:' # Use in-memory for local dev if no DATABASE_URL
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Engine profile (db_pool.py). Web workers, the scheduler and the bot thread each hold a pool,
+    # so size * processes + overflow must stay under the Postgres connection limit
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10)) # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 280)) # Render closes idle connections after ~5 minutes
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 15000)) # 0 disables
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true' # PgBouncer in transaction pooling mode
+    DB_SQLITE_WAL = os.environ.get('DB_SQLITE_WAL', 'true').lower() == 'true' # File-based SQLite in local dev
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
     ADMIN_CHAT_ID = os.environ.get('ADMIN_CHAT_ID')
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'adminpass'
-    TICKET_RESERVATION_EXPIRY_HOURS = 1
\ No newline at end of file
+    TICKET_RESERVATION_EXPIRY_HOURS = 1
+
+    # Expired-reservation sweeper (lottery_scheduler.py): tickets per transaction, and
+    # the default interval for resident mode (`python lottery_scheduler.py --every N`)
+    EXPIRY_SWEEP_BATCH_SIZE = int(os.environ.get('EXPIRY_SWEEP_BATCH_SIZE', 500))
+    EXPIRY_SWEEP_INTERVAL_SECONDS = int(os.environ.get('EXPIRY_SWEEP_INTERVAL_SECONDS', 30))
+
+    # Bulk ticket generation: rows per INSERT/COPY chunk, and the draw size above
+    # which tickets are generated in a background thread instead of the request
+    TICKET_INSERT_CHUNK_SIZE = int(os.environ.get('TICKET_INSERT_CHUNK_SIZE', 5000))
+    BACKGROUND_TICKET_GENERATION_THRESHOLD = int(os.environ.get('BACKGROUND_TICKET_GENERATION_THRESHOLD', 20000))
+
+    # 'sparse' stores only claimed tickets (availability is derived from a per-draw bitmap),
+    # 'dense' materializes one `available` row per ticket number as before
+    TICKET_STORAGE_MODE = os.environ.get('TICKET_STORAGE_MODE', 'sparse')
+
+    # Upper bound on ticket numbers claimed by a single reservation request, and on the unpaid
+    # tickets one Telegram ID may hold in a draw
+    MAX_TICKETS_PER_RESERVATION = int(os.environ.get('MAX_TICKETS_PER_RESERVATION', 10))
+    MAX_PENDING_RESERVATIONS_PER_USER = int(os.environ.get('MAX_PENDING_RESERVATIONS_PER_USER', 20))
+
+    # Admission control for reservations (admission.py), checked before any query: token buckets
+    # per Telegram ID and per client IP (mobile carriers NAT many users behind one IP, so that one is
+    # looser), and a fast reject of numbers this worker saw taken within the last max-age seconds.
+    # ADMISSION_BACKEND ("module:factory" taking the app) shares the buckets across workers.
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+    ADMISSION_USER_RATE = float(os.environ.get('ADMISSION_USER_RATE', 0.5))
+    ADMISSION_USER_BURST = int(os.environ.get('ADMISSION_USER_BURST', 5))
+    ADMISSION_IP_RATE = float(os.environ.get('ADMISSION_IP_RATE', 5))
+    ADMISSION_IP_BURST = int(os.environ.get('ADMISSION_IP_BURST', 30))
+    ADMISSION_MAX_KEYS = int(os.environ.get('ADMISSION_MAX_KEYS', 100000))
+    ADMISSION_AVAILABILITY_MAX_AGE_SECONDS = float(os.environ.get('ADMISSION_AVAILABILITY_MAX_AGE_SECONDS', 2))
+    ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND')
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0)) # 1 behind Render's proxy
+
+    # Rows per page of the admin ticket table (keyset-paginated on ticket_number)
+    ADMIN_TICKETS_PER_PAGE = int(os.environ.get('ADMIN_TICKETS_PER_PAGE', 100))
+
+    # How often the draw page asks /draw/<id>/changes.json for ticket updates
+    GRID_POLL_SECONDS = int(os.environ.get('GRID_POLL_SECONDS', 5))
+
+    # Server-Sent Events push; switched on by asgi.py when served through uvicorn
+    LIVE_UPDATES = False
+    LIVE_POLL_SECONDS = float(os.environ.get('LIVE_POLL_SECONDS', 1))
+
+    # Telegram notification outbox dispatcher (Telegram allows ~30 msg/s overall, ~1 msg/s per chat)
+    TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL') # e.g. a local fake Bot API for testing
+    TELEGRAM_API_FILE_URL = os.environ.get('TELEGRAM_API_FILE_URL') # Its file download endpoint
+    NOTIFY_GLOBAL_RATE = float(os.environ.get('NOTIFY_GLOBAL_RATE', 30))
+    NOTIFY_PER_CHAT_INTERVAL = float(os.environ.get('NOTIFY_PER_CHAT_INTERVAL', 1.0))
+    NOTIFY_BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', 100))
+    NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+    NOTIFY_IDLE_SECONDS = float(os.environ.get('NOTIFY_IDLE_SECONDS', 1.0))
+
+    # How the bot receives updates when served by asgi.py: 'polling', 'webhook' or 'off'
+    TELEGRAM_MODE = os.environ.get('TELEGRAM_MODE', 'polling')
+    TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL') # Public base URL, e.g. https://telegram-lottery.onrender.com
+    TELEGRAM_WEBHOOK_PATH = os.environ.get('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook')
+    TELEGRAM_WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+    TELEGRAM_WEBHOOK_MAX_BYTES = int(os.environ.get('TELEGRAM_WEBHOOK_MAX_BYTES', 256 * 1024)) # Larger bodies get 413
+    TELEGRAM_CONCURRENT_UPDATES = int(os.environ.get('TELEGRAM_CONCURRENT_UPDATES', 64))
+
+    # Drawn draws older than this many days have their claimed tickets moved into a compressed
+    # archive by the resident scheduler (negative disables); reset/delete purge rows in batches
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 7))
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 5000))
+
+    # Rows fetched per round trip by the streaming CSV/NDJSON exports (see exports.py)
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+
+    # Payment screenshots sent to the bot: content-addressed files under PAYMENT_PROOF_DIR (use a
+    # persistent disk in production), thumbnails made in a process pool when Pillow is installed
+    PAYMENT_PROOF_DIR = os.environ.get('PAYMENT_PROOF_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'payment_proofs')
+    PAYMENT_PROOF_MAX_BYTES = int(os.environ.get('PAYMENT_PROOF_MAX_BYTES', 10 * 1024 * 1024))
+    PAYMENT_PROOF_THUMBNAIL_PX = int(os.environ.get('PAYMENT_PROOF_THUMBNAIL_PX', 320))
+    PAYMENT_PROOF_THUMBNAIL_WORKERS = int(os.environ.get('PAYMENT_PROOF_THUMBNAIL_WORKERS', 2))
+
+    # Winner rows per page of /winners and /winners.json (infinite scroll)
+    WINNERS_PER_PAGE = int(os.environ.get('WINNERS_PER_PAGE', 30))
+
+    # Rendered public pages (home, winners, draw) cached per draw version; see response_cache.py
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512))
+    RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 300))
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') # "module:factory" taking the app, for a shared cache
+
+    # Rendering (rendering.py): compiled templates kept on disk across worker boots (empty disables),
+    # ticket-grid fragments per draw version, and gzip/brotli for text responses of at least
+    # COMPRESS_MIN_BYTES (smaller ones cost more to encode than they save on the wire)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.jinja_cache'))
+    GRID_FRAGMENT_CACHE_ENTRIES = int(os.environ.get('GRID_FRAGMENT_CACHE_ENTRIES', 32)) # 0 disables
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 1)) # On the grid markup 1 is ~2x faster than 6 and ~10% bigger
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+    COMPRESS_CACHE_MAX_ENTRIES = int(os.environ.get('COMPRESS_CACHE_MAX_ENTRIES', 256)) # Encoded bodies of cached pages
+
+    # Instrumentation (metrics.py): Prometheus text on /metrics, plus a warning log for requests
+    # slower than SLOW_REQUEST_MS or running more than N_PLUS_ONE_QUERY_THRESHOLD SQL statements
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # If set, scrapers must send "Authorization: Bearer <token>"
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    N_PLUS_ONE_QUERY_THRESHOLD = int(os.environ.get('N_PLUS_ONE_QUERY_THRESHOLD', 20))
+
+    # `flask check-boot-time` fails when importing the app in a fresh worker takes longer than this
+    BOOT_TIME_BUDGET_SECONDS = float(os.environ.get('BOOT_TIME_BUDGET_SECONDS', 2.0))
@@ -0,0 +1,145 @@
+# db_pool.py
+import time
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, NullPool
+
+
+# ---------------- Metrics ----------------
+class PoolMetrics:
+    """Checkout counters and queue wait times of one engine's pool."""
+
+    def __init__(self):
+        self.stats = {'connects': 0, 'checkouts': 0, 'checkins': 0, 'invalidations': 0, 'timeouts': 0,
+                      'waits': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0, 'peak_checked_out': 0}
+        self.checked_out = 0
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+            if name == 'checkouts':
+                self.checked_out += 1
+                self.stats['peak_checked_out'] = max(self.stats['peak_checked_out'], self.checked_out)
+            elif name == 'checkins':
+                self.checked_out -= 1
+
+    def record_wait(self, elapsed_ms):
+        with self._lock:
+            self.stats['waits'] += 1
+            self.stats['wait_ms_total'] += elapsed_ms
+            self.stats['wait_ms_max'] = max(self.stats['wait_ms_max'], elapsed_ms)
+
+    def snapshot(self, pool):
+        with self._lock:
+            stats = dict(self.stats, checked_out=self.checked_out)
+        stats['avg_wait_ms'] = round(stats['wait_ms_total'] / stats['waits'], 2) if stats['waits'] else 0.0
+        stats['wait_ms_total'] = round(stats['wait_ms_total'], 1)
+        stats['wait_ms_max'] = round(stats['wait_ms_max'], 1)
+        stats['pool_class'] = type(pool).__name__
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), overflow=pool.overflow(), checked_in=pool.checkedin(),
+                         max_overflow=pool._max_overflow, timeout=pool.timeout())
+        return stats
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a free connection."""
+
+    metrics = None  # Set by init_engine_profile
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            if self.metrics:
+                self.metrics.count('timeouts')
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.record_wait((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+# ---------------- Engine Profile ----------------
+def engine_options(config):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the configured database:
+      - PostgreSQL: a bounded QueuePool with pre-ping and recycle (Render drops idle
+        connections), plus a per-connection statement_timeout.
+      - PostgreSQL behind PgBouncer in transaction pooling mode (DB_PGBOUNCER=true):
+        no client-side pool, and the timeout is set per transaction instead.
+      - SQLite files: the default QueuePool, timed; WAL is switched on at connect.
+        In-memory SQLite keeps Flask-SQLAlchemy's single shared connection.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        return {'poolclass': TimedQueuePool} if url.database not in (None, '', ':memory:') else {}
+    if url.get_backend_name() != 'postgresql':
+        return {}
+    if config['DB_PGBOUNCER']:
+        # PgBouncer owns the pool; server connections are shared between transactions,
+        # so nothing session-scoped (startup options, SET) may be sent
+        return {'poolclass': NullPool, 'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if config['DB_STATEMENT_TIMEOUT_MS'] and url.get_driver_name() in ('psycopg2', 'psycopg'):
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets the web worker read while the scheduler or bot thread writes
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+
+def init_engine_profile(flask_app, db):
+    """Hooks pool metrics, SQLite WAL and PgBouncer statement timeouts onto the app's engine."""
+    with flask_app.app_context():
+        engine = db.engine
+    config = flask_app.config
+    metrics = PoolMetrics()
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics = metrics
+    event.listen(engine.pool, 'connect', lambda *args: metrics.count('connects'))
+    event.listen(engine.pool, 'checkout', lambda *args: metrics.count('checkouts'))
+    event.listen(engine.pool, 'checkin', lambda *args: metrics.count('checkins'))
+    event.listen(engine.pool, 'invalidate', lambda *args: metrics.count('invalidations'))
+
+    if engine.dialect.name == 'sqlite' and config['DB_SQLITE_WAL'] and engine.url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'connect', _enable_sqlite_wal)
+
+    if engine.dialect.name == 'postgresql' and config['DB_PGBOUNCER'] and config['DB_STATEMENT_TIMEOUT_MS']:
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(connection):
+            # SET LOCAL ends with the transaction, so it never leaks to another PgBouncer client
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(config['DB_STATEMENT_TIMEOUT_MS'])}")
+
+    flask_app.extensions['pool_metrics'] = metrics
+    return metrics
+
+
+def pool_snapshot(flask_app, db):
+    metrics = flask_app.extensions.get('pool_metrics')
+    pool = db.engine.pool
+    stats = metrics.snapshot(pool) if metrics else {'pool_class': type(pool).__name__}
+    stats['status'] = pool.status()
+    return stats
@@ -0,0 +1,235 @@
+# draw_archive.py
+import json
+import zlib
+import hashlib
+import threading
+from functools import partial
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, select, update, or_
+
+from models import db, Draw, Ticket, TicketEvent, Winner, WinnerSnapshot, DrawArchive, PaymentProofTicket
+
+ARCHIVE_FORMAT = 1
+PURGE_LEASE_SECONDS = 60
+
+
+# ---------------- Chunked Purge ----------------
+def _purge_rows(model, draw_id, batch_size, keep_ids=(), on_batch=None):
+    """Deletes a draw's rows of `model` in batches, one short transaction each."""
+    table = model.__table__
+    removed = 0
+    while True:
+        query = select(table.c.id).where(table.c.draw_id == draw_id)
+        if keep_ids:
+            query = query.where(table.c.id.notin_(keep_ids))
+        ids = list(db.session.execute(query.limit(batch_size)).scalars())
+        if not ids:
+            return removed
+        db.session.execute(delete(table).where(table.c.id.in_(ids)))
+        if on_batch:
+            on_batch()
+        db.session.commit()
+        removed += len(ids)
+
+
+def purge_draw_rows(draw_id, batch_size=None, keep_ticket_ids=(), on_batch=None):
+    """Removes a draw's tickets and change log in bounded batches. Returns the tickets removed."""
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+    removed = _purge_rows(Ticket, draw_id, batch_size, keep_ticket_ids, on_batch)
+    _purge_rows(TicketEvent, draw_id, batch_size, on_batch=on_batch)
+    return removed
+
+
+def _extend_purge_lease(draw_id, expired_only=False):
+    """Pushes the draw's purge lease forward; with expired_only, only if nobody holds it. Returns success."""
+    now = datetime.utcnow()
+    table = Draw.__table__
+    statement = update(table).where(table.c.id == draw_id, table.c.purge_state.isnot(None))
+    if expired_only:
+        statement = statement.where(or_(table.c.purge_lease_until.is_(None), table.c.purge_lease_until < now))
+    statement = statement.values(purge_lease_until=now + timedelta(seconds=PURGE_LEASE_SECONDS))
+    return db.session.execute(statement).rowcount == 1
+
+
+def claim_purge(draw_id):
+    """
+    Takes the purge lease of a draw being reset or deleted, in one conditional UPDATE, so only
+    one thread in one process purges it at a time. The owner renews the lease with every batch;
+    an owner that died lets it lapse after PURGE_LEASE_SECONDS and the scheduler picks the draw up.
+    """
+    claimed = _extend_purge_lease(draw_id, expired_only=True)
+    db.session.commit()
+    return claimed
+
+
+def finish_purge(draw_id):
+    """
+    Completes a reset or delete started by the admin: purges the rows in batches, then
+    either removes the draw or reopens it (regenerating available rows for dense draws).
+    Safe to run again after an interruption. Returns the tickets removed, or None when
+    there is nothing to purge or another purge of the draw holds its lease.
+    """
+    from ticket_store import generate_tickets, mark_tickets_changed
+    if not claim_purge(draw_id):
+        return None
+    draw = db.session.get(Draw, draw_id)
+    renew = partial(_extend_purge_lease, draw_id)
+    removed = purge_draw_rows(draw_id, on_batch=renew)
+    # Proof links are keyed by ticket number, so they must not outlive the tickets (the files stay)
+    _purge_rows(PaymentProofTicket, draw_id, current_app.config['PURGE_BATCH_SIZE'], on_batch=renew)
+    DrawArchive.query.filter_by(draw_id=draw_id).delete(synchronize_session=False)
+    _archived_claims_cache.pop(draw_id, None)
+
+    if draw.purge_state == 'deleting':
+        db.session.delete(draw)
+        db.session.commit()
+        return removed
+
+    # Recount rather than trust the zeroed counters: a write that raced the reset must not leave them off
+    Draw.recount_status_counts([draw_id])
+    draw.purge_state = None
+    draw.purge_lease_until = None
+    mark_tickets_changed(draw_id, [(None, 'reset')])  # Drop grids built while old rows were still there
+    db.session.commit()
+    if not draw.sparse_tickets:
+        generate_tickets(draw_id)
+    return removed
+
+
+def start_background_purge(draw_id):
+    """Runs finish_purge in a daemon thread with its own app context."""
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                removed = finish_purge(draw_id)
+                if removed is not None:
+                    print(f"Draw {draw_id}: purged {removed} tickets")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Purge of draw {draw_id} failed: {e}")
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, name=f"draw-purge-{draw_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+def resume_purges(limit=None):
+    """Finishes resets/deletes whose purge lease has lapsed (interrupted purges). Returns [(draw_id, removed)]."""
+    query = db.session.query(Draw.id)\
+                      .filter(Draw.purge_state.isnot(None),
+                              or_(Draw.purge_lease_until.is_(None), Draw.purge_lease_until < datetime.utcnow()))\
+                      .order_by(Draw.id)
+    if limit:
+        query = query.limit(limit)
+    resumed = []
+    for (draw_id,) in query.all():
+        removed = finish_purge(draw_id)
+        if removed is not None:
+            resumed.append((draw_id, removed))
+    return resumed
+
+
+# ---------------- Archive ----------------
+def _archive_lines(draw):
+    """NDJSON: one header line (draw and winners), then one line per claimed ticket in number order."""
+    winners = WinnerSnapshot.query.filter_by(draw_id=draw.id).order_by(WinnerSnapshot.place).all()
+    yield {
+        'format': ARCHIVE_FORMAT,
+        'draw': {'id': draw.id, 'name': draw.name, 'total_tickets': draw.total_tickets,
+                 'ticket_price': draw.ticket_price, 'prize_tiers': draw.prize_tiers,
+                 'draw_time': draw.draw_time.isoformat() if draw.draw_time else None,
+                 'approved_at_draw': draw.approved_at_draw},
+        'winners': [{'place': w.place, 'ticket_number': w.ticket_number, 'prize_amount': w.prize_amount,
+                     'masked_username': w.masked_username} for w in winners],
+    }
+    tickets = db.session.query(Ticket.ticket_number, Ticket.status, Ticket.user_telegram_id, Ticket.user_username,
+                               Ticket.reserved_at, Ticket.approved_at)\
+                        .filter(Ticket.draw_id == draw.id, Ticket.status != 'available')\
+                        .order_by(Ticket.ticket_number)\
+                        .yield_per(5000)
+    for number, status, user_telegram_id, username, reserved_at, approved_at in tickets:
+        yield {'n': number, 's': status, 'u': user_telegram_id, 'un': username,
+               'r': reserved_at.isoformat() if reserved_at else None,
+               'a': approved_at.isoformat() if approved_at else None}
+
+
+def archive_draw(draw_id):
+    """
+    Compacts a drawn draw: its claimed tickets and winners go into one compressed
+    DrawArchive row, then the ticket rows leave the hot table in batches. Winning
+    tickets stay, since Winner rows point at them. Returns the tickets archived.
+    """
+    draw = db.session.get(Draw, draw_id)
+    if draw is None or not draw.is_drawn or draw.archived_at or draw.purge_state:
+        return 0
+    compressor = zlib.compressobj(9)
+    digest = hashlib.sha256()
+    chunks, ticket_count = [], -1
+    for line in _archive_lines(draw):
+        data = (json.dumps(line, separators=(',', ':')) + '\n').encode('utf-8')
+        digest.update(data)
+        chunks.append(compressor.compress(data))
+        ticket_count += 1
+    chunks.append(compressor.flush())
+
+    db.session.add(DrawArchive(draw_id=draw.id, format=ARCHIVE_FORMAT, ticket_count=ticket_count,
+                               payload=b''.join(chunks), sha256=digest.hexdigest()))
+    draw.archived_at = datetime.utcnow()
+    db.session.commit()
+
+    winning_ids = [ticket_id for (ticket_id,) in db.session.query(Winner.ticket_id).filter(Winner.draw_id == draw_id)]
+    purge_draw_rows(draw_id, keep_ticket_ids=winning_ids)
+    return ticket_count
+
+
+def archive_finished_draws(flask_app, limit=None):
+    """Archives draws drawn more than ARCHIVE_AFTER_DAYS ago. Returns [(draw_id, tickets archived)]."""
+    days = flask_app.config['ARCHIVE_AFTER_DAYS']
+    if days < 0:
+        return []
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    query = db.session.query(Draw.id)\
+                      .filter(Draw.is_drawn.is_(True), Draw.archived_at.is_(None), Draw.purge_state.is_(None),
+                              Draw.draw_time < cutoff)\
+                      .order_by(Draw.draw_time)
+    if limit:
+        query = query.limit(limit)
+    return [(draw_id, archive_draw(draw_id)) for (draw_id,) in query.all()]
+
+
+def read_archive(draw_id):
+    """Yields the archived NDJSON records of a draw (header first), decompressing as it goes."""
+    archive = DrawArchive.query.filter_by(draw_id=draw_id).one()
+    decompressor = zlib.decompressobj()
+    pending = b''
+    payload = archive.payload
+    for start in range(0, len(payload), 1 << 16):
+        pending += decompressor.decompress(payload[start:start + (1 << 16)])
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield json.loads(line)
+    pending += decompressor.flush()
+    if pending.strip():
+        yield json.loads(pending)
+
+
+# draw_id -> {ticket_number: status}; archives never change, so there is nothing to invalidate but purges
+_archived_claims_cache = {}
+ARCHIVE_CACHE_SIZE = 16
+
+
+def archived_claims(draw):
+    """{ticket_number: status} of an archived draw, read back from its archive."""
+    claims = _archived_claims_cache.get(draw.id)
+    if claims is None:
+        claims = {record['n']: record['s'] for record in read_archive(draw.id) if 'n' in record}
+        if len(_archived_claims_cache) >= ARCHIVE_CACHE_SIZE:
+            _archived_claims_cache.pop(next(iter(_archived_claims_cache)))
+        _archived_claims_cache[draw.id] = claims
+    return claims
@@ -0,0 +1,226 @@
+# draw_engine.py
+import hmac
+import hashlib
+import secrets
+from datetime import datetime
+
+from sqlalchemy import update, and_, or_
+
+from models import db, Draw, Ticket, Winner, WinnerSnapshot
+from ticket_store import mark_tickets_changed
+from draw_archive import archived_claims
+
+
+class DrawError(Exception):
+    """Raised when a draw cannot be executed; the message is shown to the admin."""
+
+
+# ---------------- Commitment ----------------
+def new_server_seed():
+    return secrets.token_hex(32)
+
+
+def seed_commitment(server_seed):
+    """Published before sales start; revealing the seed later proves it was not changed."""
+    return hashlib.sha256(server_seed.encode('ascii')).hexdigest()
+
+
+def assign_new_seed(draw):
+    draw.server_seed = new_server_seed()
+    draw.seed_commitment = seed_commitment(draw.server_seed)
+
+
+# ---------------- Prize Tiers ----------------
+def parse_prize_tiers(text):
+    """'40, 20, 10' -> [0.4, 0.2, 0.1]. Raises ValueError on anything else."""
+    try:
+        tiers = [float(part) for part in (text or '').split(',') if part.strip()]
+    except ValueError:
+        raise ValueError("Prize tiers must be numbers separated by commas, e.g. 40,20,10.")
+    if not tiers:
+        raise ValueError("At least one prize tier is required.")
+    if any(tier <= 0 for tier in tiers):
+        raise ValueError("Prize tiers must be positive percentages.")
+    if sum(tiers) > 100:
+        raise ValueError("Prize tiers cannot add up to more than 100%.")
+    return [tier / 100 for tier in tiers]
+
+
+# ---------------- Selection ----------------
+def winning_offsets(server_seed, draw_id, population, count):
+    """
+    Deterministic, unbiased sample of `count` distinct offsets in [0, population).
+
+    Each candidate is HMAC-SHA256(seed, "draw_id:population:counter") read as a
+    256-bit integer, with rejection sampling to avoid modulo bias. Anyone with
+    the revealed seed and the published approved-ticket count can recompute it.
+    """
+    count = min(count, population)
+    key = bytes.fromhex(server_seed)
+    space = 1 << 256
+    limit = space - (space % population)
+    offsets = []
+    counter = 0
+    while len(offsets) < count:
+        message = f"{draw_id}:{population}:{counter}".encode('ascii')
+        counter += 1
+        value = int.from_bytes(hmac.new(key, message, hashlib.sha256).digest(), 'big')
+        if value >= limit:
+            continue
+        offset = value % population
+        if offset not in offsets:
+            offsets.append(offset)
+    return offsets
+
+
+def approved_ticket_count(draw_id):
+    return db.session.query(db.func.count(Ticket.id))\
+                     .filter(Ticket.draw_id == draw_id, Ticket.status == 'approved')\
+                     .scalar()
+
+
+def approved_ticket_at(draw_id, offset):
+    """
+    The offset-th approved ticket in ticket_number order, read through the index without loading
+    the rest; None when there are not that many (approved tickets were removed since counting).
+    """
+    return Ticket.query.filter(Ticket.draw_id == draw_id, Ticket.status == 'approved')\
+                       .order_by(Ticket.ticket_number)\
+                       .offset(offset)\
+                       .limit(1)\
+                       .first()
+
+
+def execute_draw(draw):
+    """
+    Selects and stores the winners of a draw and reveals its seed. Returns the
+    list of (Winner, Ticket). Caller commits.
+    """
+    if draw.purge_state:
+        raise DrawError('This draw is still being reset; try again once its tickets are cleared.')
+    if not draw.server_seed:
+        # Draws created before commitments existed: still reproducible, just not pre-committed
+        assign_new_seed(draw)
+    tiers = parse_prize_tiers(draw.prize_tiers)
+
+    # Claim the draw before counting, so two admins cannot execute it twice. The UPDATE row-locks the
+    # draw until the caller commits; payment changes take the same lock first (ticket_store.lock_draws),
+    # so the approved set cannot move between the count and the winners' OFFSET reads below
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Draw.__table__)
+        .where(Draw.id == draw.id, Draw.is_drawn.is_(False), Draw.purge_state.is_(None))
+        .values(is_drawn=True, draw_time=now)
+    ).rowcount
+    if not claimed:
+        raise DrawError('Draw already executed!')
+    approved_count = approved_ticket_count(draw.id)
+    if approved_count < 1:
+        raise DrawError('No approved tickets to draw winners!')
+    db.session.execute(update(Draw.__table__).where(Draw.id == draw.id).values(approved_at_draw=approved_count))
+
+    total_prize_pool = draw.ticket_price * approved_count
+    offsets = winning_offsets(draw.server_seed, draw.id, approved_count, len(tiers))
+    results = []
+    for place, offset in enumerate(offsets, start=1):
+        ticket = approved_ticket_at(draw.id, offset)
+        if ticket is None:
+            raise DrawError('Payments changed while the winners were drawn; please execute the draw again.')
+        winner = Winner(
+            place=place,
+            prize_amount=round(total_prize_pool * tiers[place - 1], 2),
+            ticket_id=ticket.id,
+            draw_id=draw.id,
+            won_at=now
+        )
+        db.session.add(winner)
+        results.append((winner, ticket))
+    # Backends without row locks: the offsets must still index the set that was counted
+    if approved_ticket_count(draw.id) != approved_count:
+        raise DrawError('Payments changed while the winners were drawn; please execute the draw again.')
+    db.session.flush()
+    snapshot_winners(draw, results, now)
+    # New version: cached pages and live viewers pick up the result
+    mark_tickets_changed(draw.id, [(None, 'drawn')])
+    return results
+
+
+# ---------------- Winner Snapshots ----------------
+def mask_username(username, telegram_id=None):
+    """'@abcdef' -> '@ab***ef'; falls back to a masked Telegram ID."""
+    if username:
+        name = username.lstrip('@')
+        return '@' + (name[:2] + '***' + name[-2:] if len(name) > 4 else name[:1] + '***')
+    digits = str(telegram_id or '')
+    return digits[:2] + '****' + digits[-2:] if len(digits) > 4 else '****'
+
+
+def snapshot_winners(draw, results, draw_time):
+    """Writes the public WinnerSnapshot rows for freshly drawn winners. Caller commits."""
+    for winner, ticket in results:
+        db.session.add(WinnerSnapshot(
+            winner_id=winner.id,
+            draw_id=draw.id,
+            draw_name=draw.name,
+            draw_time=draw_time,
+            place=winner.place,
+            prize_amount=winner.prize_amount,
+            ticket_number=ticket.ticket_number,
+            masked_username=mask_username(ticket.user_username, ticket.user_telegram_id),
+        ))
+
+
+def encode_feed_cursor(snapshot):
+    return f"{snapshot.draw_time.strftime('%Y%m%d%H%M%S%f')}-{snapshot.draw_id}-{snapshot.place}"
+
+
+def decode_feed_cursor(cursor):
+    """Returns (draw_time, draw_id, place), or None for a missing or malformed cursor."""
+    try:
+        stamp, draw_id, place = cursor.split('-')
+        return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(draw_id), int(place)
+    except (AttributeError, ValueError):
+        return None
+
+
+def winner_feed(cursor=None, limit=30):
+    """
+    Winners newest draw first (places in order within a draw), keyset-paginated
+    over the (draw_time, draw_id, place) index. Returns (snapshots, next_cursor).
+    """
+    query = WinnerSnapshot.query
+    position = decode_feed_cursor(cursor) if cursor else None
+    if position:
+        draw_time, draw_id, place = position
+        query = query.filter(or_(
+            WinnerSnapshot.draw_time < draw_time,
+            and_(WinnerSnapshot.draw_time == draw_time, WinnerSnapshot.draw_id < draw_id),
+            and_(WinnerSnapshot.draw_time == draw_time, WinnerSnapshot.draw_id == draw_id,
+                 WinnerSnapshot.place > place),
+        ))
+    rows = query.order_by(WinnerSnapshot.draw_time.desc(), WinnerSnapshot.draw_id.desc(), WinnerSnapshot.place)\
+                .limit(limit + 1)\
+                .all()
+    next_cursor = encode_feed_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def verify_draw(draw):
+    """Recomputes the winning ticket numbers from the revealed seed; compares them to the stored winners."""
+    if not draw.is_drawn or not draw.approved_at_draw:
+        return False
+    if seed_commitment(draw.server_seed) != draw.seed_commitment:
+        return False
+    offsets = winning_offsets(draw.server_seed, draw.id, draw.approved_at_draw, len(parse_prize_tiers(draw.prize_tiers)))
+    if draw.archived_at:
+        # Only the winning rows are left in the ticket table; the rest is read back from the archive
+        approved = sorted(number for number, status in archived_claims(draw).items() if status == 'approved')
+        expected = [approved[offset] for offset in offsets]
+    else:
+        tickets = [approved_ticket_at(draw.id, offset) for offset in offsets]
+        if None in tickets:
+            return False
+        expected = [ticket.ticket_number for ticket in tickets]
+    stored = [winner.ticket.ticket_number for winner in
+              Winner.query.filter_by(draw_id=draw.id).order_by(Winner.place).all()]
+    return expected == stored
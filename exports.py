@@ -0,0 +1,133 @@
+# exports.py
+# Streaming CSV/NDJSON exports for accounting: rows are read with yield_per (a server-side
+# cursor on PostgreSQL) and written out in small chunks, so memory stays flat whatever the size.
+import io
+import csv
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Draw, Ticket, Winner
+from draw_archive import read_archive
+
+EXPORT_COLUMNS = {
+    'tickets': ('draw_id', 'draw_name', 'ticket_number', 'status', 'user_telegram_id', 'user_username',
+                'reserved_at', 'approved_at'),
+    'payments': ('draw_id', 'draw_name', 'ticket_number', 'status', 'user_telegram_id', 'user_username',
+                 'approved_at', 'amount'),
+    'winners': ('draw_id', 'draw_name', 'draw_time', 'place', 'ticket_number', 'user_telegram_id', 'user_username',
+                'prize_amount', 'won_at'),
+}
+CHUNK_BYTES = 64 * 1024
+
+
+# ---------------- Rows ----------------
+def _export_draws(filters):
+    """Draws in scope: one draw, or every draw created in the window. Small, so read at once."""
+    query = db.session.query(Draw.id, Draw.name, Draw.ticket_price, Draw.draw_time, Draw.archived_at)\
+                      .filter(Draw.purge_state.is_(None))
+    if filters.get('draw_id'):
+        query = query.filter(Draw.id == filters['draw_id'])
+    if filters.get('created_from'):
+        query = query.filter(Draw.created_at >= filters['created_from'])
+    if filters.get('created_to'):
+        query = query.filter(Draw.created_at <= filters['created_to'])
+    return query.order_by(Draw.id).all()
+
+
+def _approved_in_window(approved_at, filters):
+    if filters.get('approved_from') and (approved_at is None or approved_at < filters['approved_from']):
+        return False
+    if filters.get('approved_to') and (approved_at is None or approved_at > filters['approved_to']):
+        return False
+    return True
+
+
+def _draw_tickets(draw, statuses, filters):
+    """(number, status, telegram id, username, reserved_at, approved_at) of one draw, in number order."""
+    if draw.archived_at:
+        # Only winning rows are left in the table; the archive has them all, already in number order
+        for record in read_archive(draw.id):
+            if 'n' not in record or (statuses and record['s'] not in statuses):
+                continue
+            reserved_at = datetime.fromisoformat(record['r']) if record['r'] else None
+            approved_at = datetime.fromisoformat(record['a']) if record['a'] else None
+            if _approved_in_window(approved_at, filters):
+                yield record['n'], record['s'], record['u'], record['un'], reserved_at, approved_at
+        return
+    query = select(Ticket.ticket_number, Ticket.status, Ticket.user_telegram_id, Ticket.user_username,
+                   Ticket.reserved_at, Ticket.approved_at)\
+        .where(Ticket.draw_id == draw.id)\
+        .order_by(Ticket.ticket_number)\
+        .execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE'])
+    query = query.where(Ticket.status.in_(statuses)) if statuses else query.where(Ticket.status != 'available')
+    if filters.get('approved_from'):
+        query = query.where(Ticket.approved_at >= filters['approved_from'])
+    if filters.get('approved_to'):
+        query = query.where(Ticket.approved_at <= filters['approved_to'])
+    yield from db.session.execute(query)
+
+
+def export_rows(kind, filters):
+    """Yields one tuple per row, in EXPORT_COLUMNS[kind] order."""
+    wanted = filters.get('status')
+    if kind == 'payments':
+        # Paid tickets: approved, including the ones that went on to win
+        statuses = tuple(status for status in ('approved', 'won') if not wanted or status == wanted)
+        if not statuses:
+            return
+    else:
+        statuses = (wanted,) if wanted else ()
+
+    for draw in _export_draws(filters):
+        if kind == 'tickets':
+            for number, status, user_id, username, reserved_at, approved_at in _draw_tickets(draw, statuses, filters):
+                yield draw.id, draw.name, number, status, user_id, username, reserved_at, approved_at
+        elif kind == 'payments':
+            for number, status, user_id, username, _, approved_at in _draw_tickets(draw, statuses, filters):
+                yield draw.id, draw.name, number, status, user_id, username, approved_at, draw.ticket_price
+        else:
+            winners = db.session.query(Winner.place, Ticket.ticket_number, Ticket.user_telegram_id,
+                                       Ticket.user_username, Winner.prize_amount, Winner.won_at, Ticket.approved_at)\
+                                .join(Ticket, Ticket.id == Winner.ticket_id)\
+                                .filter(Winner.draw_id == draw.id)\
+                                .order_by(Winner.place)
+            for place, number, user_id, username, prize_amount, won_at, approved_at in winners:
+                if _approved_in_window(approved_at, filters):
+                    yield draw.id, draw.name, draw.draw_time, place, number, user_id, username, prize_amount, won_at
+
+
+# ---------------- Encoding ----------------
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_chunks(kind, fmt, filters):
+    """The export as text chunks of about CHUNK_BYTES; the first (CSV header) comes before any query runs."""
+    columns = EXPORT_COLUMNS[kind]
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = lambda row: writer.writerow(['' if value is None else _value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    else:
+        write = lambda row: buffer.write(
+            json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False, separators=(',', ':')) + '\n')
+    for row in export_rows(kind, filters):
+        write(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_filename(kind, fmt, filters):
+    scope = f"draw{filters['draw_id']}" if filters.get('draw_id') else 'all'
+    return f"{kind}-{scope}-{datetime.utcnow():%Y%m%d%H%M%S}.{fmt}"
@@ -1,6 +1,6 @@
 # forms.py
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, IntegerField, FloatField, SelectField
+from wtforms import StringField, PasswordField, SubmitField, IntegerField, FloatField, SelectField, DateTimeLocalField
 from wtforms.validators import DataRequired, NumberRange, Optional, Length, Regexp, ValidationError # Added Optional, Length, Regexp
 
 # --- Consolidated CSRFOnlyForm ---
@@ -19,8 +19,17 @@ class CreateDrawForm(FlaskForm):
     name = StringField('Draw Name', validators=[DataRequired()])
     total_tickets = IntegerField('Number of Tickets Available', validators=[DataRequired(), NumberRange(min=1)])
     ticket_price = FloatField('Ticket Price ($)', validators=[DataRequired(), NumberRange(min=0.01)])
+    prize_tiers = StringField('Prize Tiers (% of pot per place, comma separated)', default='40,20,10',
+                              validators=[DataRequired()])
     submit = SubmitField('Create Draw')
 
+    def validate_prize_tiers(self, field):
+        from draw_engine import parse_prize_tiers
+        try:
+            parse_prize_tiers(field.data)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
 class ReserveTicketForm(FlaskForm):
     ticket_number = SelectField(
         'Ticket Number',coerce=str,
@@ -37,4 +46,33 @@ class ReserveTicketForm(FlaskForm):
     #     from .models import User # Import here to avoid circular imports
     #     user = User.query.filter_by(telegram_id=field.data).first()
     #     if user and user.id != current_user.id: # If current_user is relevant, adjust
-    #         raise ValidationError('This Telegram ID is already registered to another user.')
\ No newline at end of file
+    #         raise ValidationError('This Telegram ID is already registered to another user.')
+
+class TicketFilterForm(FlaskForm):
+    """GET filters for the admin ticket table (no CSRF: it only reads)."""
+    class Meta:
+        csrf = False
+
+    status = SelectField('Status', choices=[('', 'Any status'), ('available', 'Available'),
+                                            ('pending_payment', 'Pending Payment'), ('approved', 'Approved'),
+                                            ('won', 'Won')], validators=[Optional()])
+    username = StringField('Username', validators=[Optional(), Length(max=80)])
+    telegram_id = StringField('Telegram ID', validators=[Optional(), Regexp(r'^\d+$', message='Digits only')])
+    reserved_from = DateTimeLocalField('Reserved From', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    reserved_to = DateTimeLocalField('Reserved To', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+
+class ExportForm(FlaskForm):
+    """GET parameters of the streaming CSV/NDJSON export (no CSRF: it only reads)."""
+    class Meta:
+        csrf = False
+
+    kind = SelectField('Export', choices=[('tickets', 'Tickets'), ('payments', 'Payments'), ('winners', 'Winners')],
+                       default='tickets')
+    format = SelectField('Format', choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], default='csv')
+    draw_id = IntegerField('Draw', validators=[Optional()])
+    created_from = DateTimeLocalField('Draws Created From', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    created_to = DateTimeLocalField('Draws Created To', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    status = SelectField('Status', choices=[('', 'Any claimed'), ('pending_payment', 'Pending Payment'),
+                                            ('approved', 'Approved'), ('won', 'Won')], validators=[Optional()])
+    approved_from = DateTimeLocalField('Approved From', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    approved_to = DateTimeLocalField('Approved To', format='%Y-%m-%dT%H:%M', validators=[Optional()])
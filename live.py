@@ -0,0 +1,277 @@
+# live.py
+import re
+import json
+import time
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+from models import db, Draw, TicketEvent
+from ticket_store import STATUS_CODES, changes_since
+
+# ---------------- Live Ticket Updates (Server-Sent Events) ----------------
+EVENTS_PATH = re.compile(r'^/draw/(\d+)/events$')
+HEARTBEAT_SECONDS = 15
+
+
+def sse_message(payload, event='tickets'):
+    data = json.dumps(payload, separators=(',', ':'))
+    return f"id: {payload.get('version', '')}\nevent: {event}\ndata: {data}\n\n".encode('utf-8')
+
+
+class DrawBroadcaster:
+    """
+    Fans TicketEvent rows out to every SSE watcher of a draw.
+
+    Web routes and the scheduler already write a TicketEvent for every
+    change, so a single poller per worker reads the new rows (one indexed
+    `id > last_seen` query per interval, no matter how many people watch),
+    encodes one message per changed draw and hands the same bytes to each
+    subscriber queue. Slow consumers get a reload message instead of an
+    ever-growing backlog.
+    """
+
+    def __init__(self, flask_app, poll_interval=1.0, queue_size=64, batch_size=10000):
+        self.app = flask_app
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.subscribers = defaultdict(set)  # draw_id -> {asyncio.Queue}
+        self.last_event_id = None
+        self._task = None
+        self.stats = {
+            'messages_sent': 0,
+            'slow_consumers_reset': 0,
+            'polls': 0,
+            'last_fanout_ms': 0.0,
+            'last_event_latency_ms': 0.0,
+        }
+
+    # --- subscriptions ---
+    def subscribe(self, draw_id, after_event_id):
+        """
+        `after_event_id` is the last TicketEvent the watcher's catch-up covered; the
+        poller rewinds to it if it has already read past, so nothing in between is lost.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[draw_id].add(queue)
+        if self.last_event_id is None or after_event_id < self.last_event_id:
+            self.last_event_id = after_event_id
+        self.start()
+        return queue
+
+    def unsubscribe(self, draw_id, queue):
+        watchers = self.subscribers.get(draw_id)
+        if watchers is not None:
+            watchers.discard(queue)
+            if not watchers:
+                del self.subscribers[draw_id]
+
+    def connection_count(self):
+        return sum(len(watchers) for watchers in self.subscribers.values())
+
+    # --- poller ---
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            try:
+                # Positions are only moved here and in subscribe(), both on the event loop
+                if self.subscribers:
+                    start = self.last_event_id
+                    batches, last_id = await asyncio.to_thread(self._fetch, start, set(self.subscribers))
+                    # A watcher that subscribed meanwhile may have rewound the position to its catch-up
+                    self.last_event_id = last_id if self.last_event_id == start else min(last_id, self.last_event_id)
+                    self._publish(batches)
+                else:
+                    # Nobody watching: keep up with the log anyway, or the first subscriber after a
+                    # quiet spell would be sent every event written meanwhile
+                    head = await asyncio.to_thread(log_head, self.app)
+                    if not self.subscribers:
+                        self.last_event_id = head
+                self.stats['polls'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Live update poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _fetch(self, after_id, draw_ids):
+        """
+        Runs in a worker thread: reads the events after `after_id` and groups them per
+        watched draw. Returns (batches, id of the last event read).
+        """
+        with self.app.app_context():
+            try:
+                rows = db.session.query(TicketEvent.id, TicketEvent.draw_id, TicketEvent.version,
+                                        TicketEvent.ticket_number, TicketEvent.status, TicketEvent.created_at)\
+                                 .filter(TicketEvent.id > after_id)\
+                                 .order_by(TicketEvent.id)\
+                                 .limit(self.batch_size)\
+                                 .all()
+                if not rows:
+                    return {}, after_id
+
+                batches = {}
+                for row in rows:
+                    if row.draw_id not in draw_ids:
+                        continue
+                    batch = batches.setdefault(row.draw_id, {'version': 0, 'changes': {}, 'reload': False,
+                                                             'oldest': row.created_at})
+                    batch['version'] = max(batch['version'], row.version)
+                    if row.ticket_number is None:
+                        batch['reload'] = True
+                    else:
+                        batch['changes'][row.ticket_number] = STATUS_CODES.get(row.status, 'r')
+                if batches:
+                    draws = Draw.query.filter(Draw.id.in_(list(batches))).all()
+                    for draw in draws:
+                        batches[draw.id]['counts'] = draw.get_status_counts()
+                return batches, rows[-1].id
+            finally:
+                db.session.remove()
+
+    def _publish(self, batches):
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        for draw_id, batch in batches.items():
+            if batch['reload']:
+                payload = {'version': batch['version'], 'reload': True}
+            else:
+                payload = {
+                    'version': batch['version'],
+                    'counts': batch.get('counts'),
+                    'changes': [[number, code] for number, code in batch['changes'].items()],
+                }
+            message = sse_message(payload)
+            self.stats['last_event_latency_ms'] = (now - batch['oldest']).total_seconds() * 1000
+            for queue in list(self.subscribers.get(draw_id, ())):
+                self._offer(queue, message, batch['version'])
+        if batches:
+            self.stats['last_fanout_ms'] = (time.perf_counter() - started) * 1000
+
+    def _offer(self, queue, message, version):
+        try:
+            queue.put_nowait(message)
+            self.stats['messages_sent'] += 1
+        except asyncio.QueueFull:
+            # Consumer fell behind: drop its backlog and make it reload the grid
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(sse_message({'version': version, 'reload': True}))
+            self.stats['slow_consumers_reset'] += 1
+
+    def snapshot(self):
+        return dict(self.stats, connections=self.connection_count(), draws_watched=len(self.subscribers))
+
+
+def log_head(flask_app):
+    """Id of the newest TicketEvent (0 if none)."""
+    with flask_app.app_context():
+        try:
+            return db.session.query(db.func.max(TicketEvent.id)).scalar() or 0
+        finally:
+            db.session.remove()
+
+
+# ---------------- ASGI Routing ----------------
+def _catch_up(flask_app, draw_id, since):
+    """
+    Current state for a new watcher, and the newest TicketEvent id it covers
+    (read first, so anything later is left to the broadcaster). None if the draw does not exist.
+    """
+    with flask_app.app_context():
+        try:
+            head = db.session.query(db.func.max(TicketEvent.id)).scalar() or 0
+            draw = db.session.get(Draw, draw_id)
+            if draw is None:
+                return None
+            version, changes = changes_since(draw, since)
+            if changes is None:
+                return {'version': version, 'reload': True}, head
+            return {'version': version, 'counts': draw.get_status_counts(), 'changes': changes}, head
+        finally:
+            db.session.remove()
+
+
+async def send_plain(send, status, body, content_type=b'text/plain'):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type), (b'cache-control', b'no-cache')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def stream_draw_events(broadcaster, scope, receive, send, draw_id):
+    query = dict(pair.split('=', 1) for pair in scope.get('query_string', b'').decode().split('&') if '=' in pair)
+    headers = dict(scope.get('headers') or [])
+    # A reconnecting EventSource sends Last-Event-ID, which is newer than the ?since= it was opened with
+    since = headers.get(b'last-event-id', b'').decode() or query.get('since') or '0'
+    since = int(since) if since.isdigit() else 0
+
+    caught_up = await asyncio.to_thread(_catch_up, broadcaster.app, draw_id, since)
+    if caught_up is None:
+        await send_plain(send, 404, b'Draw not found')
+        return
+    initial, head = caught_up
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    queue = broadcaster.subscribe(draw_id, head)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.body', 'body': sse_message(initial), 'more_body': True})
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                getter.cancel()
+                break
+            if getter in done:
+                body = getter.result()
+            else:
+                getter.cancel()
+                body = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broadcaster.unsubscribe(draw_id, queue)
+        disconnected.cancel()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def live_app(broadcaster, fallback):
+    """ASGI app serving /draw/<id>/events and /live/stats, delegating everything else to `fallback`."""
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = EVENTS_PATH.match(scope['path'])
+            if match:
+                await stream_draw_events(broadcaster, scope, receive, send, int(match.group(1)))
+                return
+            if scope['path'] == '/live/stats':
+                body = json.dumps(broadcaster.snapshot()).encode('utf-8')
+                await send_plain(send, 200, body, b'application/json')
+                return
+
+        await fallback(scope, receive, send)
+
+    return app
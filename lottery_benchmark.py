@@ -0,0 +1,1015 @@
+# lottery_benchmark.py
+"""
+End-to-end benchmark of the lottery workflow, stage by stage:
+
+    create_draw     admin creates a draw (dense mode: ticket rows generated)
+    view_draw       concurrent GETs of the public draw page
+    reserve         concurrent reservations, posted the way the draw page's modal does
+    race_sparse     concurrent 1-3 number requests from distinct users for the same few numbers of a
+    race_dense      sparse / dense draw; these and reserve check every number was claimed at most once
+    proof_upload    reserving users send payment screenshots to the bot (getFile + download from
+                    the fake Bot API, hashing, storage, thumbnails, linking); some are resends
+    approve         admin approves pending payments one by one
+    bulk_approve    admin approves as many pending payments in one request; compare per-ticket throughput
+    expiry_sweep    lottery_scheduler releases the remaining (backdated) reservations
+    draw_execute    admin executes the draw
+    notify          the outbox dispatcher drains every queued message to a fake Bot API
+    flood_open      a reservation flood (few users and IPs, mostly taken numbers) with admission
+                    control off, on a fresh draw that is 90% claimed
+    flood_guarded   the same flood with admission control on; compare their db_qps
+
+Then, once:
+
+    webhook         /my_tickets updates POSTed to asgi.py's webhook route and answered by the bot;
+                    latency is the acknowledgement, throughput is updates answered per second
+    bot_users       --bot-users distinct users sending /my_tickets at the same moment
+    sse_fanout      --sse-watchers Server-Sent Events subscribers of one draw (live.py's ASGI app,
+                    in process) while reservations are committed; latency is commit to delivery,
+                    size is the watcher count
+
+And page rendering of 1k/10k/50k-ticket draws (30% claimed), each row carrying its bytes:
+
+    tpl_compile     every template compiled from source, as a worker without the bytecode cache boots
+    tpl_bytecode    the same templates loaded from the Jinja bytecode cache
+    page_loop       the draw page with the per-ticket Jinja loop it used before rendering.py, uncompressed
+    page_cold       the draw page with the ticket-grid fragment built for a new draw version
+    page_warm       the draw page with the fragment served from the worker's fragment cache
+    page_gzip       GET of the draw page (response cache off) with Accept-Encoding: gzip
+    page_br         the same with Accept-Encoding: br, when brotli is installed
+
+Each stage reports throughput and p50/p95/p99 latency for every draw size.
+
+    python lottery_benchmark.py --database-url sqlite:////tmp/lottery_bench.db
+    python lottery_benchmark.py --database-url postgresql://localhost/lottery_bench \\
+        --sizes 1000,10000,100000,1000000 --json results.json --baseline last_release.json
+
+Always point it at a scratch database: it migrates the schema and leaves its
+benchmark draws behind. With --baseline, it exits non-zero when a stage's p95
+is worse than the baseline's by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+
+# ---------------- Fake Telegram Bot API ----------------
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """
+    Answers getMe/sendMessage/getFile like api.telegram.org and serves the
+    registered `files` from /file/bot<token>/, after an optional simulated
+    network delay.
+    """
+
+    latency_seconds = 0.0
+    sent = 0
+    files = {}  # file_id -> bytes
+    lock = threading.Lock()
+
+    def do_GET(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        file_id = os.path.splitext(self.path.rsplit('/', 1)[-1])[0]
+        data = self.files.get(file_id)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        method = self.path.rsplit('/', 1)[-1]
+        if method == 'getFile':
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                file_id = json.loads(body)['file_id']
+            else:
+                file_id = parse_qs(body.decode('utf-8'))['file_id'][0]
+            result = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self.files.get(file_id, b'')),
+                      'file_path': f'photos/{file_id}.jpg'}
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+        elif method == 'sendMessage':
+            with self.lock:
+                FakeBotAPI.sent += 1
+                message_id = FakeBotAPI.sent
+            result = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': 1, 'type': 'private'}}
+        else:
+            result = True
+        body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_bot_api(latency_ms):
+    FakeBotAPI.latency_seconds = latency_ms / 1000
+    ThreadingHTTPServer.request_queue_size = 1024  # The bot opens up to 256 connections at once
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    root = f"http://127.0.0.1:{server.server_address[1]}"
+    return server, f"{root}/bot", f"{root}/file/bot"
+
+
+def fake_screenshot(seed, size_kb):
+    """A phone-screenshot-sized JPEG (random bytes of that size without Pillow)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return random.Random(seed).randbytes(size_kb * 1024)
+    import io
+    image = Image.effect_noise((1080, 2340), 20 + seed % 40).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=70)
+    return buffer.getvalue()
+
+
+# ---------------- Measurement ----------------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(stage, size, latencies, elapsed, items=None, errors=0):
+    """One result row. `items` counts work done when it differs from requests (tickets swept, messages sent)."""
+    latencies = sorted(latencies)
+    items = len(latencies) if items is None else items
+    return {
+        'stage': stage,
+        'size': size,
+        'requests': len(latencies),
+        'items': items,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_per_second': round(items / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_concurrently(jobs, concurrency, call):
+    """Runs call(client, job) for every job on `concurrency` threads. Returns (latencies, errors, elapsed)."""
+    from app import app
+    latencies, errors = [], []
+    lock = threading.Lock()
+    pending = list(jobs)
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                job = pending.pop()
+            started = time.perf_counter()
+            try:
+                ok = call(client, job)
+            except Exception as e:
+                ok = False
+                print(f"   ! {e!r}")
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors.append(job)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors), time.perf_counter() - started
+
+
+def admin_client():
+    from app import app
+    client = app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': app.config['ADMIN_PASSWORD']})
+    return client
+
+
+def timed(call):
+    started = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - started
+
+
+# ---------------- Stages ----------------
+def bench_size(size, args):
+    from app import app
+    from models import db, Draw, Ticket
+    from lottery_scheduler import expire_reservation_batch
+
+    results = []
+    admin = admin_client()
+    name = f"benchmark-{size}-{datetime.utcnow():%Y%m%d%H%M%S%f}"
+
+    # create_draw: through the admin form, then wait for background generation of big dense draws
+    def create():
+        response = admin.post('/admin/create_draw', data={'name': name, 'total_tickets': size,
+                                                          'ticket_price': 1, 'prize_tiers': '40,20,10'})
+        with app.app_context():
+            draw = Draw.query.filter_by(name=name).one()
+            while not draw.sparse_tickets and draw.tickets_generated < draw.total_tickets:
+                time.sleep(0.2)
+                db.session.refresh(draw)
+            return response.status_code == 302, draw.id, draw.sparse_tickets
+    (ok, draw_id, sparse), elapsed = timed(create)
+    results.append(summarize('create_draw', size, [elapsed], elapsed, items=1 if sparse else size,
+                             errors=0 if ok else 1))
+
+    # view_draw: anonymous page views, steady state (served from the response cache between writes).
+    # One render first: a cold cache hit by every client at once measures the stampede, not the page
+    admin.application.test_client().get(f'/draw/{draw_id}')
+    latencies, errors, elapsed = run_concurrently(
+        range(args.views), args.concurrency, lambda client, _: client.get(f'/draw/{draw_id}').status_code == 200)
+    results.append(summarize('view_draw', size, latencies, elapsed, errors=errors))
+
+    # reserve: random numbers from many users, so some attempts collide like they would in production.
+    # The draw page's modal posts to /draw/<id>/reserve; a taken number is a normal outcome, not an error
+    reservations = min(args.reservations, size)
+    jobs = [(n, [random.randint(1, size)]) for n in range(reservations)]
+    latencies, errors, elapsed, reported = reserve_concurrently(draw_id, jobs, args.concurrency)
+    row = summarize('reserve', size, latencies, elapsed, errors=errors)
+    row['double_bookings'] = double_bookings(draw_id, reported)
+    results.append(row)
+
+    results.extend(bench_reservation_race(size, args))
+    results.append(bench_payment_proofs(size, draw_id, args))
+
+    with app.app_context():
+        pending_ids = [ticket_id for (ticket_id,) in
+                       db.session.query(Ticket.id).filter(Ticket.draw_id == draw_id,
+                                                          Ticket.status == 'pending_payment')
+                                                  .order_by(Ticket.id).all()]
+    # The same number approved one by one and in one bulk request (at most a third each), the rest left to expire
+    batch = min(args.approvals, len(pending_ids) // 3)
+    single_ids, bulk_ids = pending_ids[:batch], pending_ids[batch:2 * batch]
+
+    latencies, errors, elapsed = run_concurrently(
+        single_ids, 1,
+        lambda client, ticket_id: admin.post(f'/admin/approve_payment/{ticket_id}').status_code == 302)
+    single = summarize('approve', size, latencies, elapsed, errors=errors)
+    results.append(single)
+
+    response, elapsed = timed(lambda: admin.post('/admin/payments/bulk',
+                                                 json={'action': 'approve', 'ticket_ids': bulk_ids}))
+    bulk = summarize('bulk_approve', size, [elapsed], elapsed, items=(response.get_json() or {}).get('count', 0),
+                     errors=0 if response.status_code == 200 else 1)
+    results.append(bulk)
+    if single['throughput_per_second']:
+        print(f"   {batch} payments: bulk approves "
+              f"{bulk['throughput_per_second'] / single['throughput_per_second']:.0f}x faster per ticket")
+
+    # expiry_sweep: backdate what is still pending, then sweep it in scheduler-sized batches
+    with app.app_context():
+        expired_at = datetime.utcnow() - timedelta(hours=app.config['TICKET_RESERVATION_EXPIRY_HOURS'] + 1)
+        Ticket.query.filter(Ticket.draw_id == draw_id, Ticket.status == 'pending_payment')\
+                    .update({'reserved_at': expired_at}, synchronize_session=False)
+        db.session.commit()
+        latencies, released = [], 0
+        started = time.perf_counter()
+        while True:
+            count, batch_elapsed = timed(lambda: expire_reservation_batch(app, app.config['EXPIRY_SWEEP_BATCH_SIZE']))
+            latencies.append(batch_elapsed)
+            released += count
+            if count < app.config['EXPIRY_SWEEP_BATCH_SIZE']:
+                break
+        elapsed = time.perf_counter() - started
+        db.session.remove()
+    results.append(summarize('expiry_sweep', size, latencies, elapsed, items=released))
+
+    response, elapsed = timed(lambda: admin.post(f'/admin/draw_execute/{draw_id}'))
+    with app.app_context():
+        drawn = db.session.get(Draw, draw_id).is_drawn
+    results.append(summarize('draw_execute', size, [elapsed], elapsed, errors=0 if drawn else 1))
+
+    results.append(bench_notifications(size, args))
+    results.extend(bench_admission_flood(size, args))
+    return results
+
+
+def reserve_concurrently(draw_id, jobs, concurrency):
+    """
+    Posts (user, [numbers]) jobs the way the draw page's modal does; a taken number is a normal outcome, not an
+    error. Returns run_concurrently's results plus {number: [telegram ids told they reserved it]}.
+    """
+    reported = {}
+    lock = threading.Lock()
+
+    def reserve(client, job):
+        user, numbers = job
+        user_telegram_id = 900000000 + user
+        response = client.post(f'/draw/{draw_id}/reserve', data={'ticket_number': ','.join(map(str, numbers)),
+                                                                 'user_telegram_id': str(user_telegram_id),
+                                                                 'user_username': f'bench{user}'})
+        body = response.get_json() or {}
+        with lock:
+            for number in body.get('reserved', ()):
+                reported.setdefault(number, []).append(user_telegram_id)
+        return response.status_code == 200 and 'reserved' in body
+    return (*run_concurrently(jobs, concurrency, reserve), reported)
+
+
+def double_bookings(draw_id, reported):
+    """
+    Numbers claimed more than once, which must be zero: reported reserved to two users, stored in two rows,
+    or held in the database by someone other than the user who was told they got it.
+    """
+    from app import app
+    from models import db, Ticket
+
+    with app.app_context():
+        rows = db.session.query(Ticket.ticket_number, Ticket.user_telegram_id)\
+                         .filter(Ticket.draw_id == draw_id, Ticket.status != 'available').all()
+        db.session.remove()
+    holders = {}
+    for number, user_telegram_id in rows:
+        holders.setdefault(number, []).append(user_telegram_id)
+    bad = {number for number, users in reported.items() if len(users) > 1 or holders.get(number) != users}
+    bad.update(number for number, users in holders.items() if len(users) > 1)
+    for number in sorted(bad)[:10]:
+        print(f"   ! ticket {number} double-booked: told {reported.get(number)}, stored {holders.get(number)}")
+    return len(bad)
+
+
+def bench_reservation_race(size, args):
+    """
+    Many users fighting over a few numbers, with multi-number requests, on a sparse and on a dense draw.
+    Each row's double_bookings must be 0; main() exits non-zero otherwise.
+    """
+    from app import app
+    from models import Draw
+
+    admin = admin_client()
+    total = min(size, 1000)
+    hot = max(total // 10, 10)
+    rows = []
+    storage_mode = app.config['TICKET_STORAGE_MODE']
+    try:
+        for mode in ('sparse', 'dense'):
+            app.config['TICKET_STORAGE_MODE'] = mode
+            name = f"race-{mode}-{total}-{datetime.utcnow():%Y%m%d%H%M%S%f}"
+            admin.post('/admin/create_draw', data={'name': name, 'total_tickets': total, 'ticket_price': 1,
+                                                   'prize_tiers': '50'})
+            with app.app_context():
+                draw_id = Draw.query.filter_by(name=name).one().id  # Small enough to be generated in the request
+            jobs = [(user, random.sample(range(1, hot + 1), random.randint(1, 3))) for user in range(args.race)]
+            latencies, errors, elapsed, reported = reserve_concurrently(draw_id, jobs, args.concurrency)
+            row = summarize(f'race_{mode}', size, latencies, elapsed, items=len(reported), errors=errors)
+            row['double_bookings'] = double_bookings(draw_id, reported)
+            print(f"   race_{mode}: {len(jobs)} requests for {hot} numbers, {len(reported)} reserved, "
+                  f"{row['double_bookings']} double-booked")
+            rows.append(row)
+    finally:
+        app.config['TICKET_STORAGE_MODE'] = storage_mode
+    return rows
+
+
+def bench_payment_proofs(size, draw_id, args):
+    """Feeds photo updates straight into the bot Application, the way polling or the webhook would."""
+    from telegram import Update
+    from app import app, build_telegram_application
+    from models import db, Ticket
+
+    with app.app_context():
+        senders = [user_id for (user_id,) in db.session.query(Ticket.user_telegram_id).distinct()
+                                                      .filter(Ticket.draw_id == draw_id,
+                                                              Ticket.status == 'pending_payment')
+                                                      .limit(args.proofs).all()]
+        db.session.remove()
+    if not senders:
+        return summarize('proof_upload', size, [], 0.0)
+    # Every tenth upload resends an earlier screenshot, which the dedup has to catch
+    jobs = []
+    for n in range(args.proofs):
+        file_id = f"d{draw_id}p{n - n % 10 if n % 10 == 9 else n}"
+        if file_id not in FakeBotAPI.files:
+            FakeBotAPI.files[file_id] = fake_screenshot(n, args.proof_kb)
+        jobs.append((n, senders[n % len(senders)], file_id))
+
+    async def upload_all():
+        bot_app = build_telegram_application(app)
+        latencies = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def upload(n, user_id, file_id):
+            update = Update.de_json({
+                'update_id': n,
+                'message': {
+                    'message_id': n, 'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{user_id}'},
+                    'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1080, 'height': 2340,
+                               'file_size': len(FakeBotAPI.files[file_id])}],
+                },
+            }, bot_app.bot)
+            async with semaphore:
+                started = time.perf_counter()
+                await bot_app.process_update(update)
+                latencies.append(time.perf_counter() - started)
+
+        async with bot_app:
+            started = time.perf_counter()
+            await asyncio.gather(*(upload(*job) for job in jobs))
+            return latencies, time.perf_counter() - started
+
+    replies_before = FakeBotAPI.sent
+    latencies, elapsed = asyncio.run(upload_all())
+    # Every handled upload ends with a reply; a handler that raised sent none
+    errors = len(jobs) - (FakeBotAPI.sent - replies_before)
+    print(f"   {len(jobs)} screenshots from {len(senders)} users, {len(jobs) / elapsed * 60:.0f}/min")
+    return summarize('proof_upload', size, latencies, elapsed, errors=errors)
+
+
+def my_tickets_update(update_id, user_id):
+    """The update Telegram sends when `user_id` types /my_tickets."""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{user_id}'},
+            'text': '/my_tickets', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 11}],
+        },
+    }
+
+
+def ticket_holders(count):
+    """Up to `count` Telegram IDs holding tickets in the benchmark draws."""
+    from app import app
+    from models import db, Ticket
+    with app.app_context():
+        users = [user_id for (user_id,) in db.session.query(Ticket.user_telegram_id).distinct()
+                                                     .filter(Ticket.user_telegram_id.isnot(None))
+                                                     .limit(count).all()]
+        db.session.remove()
+    return users
+
+
+def bench_webhook(args):
+    """
+    /my_tickets updates POSTed to asgi.py's webhook route, --webhook-connections at a time (Telegram's
+    max_connections), with the bot Application processing its update queue as it does in production.
+    Latency is the webhook's acknowledgement; throughput is updates answered (reply sent) per second.
+    """
+    from app import app, get_telegram_application
+
+    users = ticket_holders(args.webhook_updates)
+    if not users:
+        return summarize('webhook', args.webhook_updates, [], 0.0)
+    saved = {key: app.config[key] for key in ('TELEGRAM_MODE', 'LIVE_UPDATES')}
+    import asgi  # Turns LIVE_UPDATES on for the process; restored below for the page_* stages
+    app.config['TELEGRAM_MODE'] = 'webhook'
+    secret = app.config.get('TELEGRAM_WEBHOOK_SECRET')
+    bodies = [json.dumps(my_tickets_update(n, users[n % len(users)])).encode('utf-8')
+              for n in range(args.webhook_updates)]
+
+    async def replay():
+        bot_app = get_telegram_application()
+        await bot_app.initialize()
+        await bot_app.start()
+        latencies, rejected = [], []
+        pending = list(bodies)
+
+        async def deliver(body):
+            headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+            if secret:
+                headers.append((b'x-telegram-bot-api-secret-token', secret.encode('utf-8')))
+            scope = {'type': 'http', 'method': 'POST', 'path': asgi.WEBHOOK_PATH, 'query_string': b'',
+                     'headers': headers}
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start' and message['status'] != 200:
+                    rejected.append(message['status'])
+            started = time.perf_counter()
+            await asgi.app(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+
+        async def connection():
+            while pending:
+                await deliver(pending.pop())
+
+        replies_before = FakeBotAPI.sent
+        started = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(args.webhook_connections)))
+        acked = time.perf_counter() - started
+        deadline = time.perf_counter() + 60
+        while FakeBotAPI.sent - replies_before < len(bodies) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        answered = FakeBotAPI.sent - replies_before
+        await bot_app.stop()
+        await bot_app.shutdown()
+        return latencies, len(rejected), answered, acked, elapsed
+
+    try:
+        latencies, rejected, answered, acked, elapsed = asyncio.run(replay())
+    finally:
+        app.config.update(saved)
+    row = summarize('webhook', len(bodies), latencies, elapsed, items=answered,
+                    errors=rejected + len(bodies) - answered)
+    row.update(acked_per_second=round(len(bodies) / acked, 1) if acked else 0.0)
+    print(f"   {len(bodies)} updates from {len(users)} users: acknowledged at {len(bodies) / acked:.0f}/s, "
+          f"answered at {answered / elapsed:.0f}/s")
+    return row
+
+
+def bench_bot_users(args):
+    """
+    --bot-users distinct users sending /my_tickets at the same moment. They are handled
+    TELEGRAM_CONCURRENT_UPDATES at a time, as the Application does; latency runs from arrival.
+    """
+    from telegram import Update
+    from app import app, build_telegram_application
+
+    users = ticket_holders(args.bot_users)
+    if not users:
+        return summarize('bot_users', args.bot_users, [], 0.0)
+
+    async def run():
+        bot_app = build_telegram_application(app)
+        latencies = []
+        semaphore = asyncio.Semaphore(app.config['TELEGRAM_CONCURRENT_UPDATES'])
+
+        async def handle(n, user_id):
+            update = Update.de_json(my_tickets_update(n, user_id), bot_app.bot)
+            started = time.perf_counter()
+            async with semaphore:
+                await bot_app.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+        async with bot_app:
+            started = time.perf_counter()
+            await asyncio.gather(*(handle(n, users[n % len(users)]) for n in range(args.bot_users)))
+            return latencies, time.perf_counter() - started
+
+    replies_before = FakeBotAPI.sent
+    latencies, elapsed = asyncio.run(run())
+    errors = args.bot_users - (FakeBotAPI.sent - replies_before)
+    print(f"   {args.bot_users} concurrent /my_tickets from {len(users)} users")
+    return summarize('bot_users', args.bot_users, latencies, elapsed, errors=errors)
+
+
+def bench_admission_flood(size, args):
+    """The same flood twice, admission control off then on; the rows carry the SQL statements per second."""
+    from sqlalchemy import event
+    from app import app
+    from models import db, Draw
+    from ticket_store import reserve_tickets
+
+    admin = admin_client()
+    total = min(size, 10000)
+    statements = [0]
+
+    def count_statement(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', count_statement)
+    rows = []
+    try:
+        for stage, enabled in (('flood_open', False), ('flood_guarded', True)):
+            name = f"flood-{stage}-{total}-{datetime.utcnow():%Y%m%d%H%M%S%f}"
+            admin.post('/admin/create_draw', data={'name': name, 'total_tickets': total, 'ticket_price': 1,
+                                                   'prize_tiers': '50'})
+            with app.app_context():
+                draw = Draw.query.filter_by(name=name).one()
+                while not draw.sparse_tickets and draw.tickets_generated < draw.total_tickets:
+                    time.sleep(0.2)
+                    db.session.refresh(draw)
+                # 90% already claimed, as at the height of a launch
+                claimed = [n for n in range(1, total + 1) if n % 10]
+                for start in range(0, len(claimed), 500):
+                    reserve_tickets(draw, claimed[start:start + 500], 1, 'flood-filler')
+                draw_id = draw.id
+                db.session.remove()
+            admin.application.test_client().get(f'/draw/{draw_id}')  # A visitor has loaded the page
+
+            jobs = [(random.randrange(args.flood_users), random.randrange(args.flood_ips), random.randint(1, total))
+                    for _ in range(args.flood)]
+            outcomes = {}
+
+            def reserve(client, job):
+                user, ip, number = job
+                response = client.post(f'/draw/{draw_id}/reserve',
+                                       data={'ticket_number': str(number), 'user_telegram_id': str(800000000 + user),
+                                             'user_username': f'flood{user}'},
+                                       environ_base={'REMOTE_ADDR': f'10.0.0.{ip + 1}'})
+                body = response.get_json() or {}
+                outcome = 'rate_limited' if response.status_code == 429 else \
+                          'reserved' if body.get('reserved') else 'refused'
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                return response.status_code in (200, 429)
+
+            app.config['ADMISSION_ENABLED'] = enabled
+            before = statements[0]
+            latencies, errors, elapsed = run_concurrently(jobs, args.concurrency, reserve)
+            executed = statements[0] - before
+            row = summarize(stage, size, latencies, elapsed, errors=errors)
+            row.update(db_statements=executed, db_qps=round(executed / elapsed, 1), outcomes=outcomes)
+            print(f"   {stage}: {executed} SQL statements, {row['db_qps']}/s; {outcomes}")
+            rows.append(row)
+    finally:
+        event.remove(engine, 'after_cursor_execute', count_statement)
+        app.config['ADMISSION_ENABLED'] = False
+    return rows
+
+
+def bench_live_updates(args):
+    """
+    SSE fan-out through live.py's ASGI app, in process: --sse-watchers subscribers of one draw
+    while --sse-events reservations are committed. Latency is commit to delivery, per watcher
+    and event; a message carrying a later version delivers every earlier change too.
+    """
+    from app import app
+    from live import DrawBroadcaster, live_app
+    from models import db, Draw
+    from ticket_store import reserve_tickets
+
+    admin = admin_client()
+    name = f"live-{args.sse_watchers}-{datetime.utcnow():%Y%m%d%H%M%S%f}"
+    admin.post('/admin/create_draw', data={'name': name, 'total_tickets': max(args.sse_events, 100),
+                                           'ticket_price': 1, 'prize_tiers': '50'})
+    with app.app_context():
+        draw_id = Draw.query.filter_by(name=name).one().id
+        db.session.remove()
+
+    def reserve(number):
+        with app.app_context():
+            reserve_tickets(db.session.get(Draw, draw_id), [number], 700000000 + number, f'live{number}')
+            committed = time.perf_counter()
+            version = db.session.query(Draw.tickets_version).filter(Draw.id == draw_id).scalar()
+            db.session.remove()
+        return version, committed
+
+    async def run():
+        broadcaster = DrawBroadcaster(app, poll_interval=app.config['LIVE_POLL_SECONDS'])
+        asgi = live_app(broadcaster, None)
+        stop = asyncio.Event()
+        arrivals = [[] for _ in range(args.sse_watchers)]  # per watcher: [(time, version)]
+
+        async def watch(index):
+            scope = {'type': 'http', 'method': 'GET', 'path': f'/draw/{draw_id}/events',
+                     'query_string': b'since=0', 'headers': []}
+
+            async def receive():
+                await stop.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                body = message.get('body', b'')
+                if body.startswith(b'id: '):
+                    arrivals[index].append((time.perf_counter(), int(body[4:body.index(b'\n')] or 0)))
+            await asgi(scope, receive, send)
+
+        started = time.perf_counter()
+        watchers = [asyncio.create_task(watch(index)) for index in range(args.sse_watchers)]
+        while broadcaster.connection_count() < args.sse_watchers:
+            await asyncio.sleep(0.05)
+        connect_seconds = time.perf_counter() - started
+
+        commits = []
+        for number in range(1, args.sse_events + 1):
+            commits.append(await asyncio.to_thread(reserve, number))
+            await asyncio.sleep(0.02)
+        last_version = commits[-1][0]
+        deadline = time.perf_counter() + 5 + 3 * broadcaster.poll_interval
+        while time.perf_counter() < deadline and \
+                any(not seen or seen[-1][1] < last_version for seen in arrivals):
+            await asyncio.sleep(0.05)
+        fanout_ms = broadcaster.stats['last_fanout_ms']
+        stop.set()
+        await asyncio.gather(*watchers)
+        await broadcaster.stop()
+
+        latencies, missed = [], 0
+        last_arrival = max((seen[-1][0] for seen in arrivals if seen), default=commits[0][1])
+        for seen in arrivals:
+            for version, committed in commits:
+                delivered = next((at for at, seen_version in seen if seen_version >= version), None)
+                if delivered is None:
+                    missed += 1
+                else:
+                    latencies.append(max(delivered - committed, 0.0))
+        elapsed = last_arrival - commits[0][1]
+        return latencies, missed, elapsed, connect_seconds, fanout_ms, broadcaster.stats['messages_sent']
+
+    latencies, missed, elapsed, connect_seconds, fanout_ms, sent = asyncio.run(run())
+    # Throughput is changes delivered (watcher x event) per second
+    row = summarize('sse_fanout', args.sse_watchers, latencies, elapsed, errors=missed)
+    row.update(connections=args.sse_watchers, messages_sent=sent, connect_seconds=round(connect_seconds, 2),
+               last_fanout_ms=round(fanout_ms, 2))
+    print(f"   {args.sse_watchers} watchers connected in {connect_seconds:.2f} s; {sent} messages, "
+          f"last fan-out {fanout_ms:.1f} ms, {missed} deliveries missed")
+    return row
+
+
+def bench_notifications(size, args):
+    from app import app
+    from notifications import NotificationDispatcher, build_bot, pending_notification_count
+
+    async def drain():
+        latencies, handled = [], 0
+        async with build_bot(app) as bot:
+            dispatcher = NotificationDispatcher(app, bot)
+            started = time.perf_counter()
+            while True:
+                batch_started = time.perf_counter()
+                count = await dispatcher.dispatch_once()
+                if not count:
+                    break
+                latencies.append(time.perf_counter() - batch_started)
+                handled += count
+            return latencies, handled, time.perf_counter() - started, dispatcher.stats['failed']
+
+    with app.app_context():
+        queued = pending_notification_count()
+    latencies, handled, elapsed, failed = asyncio.run(drain())
+    print(f"   {queued} notifications queued")
+    return summarize('notify', size, latencies, elapsed, items=handled, errors=failed)
+
+
+# The grid as draw_public_details.html rendered it before rendering.py, the "before" of the page_* stages
+LOOP_GRID_TEMPLATE = """
+        {% for ticket in tickets %}
+            {% set color = 'success' if ticket.status=='available' else ('warning text-dark' if ticket.status=='pending_payment' else 'danger') %}
+            <div class="col-3 col-sm-2 col-md-1">
+                <button type="button"
+                        class="btn btn-{{ color }} ticket-btn w-100 py-3 fw-bold"
+                        data-ticket="{{ ticket.ticket_number }}"
+                        data-status="{{ ticket.status }}"
+                        {% if ticket.status != 'available' %}disabled{% endif %}
+                        style="border-radius: 8px; font-size: 1rem;">
+                    {{ ticket.ticket_number }}
+                </button>
+            </div>
+        {% endfor %}
+"""
+
+
+def bench_templates(bytecode_dir):
+    """Boot-time template loading, compiled from source vs read back from the bytecode cache."""
+    from jinja2 import FileSystemBytecodeCache
+    from app import app
+
+    names = app.jinja_env.list_templates(extensions=('html',))
+    rows = []
+    for stage, bytecode_cache in (('tpl_compile', None), ('tpl_bytecode', FileSystemBytecodeCache(bytecode_dir))):
+        if bytecode_cache:
+            warm = app.jinja_env.overlay(bytecode_cache=bytecode_cache, cache_size=0)
+            for name in names:
+                warm.get_template(name)
+        # No in-memory template cache: every lookup compiles or reads bytecode, as in a fresh worker
+        env = app.jinja_env.overlay(bytecode_cache=bytecode_cache, cache_size=0)
+        latencies = []
+        started = time.perf_counter()
+        for name in names:
+            _, elapsed = timed(lambda: env.get_template(name))
+            latencies.append(elapsed)
+        rows.append(summarize(stage, len(names), latencies, time.perf_counter() - started))
+    return rows
+
+
+def bench_render(size, args):
+    """Draw page renders before (Jinja loop) and after (fragment), and the bytes each coding puts on the wire."""
+    from flask import render_template
+    from markupsafe import Markup
+    from app import app
+    from models import db, Draw
+    from ticket_store import reserve_tickets, ticket_grid
+    from rendering import ticket_grid_fragment, CONTENT_CODINGS
+
+    admin = admin_client()
+    name = f"render-{size}-{datetime.utcnow():%Y%m%d%H%M%S%f}"
+    admin.post('/admin/create_draw', data={'name': name, 'total_tickets': size, 'ticket_price': 1,
+                                           'prize_tiers': '50'})
+    with app.app_context():
+        draw = Draw.query.filter_by(name=name).one()
+        while not draw.sparse_tickets and draw.tickets_generated < draw.total_tickets:
+            time.sleep(0.2)
+            db.session.refresh(draw)
+        claimed = sorted(random.sample(range(1, size + 1), size * 3 // 10))
+        for start in range(0, len(claimed), 500):
+            reserve_tickets(draw, claimed[start:start + 500], 1, 'render-filler')
+        draw_id = draw.id
+        db.session.remove()
+
+    rows = []
+    with app.test_request_context(f'/draw/{draw_id}'):
+        draw = db.session.get(Draw, draw_id)
+        loop = app.jinja_env.from_string(LOOP_GRID_TEMPLATE)
+        fragments = app.extensions['grid_fragments']
+
+        def loop_page():
+            grid = Markup(loop.render(tickets=ticket_grid(draw)))
+            return render_template('draw_public_details.html', draw=draw, ticket_grid=grid, winners=[])
+
+        def cold_page():
+            fragments.clear()
+            return render_template('draw_public_details.html', draw=draw, ticket_grid=ticket_grid_fragment(draw),
+                                   winners=[])
+
+        def warm_page():
+            return render_template('draw_public_details.html', draw=draw, ticket_grid=ticket_grid_fragment(draw),
+                                   winners=[])
+
+        for stage, render in (('page_loop', loop_page), ('page_cold', cold_page), ('page_warm', warm_page)):
+            render()
+            latencies = [timed(render)[1] for _ in range(args.renders)]
+            row = summarize(stage, size, latencies, sum(latencies))
+            row['bytes'] = len(render().encode('utf-8'))
+            rows.append(row)
+        db.session.remove()
+
+    # Through the full request: queries, render, compression; the response cache would answer repeats
+    cache = app.extensions.pop('response_cache', None)
+    try:
+        client = app.test_client()
+        for coding in reversed(CONTENT_CODINGS):
+            latencies, sizes = [], set()
+            for _ in range(args.renders + 1):
+                response, elapsed = timed(lambda: client.get(f'/draw/{draw_id}', headers={'Accept-Encoding': coding}))
+                latencies.append(elapsed)
+                sizes.add(len(response.data) if response.headers.get('Content-Encoding') == coding else -1)
+            row = summarize(f'page_{coding}', size, latencies[1:], sum(latencies[1:]), errors=int(-1 in sizes))
+            row['bytes'] = max(sizes)
+            rows.append(row)
+    finally:
+        if cache is not None:
+            app.extensions['response_cache'] = cache
+    return rows
+
+
+# ---------------- Reporting ----------------
+def print_table(results):
+    header = f"{'stage':<14}{'size':>9}{'reqs':>7}{'items':>8}{'err':>5}{'per sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'bytes':>11}"
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print(f"{row['stage']:<14}{row['size']:>9}{row['requests']:>7}{row['items']:>8}{row['errors']:>5}"
+              f"{row['throughput_per_second']:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row.get('bytes', ''):>11}")
+
+
+def regressions(results, baseline_path, tolerance):
+    """Stages whose p95 grew by more than `tolerance` (a fraction) over the baseline run."""
+    with open(baseline_path) as f:
+        baseline = {(row['stage'], row['size']): row for row in json.load(f)['results']}
+    found = []
+    for row in results:
+        before = baseline.get((row['stage'], row['size']))
+        # Sub-millisecond stages are noise; compare only what can meaningfully regress
+        if before and before['p95_ms'] >= 1 and row['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(f"{row['stage']} @ {row['size']}: p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lottery workflow end to end.")
+    parser.add_argument('--database-url', required=True, help="Scratch database (it is migrated and written to)")
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help="Draw sizes, comma separated")
+    parser.add_argument('--storage', choices=('sparse', 'dense'), default=None,
+                        help="Ticket storage mode (default: TICKET_STORAGE_MODE)")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent public clients")
+    parser.add_argument('--views', type=int, default=500, help="Draw page views per size")
+    parser.add_argument('--reservations', type=int, default=6000, help="Reservation attempts per size")
+    parser.add_argument('--race', type=int, default=2000, help="Requests in each race_* stage")
+    parser.add_argument('--approvals', type=int, default=2000,
+                        help="Payments approved one by one, and again in bulk, per size (at most)")
+    parser.add_argument('--flood', type=int, default=3000, help="Reservation attempts in each flood stage")
+    parser.add_argument('--flood-users', type=int, default=50, help="Telegram IDs behind the flood")
+    parser.add_argument('--flood-ips', type=int, default=10, help="Client IPs behind the flood")
+    parser.add_argument('--proofs', type=int, default=300, help="Payment screenshots sent to the bot per size")
+    parser.add_argument('--proof-kb', type=int, default=200, help="Screenshot size without Pillow")
+    parser.add_argument('--bot-latency-ms', type=float, default=20, help="Simulated Bot API round trip")
+    parser.add_argument('--render-sizes', default='1000,10000,50000', help="Draw sizes of the page_* stages")
+    parser.add_argument('--renders', type=int, default=20, help="Renders per page_* stage and size")
+    parser.add_argument('--webhook-updates', type=int, default=5000,
+                        help="/my_tickets updates POSTed to the webhook (0 skips the stage)")
+    parser.add_argument('--webhook-connections', type=int, default=40,
+                        help="Concurrent webhook deliveries (Telegram's max_connections)")
+    parser.add_argument('--bot-users', type=int, default=1000, help="Users sending /my_tickets at once (0 skips it)")
+    parser.add_argument('--sse-watchers', type=int, default=2000, help="SSE subscribers in sse_fanout (0 skips it)")
+    parser.add_argument('--sse-events', type=int, default=50, help="Reservations committed while they watch")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for the reservation pattern")
+    parser.add_argument('--json', dest='json_path', help="Write machine-readable results here")
+    parser.add_argument('--baseline', help="Results JSON of a previous run to compare p95 against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p95 growth over the baseline")
+    args = parser.parse_args()
+
+    fake_api, base_url, file_url = start_fake_bot_api(args.bot_latency_ms)
+    # Configure before the app is imported: config.Config reads the environment once
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['TELEGRAM_BOT_TOKEN'] = '123456:benchmark'
+    os.environ['TELEGRAM_API_BASE_URL'] = base_url
+    os.environ['TELEGRAM_API_FILE_URL'] = file_url
+    os.environ['PAYMENT_PROOF_DIR'] = tempfile.mkdtemp(prefix='lottery_bench_proofs_')
+    os.environ['TELEGRAM_MODE'] = 'off'
+    if args.storage:
+        os.environ['TICKET_STORAGE_MODE'] = args.storage
+    random.seed(args.seed)
+    started_at = datetime.utcnow()
+
+    from app import app, init_database
+    from models import db
+    app.config['WTF_CSRF_ENABLED'] = False  # The benchmark clients post forms without rendering them first
+    # Every user is distinct, so the per-chat interval never applies; lift the global cap to measure the pipeline
+    app.config['NOTIFY_GLOBAL_RATE'] = 10000
+    # The workflow stages post from one address; admission control is measured by the flood stages
+    app.config['ADMISSION_ENABLED'] = False
+    with app.app_context():
+        init_database(app)
+        dialect = db.engine.dialect.name
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = []
+    for size in sizes:
+        print(f"▶ {size} tickets")
+        for row in bench_size(size, args):
+            print(f"   {row['stage']:<14} {row['throughput_per_second']:>9}/s  p95 {row['p95_ms']} ms")
+            results.append(row)
+
+    if args.webhook_updates or args.bot_users:
+        print("▶ bot")
+        rows = [bench_webhook(args)] if args.webhook_updates else []
+        rows += [bench_bot_users(args)] if args.bot_users else []
+        for row in rows:
+            print(f"   {row['stage']:<14} {row['throughput_per_second']:>9}/s  p99 {row['p99_ms']} ms")
+        results.extend(rows)
+
+    if args.sse_watchers:
+        print("▶ live updates")
+        row = bench_live_updates(args)
+        print(f"   {row['stage']:<14} {row['throughput_per_second']:>9}/s  p95 {row['p95_ms']} ms")
+        results.append(row)
+
+    render_sizes = [int(size) for size in args.render_sizes.split(',') if size.strip()]
+    if render_sizes:
+        print("▶ page rendering")
+        rows = bench_templates(tempfile.mkdtemp(prefix='lottery_bench_jinja_'))
+        for size in render_sizes:
+            rows.extend(bench_render(size, args))
+        for row in rows:
+            print(f"   {row['stage']:<14} {row['size']:>9}  p50 {row['p50_ms']} ms  {row.get('bytes', '')}")
+        results.extend(rows)
+    fake_api.shutdown()
+
+    print()
+    print_table(results)
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'dialect': dialect,
+            'storage': app.config['TICKET_STORAGE_MODE'],
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('database_url', 'baseline')},
+        },
+        'results': results,
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+    booked_twice = [row for row in results if row.get('double_bookings')]
+    for row in booked_twice:
+        print(f"❌ {row['stage']} @ {row['size']}: {row['double_bookings']} tickets double-booked")
+    if booked_twice:
+        sys.exit(1)
+    if args.baseline:
+        found = regressions(results, args.baseline, args.tolerance)
+        for line in found:
+            print(f"❌ {line}")
+        if found:
+            sys.exit(1)
+        print(f"✅ No stage regressed by more than {args.tolerance:.0%} over {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
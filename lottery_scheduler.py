@@ -1,57 +1,177 @@
 # lottery_scheduler.py
-import os
+import time
 import asyncio
+import argparse
+from collections import defaultdict
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from sqlalchemy import update, delete, select
+
 # Ensure environment variables are loaded for this script too
 load_dotenv()
 
-# We need to create a dummy app context to use Flask-SQLAlchemy outside the main app.
-# Import create_app from app.py
-from app import create_app, db, Ticket, application # Import application as well for bot messaging
+from models import db, Draw, Ticket
+from ticket_store import mark_tickets_changed
+from notifications import enqueue_notification
+from draw_archive import archive_finished_draws, resume_purges
+
+
+def expire_reservation_batch(flask_app, batch_size):
+    """
+    Releases up to `batch_size` expired pending_payment tickets in one transaction.
+
+    The candidates come from the (status, reserved_at) index, oldest first,
+    skipping draws that are being reset or deleted (the purge removes those).
+    They are then released with one conditional statement per storage mode
+    (UPDATE for dense draws, DELETE for sparse ones) that re-checks status and
+    reserved_at, so a ticket approved in the meantime is left alone. Returns the
+    number of tickets released.
+    """
+    expiry_threshold = datetime.utcnow() - timedelta(hours=flask_app.config['TICKET_RESERVATION_EXPIRY_HOURS'])
+    candidates = db.session.query(Ticket.id, Ticket.draw_id, Ticket.ticket_number, Ticket.user_telegram_id,
+                                  Draw.name, Draw.sparse_tickets)\
+                           .join(Draw, Draw.id == Ticket.draw_id)\
+                           .filter(Ticket.status == 'pending_payment', Ticket.reserved_at < expiry_threshold,
+                                   Draw.purge_state.is_(None))\
+                           .order_by(Ticket.reserved_at)\
+                           .limit(batch_size)\
+                           .all()
+    if not candidates:
+        return 0
+
+    table = Ticket.__table__
+    # A reset or delete zeroes the counters at once and purges the rows later: leave those rows to the purge
+    purging = select(Draw.__table__.c.id).where(Draw.__table__.c.purge_state.isnot(None))
+    still_expired = (table.c.status == 'pending_payment') & (table.c.reserved_at < expiry_threshold) \
+        & table.c.draw_id.not_in(purging)
+    by_id = {row.id: row for row in candidates}
+    released_ids = []
+    for sparse, statement in (
+        (True, delete(table)),
+        (False, update(table).values(status='available', user_telegram_id=None, user_username=None, reserved_at=None)),
+    ):
+        ids = [row.id for row in candidates if bool(row.sparse_tickets) == sparse]
+        if not ids:
+            continue
+        statement = statement.where(table.c.id.in_(ids), still_expired)
+        supports_returning = db.engine.dialect.delete_returning if sparse else db.engine.dialect.update_returning
+        if supports_returning:
+            released_ids.extend(db.session.execute(statement.returning(table.c.id)).scalars())
+        else:
+            db.session.execute(statement)
+            released_ids.extend(ids)
+
+    released_by_draw = defaultdict(list)
+    for ticket_id in released_ids:
+        row = by_id[ticket_id]
+        released_by_draw[row.draw_id].append(row.ticket_number)
+        # Notify from the values read before the release, then let the dispatcher send it
+        enqueue_notification(
+            row.user_telegram_id,
+            f"⏰ Your reservation for Ticket #{row.ticket_number} in Draw '{row.name}' has expired "
+            "due to non-payment. The ticket is now available again."
+        )
+    for draw_id, numbers in released_by_draw.items():
+        mark_tickets_changed(draw_id, [(n, 'available') for n in numbers], pending_payment=-len(numbers))
+
+    db.session.commit()
+    return len(released_ids)
+
+
+def expire_reservations(flask_app):
+    """Runs expiry batches until no expired reservation is left."""
+    batch_size = flask_app.config['EXPIRY_SWEEP_BATCH_SIZE']
+    total = 0
+    with flask_app.app_context():
+        try:
+            while True:
+                released = expire_reservation_batch(flask_app, batch_size)
+                total += released
+                if released < batch_size:
+                    break
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+    return total
 
-# Create a minimal app instance for the scheduler to use
-# This app won't run a web server, but provides the app context for DB operations
-scheduler_app = create_app()
 
-async def clean_expired_tickets_task():
+async def clean_expired_tickets_task(flask_app):
     """
     Reverts 'pending_payment' tickets to 'available' after their reservation expires.
-    This task is designed to be run by a background scheduler (e.g., Render Cron Job).
+    Runs once per call; use run_resident for the long-lived mode.
     """
     print("Running expired ticket cleaner...")
-    with scheduler_app.app_context():
-        expiry_threshold = datetime.utcnow() - timedelta(hours=scheduler_app.config['TICKET_RESERVATION_EXPIRY_HOURS'])
-
-        expired_tickets = Ticket.query.filter(
-            Ticket.status == 'pending_payment',
-            Ticket.reserved_at < expiry_threshold
-        ).all()
-
-        for ticket in expired_tickets:
-            print(f"Reverting expired ticket #{ticket.ticket_number} for Draw '{ticket.draw.name}' (User: {ticket.user_telegram_id})")
-            ticket.status = 'available'
-            ticket.user_telegram_id = None
-            ticket.user_username = None
-            ticket.reserved_at = None
-            db.session.add(ticket)
-
-            # Optional: Notify user that reservation expired via Telegram Bot
-            if ticket.user_telegram_id:
-                try:
-                    # 'application' is the global bot instance initialized in create_app()
-                    await application.bot.send_message(
-                        chat_id=ticket.user_telegram_id,
-                        text=f"⏰ Your reservation for Ticket #{ticket.ticket_number} in Draw '{ticket.draw.name}' has expired "
-                             "due to non-payment. The ticket is now available again."
-                    )
-                except Exception as e:
-                    print(f"Failed to send expiry message to {ticket.user_telegram_id}: {e}")
-
-        db.session.commit()
-        print(f"Cleaned {len(expired_tickets)} expired tickets.")
+    cleaned = await asyncio.to_thread(expire_reservations, flask_app)
+    print(f"Cleaned {cleaned} expired tickets.")
+    return cleaned
+
+
+def archive_due_draws(flask_app):
+    """Archives at most one finished draw per call, so a backlog never stalls the expiry sweep."""
+    with flask_app.app_context():
+        try:
+            return archive_finished_draws(flask_app, limit=1)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def resume_due_purges(flask_app):
+    """Finishes one reset/delete whose purge was interrupted (its lease lapsed), like archive_due_draws."""
+    with flask_app.app_context():
+        try:
+            return resume_purges(limit=1)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+async def run_resident(flask_app, every_seconds):
+    """
+    Sweeps every `every_seconds` until stopped, so expiry lags by seconds rather than a cron period.
+    Between sweeps, interrupted resets/deletes are resumed and finished draws past
+    ARCHIVE_AFTER_DAYS are archived.
+    """
+    print(f"✅ Expiry sweeper running every {every_seconds}s")
+    while True:
+        started = time.monotonic()
+        try:
+            cleaned = await asyncio.to_thread(expire_reservations, flask_app)
+            if cleaned:
+                print(f"Cleaned {cleaned} expired tickets.")
+        except Exception as e:
+            print(f"Expiry sweep failed: {e}")
+        try:
+            for draw_id, removed in await asyncio.to_thread(resume_due_purges, flask_app):
+                print(f"Resumed purge of draw {draw_id} ({removed} tickets).")
+        except Exception as e:
+            print(f"Purge resume failed: {e}")
+        try:
+            for draw_id, ticket_count in await asyncio.to_thread(archive_due_draws, flask_app):
+                print(f"Archived draw {draw_id} ({ticket_count} claimed tickets).")
+        except Exception as e:
+            print(f"Draw archival failed: {e}")
+        await asyncio.sleep(max(every_seconds - (time.monotonic() - started), 0))
+
 
 if __name__ == '__main__':
-    # When this script is run, execute the cleaning task
-    asyncio.run(clean_expired_tickets_task())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Release expired ticket reservations.")
+    parser.add_argument('--every', type=int, nargs='?', const=0, default=None, metavar='SECONDS',
+                        help="Stay resident and sweep every SECONDS (default: EXPIRY_SWEEP_INTERVAL_SECONDS)")
+    args = parser.parse_args()
+
+    # Build the app only when run as a script, never on import
+    from app import app as scheduler_app
+
+    if args.every is None:
+        asyncio.run(clean_expired_tickets_task(scheduler_app))
+    else:
+        interval = args.every or scheduler_app.config['EXPIRY_SWEEP_INTERVAL_SECONDS']
+        asyncio.run(run_resident(scheduler_app, interval))
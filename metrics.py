@@ -0,0 +1,251 @@
+# metrics.py
+# In-process instrumentation: per-route latency, SQL and template time per request,
+# bot handler latency and queue gauges, served in Prometheus text format on /metrics.
+import re
+import time
+import threading
+from collections import Counter
+from functools import wraps
+
+from flask import g, request, has_request_context, abort, Response
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+# ---------------- Primitives ----------------
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for label_values, series in items:
+            labels = _labels(self.labels, label_values)
+            for bound, bucket_count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f'{self.name}{{{_labels(self.labels, key)}}} {value:g}' for key, value in items)
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _gauge_lines(name, documentation, samples):
+    """samples: [(labels dict, value)] collected at scrape time."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        rendered = _labels(labels.keys(), labels.values())
+        lines.append(f'{name}{{{rendered}}} {value:g}' if rendered else f'{name} {value:g}')
+    return lines
+
+
+REQUEST_SECONDS = Histogram('lottery_http_request_duration_seconds', 'Flask request latency.',
+                            ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram('lottery_http_request_sql_queries', 'SQL statements executed per request.',
+                            ('endpoint',), QUERY_COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('lottery_http_request_sql_seconds', 'Time spent in SQL per request.', ('endpoint',))
+REQUEST_TEMPLATE_SECONDS = Histogram('lottery_http_request_template_seconds', 'Template render time per request.',
+                                     ('endpoint',))
+SQL_QUERIES = CounterMetric('lottery_sql_queries_total', 'SQL statements executed, by endpoint ("background" '
+                            'for the bot, scheduler and dispatcher).', ('endpoint',))
+SQL_SECONDS = CounterMetric('lottery_sql_seconds_total', 'Time spent in SQL, by endpoint.', ('endpoint',))
+SLOW_REQUESTS = CounterMetric('lottery_slow_requests_total', 'Requests over the slow-request or query-count '
+                              'threshold.', ('endpoint', 'reason'))
+BOT_HANDLER_SECONDS = Histogram('lottery_bot_handler_duration_seconds', 'Telegram handler latency.',
+                                ('handler', 'outcome'))
+ADMISSION_DECISIONS = CounterMetric('lottery_reservation_admission_total', 'Reservation attempts by admission '
+                                    'outcome: admitted, or the rejection reason.', ('outcome',))
+RESPONSE_BYTES = CounterMetric('lottery_http_response_bytes_total', 'Bytes of text responses sent, by content '
+                               'coding (streamed responses not included).', ('coding',))
+
+
+# ---------------- Bot Handlers ----------------
+def timed_handler(handler):
+    """Decorator for async Telegram handlers: records their latency and whether they raised."""
+    @wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await handler(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            BOT_HANDLER_SECONDS.observe(time.perf_counter() - started, handler.__name__, outcome)
+    return wrapper
+
+
+# ---------------- Flask / SQLAlchemy Hooks ----------------
+_LITERALS = re.compile(r"'[^']*'|\b\d+\b")
+
+
+def _statement_shape(statement):
+    """SQL with literals folded, so the same query with different ids counts as one shape."""
+    return ' '.join(_LITERALS.sub('?', statement).split())[:200]
+
+
+def init_metrics(flask_app, db):
+    """Hooks request, SQL and template timing into the app and registers GET /metrics."""
+    if not flask_app.config['METRICS_ENABLED']:
+        return
+    with flask_app.app_context():
+        engine = db.engine
+    slow_ms = flask_app.config['SLOW_REQUEST_MS']
+    query_threshold = flask_app.config['N_PLUS_ONE_QUERY_THRESHOLD']
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if has_request_context() and 'metrics_started' in g:
+            g.sql_count += 1
+            g.sql_seconds += elapsed
+            g.sql_shapes[_statement_shape(statement)] += 1
+            endpoint = request.endpoint or 'unknown'
+        else:
+            endpoint = 'background'
+        SQL_QUERIES.inc(1, endpoint)
+        SQL_SECONDS.inc(elapsed, endpoint)
+
+    @event.listens_for(engine, 'handle_error')
+    def drop_failed_query(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started'):
+            connection.info['query_started'].pop()
+
+    def before_render(sender, template, context, **extra):
+        if 'metrics_started' in g:
+            g.template_started.append(time.perf_counter())
+
+    def rendered(sender, template, context, **extra):
+        if 'metrics_started' in g and g.template_started:
+            started = g.template_started.pop()
+            if not g.template_started:  # Count nested includes/extends once
+                g.template_seconds += time.perf_counter() - started
+
+    before_render_template.connect(before_render, flask_app, weak=False)
+    template_rendered.connect(rendered, flask_app, weak=False)
+
+    @flask_app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_shapes = Counter()
+        g.template_started = []
+        g.template_seconds = 0.0
+
+    @flask_app.after_request
+    def record_request_metrics(response):
+        if 'metrics_started' not in g or request.endpoint == 'metrics':
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_SECONDS.observe(elapsed, endpoint, request.method, response.status_code)
+        REQUEST_QUERIES.observe(g.sql_count, endpoint)
+        REQUEST_SQL_SECONDS.observe(g.sql_seconds, endpoint)
+        REQUEST_TEMPLATE_SECONDS.observe(g.template_seconds, endpoint)
+
+        reasons = []
+        if elapsed * 1000 > slow_ms:
+            reasons.append('slow')
+        if g.sql_count > query_threshold:
+            reasons.append('queries')
+        for reason in reasons:
+            SLOW_REQUESTS.inc(1, endpoint, reason)
+        if reasons:
+            shape, repeats = g.sql_shapes.most_common(1)[0] if g.sql_shapes else ('', 0)
+            hint = f"; likely N+1: {repeats}x {shape}" if repeats > query_threshold // 2 else ''
+            flask_app.logger.warning(
+                f"Slow request {request.method} {request.path} ({endpoint}): {elapsed * 1000:.0f} ms, "
+                f"{g.sql_count} queries in {g.sql_seconds * 1000:.0f} ms, "
+                f"templates {g.template_seconds * 1000:.0f} ms{hint}")
+        return response
+
+    def metrics():
+        token = flask_app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+        lines = []
+        for metric in (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, REQUEST_TEMPLATE_SECONDS,
+                       SQL_QUERIES, SQL_SECONDS, SLOW_REQUESTS, BOT_HANDLER_SECONDS, ADMISSION_DECISIONS,
+                       RESPONSE_BYTES):
+            lines.extend(metric.render())
+        lines.extend(_scrape_gauges(flask_app, db))
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    flask_app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def _scrape_gauges(flask_app, db):
+    from models import Notification
+    from db_pool import pool_snapshot
+    statuses = ('pending', 'sending', 'failed')
+    depth = dict(db.session.query(Notification.status, db.func.count(Notification.id))
+                           .filter(Notification.status.in_(statuses))
+                           .group_by(Notification.status).all())
+    lines = _gauge_lines('lottery_notification_queue', 'Telegram notifications waiting in the outbox, by status.',
+                         [({'status': status}, depth.get(status, 0)) for status in statuses])
+    pool = pool_snapshot(flask_app, db)
+    for key in ('checked_out', 'peak_checked_out', 'timeouts', 'avg_wait_ms', 'wait_ms_max'):
+        if key in pool:
+            lines.extend(_gauge_lines(f'lottery_db_pool_{key}', f'Database pool {key.replace("_", " ")}.',
+                                      [({}, pool[key])]))
+    return lines
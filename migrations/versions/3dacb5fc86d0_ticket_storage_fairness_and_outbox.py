@@ -0,0 +1,98 @@
+"""ticket storage, fairness and outbox tables
+
+Adds the ticket_event change log, the notification outbox and the Draw
+columns for ticket generation, sparse storage, the availability bitmap,
+denormalized counters and the seed commitment. Existing draws are dense and
+fully generated, so their counters are backfilled from the ticket table.
+
+Revision ID: 3dacb5fc86d0
+Revises: 5aef7bbe5571
+Create Date: 2026-10-17 02:07:18.751648
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3dacb5fc86d0'
+down_revision = '5aef7bbe5571'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.create_index('ix_notification_status_next_attempt', ['status', 'next_attempt_at'], unique=False)
+
+    op.create_table('ticket_event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('draw_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('ticket_number', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['draw_id'], ['draw.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ticket_event', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_event_draw_version', ['draw_id', 'version'], unique=False)
+
+    with op.batch_alter_table('draw', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tickets_generated', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('sparse_tickets', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column('tickets_version', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('availability_bitmap', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('bitmap_version', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('pending_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('approved_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('won_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('server_seed', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('seed_commitment', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('prize_tiers', sa.String(length=100), nullable=False, server_default='40,20,10'))
+        batch_op.add_column(sa.Column('approved_at_draw', sa.Integer(), nullable=True))
+
+    # Draws created before this revision stored every ticket row up front
+    op.execute("""
+        UPDATE draw SET
+            tickets_generated = (SELECT COUNT(*) FROM ticket WHERE ticket.draw_id = draw.id),
+            pending_count = (SELECT COUNT(*) FROM ticket WHERE ticket.draw_id = draw.id AND ticket.status = 'pending_payment'),
+            approved_count = (SELECT COUNT(*) FROM ticket WHERE ticket.draw_id = draw.id AND ticket.status = 'approved'),
+            won_count = (SELECT COUNT(*) FROM ticket WHERE ticket.draw_id = draw.id AND ticket.status = 'won')
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('draw', schema=None) as batch_op:
+        batch_op.drop_column('approved_at_draw')
+        batch_op.drop_column('prize_tiers')
+        batch_op.drop_column('seed_commitment')
+        batch_op.drop_column('server_seed')
+        batch_op.drop_column('won_count')
+        batch_op.drop_column('approved_count')
+        batch_op.drop_column('pending_count')
+        batch_op.drop_column('bitmap_version')
+        batch_op.drop_column('availability_bitmap')
+        batch_op.drop_column('tickets_version')
+        batch_op.drop_column('sparse_tickets')
+        batch_op.drop_column('tickets_generated')
+
+    with op.batch_alter_table('ticket_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_event_draw_version')
+    op.drop_table('ticket_event')
+
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_status_next_attempt')
+    op.drop_table('notification')
@@ -0,0 +1,57 @@
+"""payment proofs
+
+Revision ID: 47cd9a9c772a
+Revises: d9a3f5b17c22
+Create Date: 2026-10-17 02:38:43.628902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '47cd9a9c772a'
+down_revision = 'd9a3f5b17c22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payment_proof',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_telegram_id', sa.BigInteger(), nullable=False),
+        sa.Column('user_username', sa.String(length=80), nullable=True),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('storage_path', sa.String(length=255), nullable=False),
+        sa.Column('thumbnail_path', sa.String(length=255), nullable=True),
+        sa.Column('size_bytes', sa.Integer(), nullable=False),
+        sa.Column('telegram_file_unique_id', sa.String(length=64), nullable=True),
+        sa.Column('duplicate_of_id', sa.Integer(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['duplicate_of_id'], ['payment_proof.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('payment_proof', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_proof_sha256', ['sha256', 'id'], unique=False)
+        batch_op.create_index('ix_payment_proof_user', ['user_telegram_id', 'received_at'], unique=False)
+    op.create_table('payment_proof_ticket',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('proof_id', sa.Integer(), nullable=False),
+        sa.Column('draw_id', sa.Integer(), nullable=False),
+        sa.Column('ticket_number', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['draw_id'], ['draw.id'], ),
+        sa.ForeignKeyConstraint(['proof_id'], ['payment_proof.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('payment_proof_ticket', schema=None) as batch_op:
+        batch_op.create_index('ix_payment_proof_ticket_draw_number', ['draw_id', 'ticket_number'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment_proof_ticket', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_proof_ticket_draw_number')
+    op.drop_table('payment_proof_ticket')
+    with op.batch_alter_table('payment_proof', schema=None) as batch_op:
+        batch_op.drop_index('ix_payment_proof_user')
+        batch_op.drop_index('ix_payment_proof_sha256')
+    op.drop_table('payment_proof')
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""initial schema
+
+The tables as db.create_all() used to build them before migrations existed.
+Databases created that way are stamped at this revision on first upgrade.
+
+Revision ID: 5aef7bbe5571
+Revises: 
+Create Date: 2026-10-17 02:07:00.111075
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5aef7bbe5571'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('admin_user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=20), nullable=False),
+        sa.Column('password', sa.String(length=60), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('draw',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('total_tickets', sa.Integer(), nullable=False),
+        sa.Column('ticket_price', sa.Float(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('draw_time', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('is_drawn', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('ticket',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('draw_id', sa.Integer(), nullable=False),
+        sa.Column('ticket_number', sa.Integer(), nullable=False),
+        sa.Column('user_telegram_id', sa.BigInteger(), nullable=True),
+        sa.Column('user_username', sa.String(length=80), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('reserved_at', sa.DateTime(), nullable=True),
+        sa.Column('approved_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['draw_id'], ['draw.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('draw_id', 'ticket_number', name='_draw_ticket_uc')
+    )
+    op.create_table('winner',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('draw_id', sa.Integer(), nullable=False),
+        sa.Column('ticket_id', sa.Integer(), nullable=False),
+        sa.Column('place', sa.Integer(), nullable=False),
+        sa.Column('prize_amount', sa.Float(), nullable=False),
+        sa.Column('won_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['draw_id'], ['draw.id'], ),
+        sa.ForeignKeyConstraint(['ticket_id'], ['ticket.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('winner')
+    op.drop_table('ticket')
+    op.drop_table('draw')
+    op.drop_table('admin_user')
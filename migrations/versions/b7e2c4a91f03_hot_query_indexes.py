@@ -0,0 +1,43 @@
+"""hot query indexes
+
+Indexes behind the queries that run on every page view, reservation and
+sweep. On PostgreSQL they are built CONCURRENTLY so a large ticket table
+stays writable while the migration runs.
+
+Revision ID: b7e2c4a91f03
+Revises: 3dacb5fc86d0
+Create Date: 2026-10-17 02:15:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c4a91f03'
+down_revision = '3dacb5fc86d0'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # (name, table, columns)
+    ('ix_ticket_draw_status_number', 'ticket', ['draw_id', 'status', 'ticket_number']),
+    ('ix_ticket_user_telegram_id', 'ticket', ['user_telegram_id', 'draw_id']),
+    ('ix_ticket_status_reserved_at', 'ticket', ['status', 'reserved_at']),
+    ('ix_draw_active_drawn_created', 'draw', ['is_active', 'is_drawn', 'created_at']),
+    ('ix_draw_draw_time', 'draw', ['draw_time']),
+]
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            # if_not_exists: databases built by the old create_all() may already have some of these
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=postgresql)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,75 @@
+"""winner snapshots
+
+Denormalized public copy of each winner for the /winners feed, backfilled
+from the existing winners.
+
+Revision ID: c41f8d2e6a7b
+Revises: b7e2c4a91f03
+Create Date: 2026-10-17 02:41:12.530947
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f8d2e6a7b'
+down_revision = 'b7e2c4a91f03'
+branch_labels = None
+depends_on = None
+
+
+def _mask(username, telegram_id):
+    # Same rule as draw_engine.mask_username, frozen here so the migration never changes
+    if username:
+        name = username.lstrip('@')
+        return '@' + (name[:2] + '***' + name[-2:] if len(name) > 4 else name[:1] + '***')
+    digits = str(telegram_id or '')
+    return digits[:2] + '****' + digits[-2:] if len(digits) > 4 else '****'
+
+
+def upgrade():
+    snapshots = op.create_table('winner_snapshot',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('winner_id', sa.Integer(), nullable=True),
+        sa.Column('draw_id', sa.Integer(), nullable=False),
+        sa.Column('draw_name', sa.String(length=100), nullable=False),
+        sa.Column('draw_time', sa.DateTime(), nullable=False),
+        sa.Column('place', sa.Integer(), nullable=False),
+        sa.Column('prize_amount', sa.Float(), nullable=False),
+        sa.Column('ticket_number', sa.Integer(), nullable=False),
+        sa.Column('masked_username', sa.String(length=80), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['draw_id'], ['draw.id'], ),
+        sa.ForeignKeyConstraint(['winner_id'], ['winner.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('winner_snapshot', schema=None) as batch_op:
+        batch_op.create_index('ix_winner_snapshot_feed', ['draw_time', 'draw_id', 'place'], unique=False)
+
+    rows = op.get_bind().execute(sa.text("""
+        SELECT winner.id, winner.draw_id, draw.name, COALESCE(draw.draw_time, winner.won_at) AS draw_time,
+               winner.place, winner.prize_amount, winner.won_at, ticket.ticket_number,
+               ticket.user_username, ticket.user_telegram_id
+        FROM winner
+        JOIN draw ON draw.id = winner.draw_id
+        JOIN ticket ON ticket.id = winner.ticket_id
+    """).columns(draw_time=sa.DateTime(), won_at=sa.DateTime())).all()
+    if rows:
+        op.bulk_insert(snapshots, [{
+            'winner_id': row.id,
+            'draw_id': row.draw_id,
+            'draw_name': row.name,
+            'draw_time': row.draw_time,
+            'place': row.place,
+            'prize_amount': row.prize_amount,
+            'ticket_number': row.ticket_number,
+            'masked_username': _mask(row.user_username, row.user_telegram_id),
+            'created_at': row.won_at,
+        } for row in rows])
+
+
+def downgrade():
+    with op.batch_alter_table('winner_snapshot', schema=None) as batch_op:
+        batch_op.drop_index('ix_winner_snapshot_feed')
+    op.drop_table('winner_snapshot')
@@ -0,0 +1,41 @@
+"""draw archive and purge state
+
+Revision ID: d9a3f5b17c22
+Revises: c41f8d2e6a7b
+Create Date: 2026-10-17 02:58:36.214508
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a3f5b17c22'
+down_revision = 'c41f8d2e6a7b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('draw_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('draw_id', sa.Integer(), nullable=False),
+        sa.Column('format', sa.Integer(), nullable=False),
+        sa.Column('ticket_count', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['draw_id'], ['draw.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('draw_id')
+    )
+    with op.batch_alter_table('draw', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('purge_state', sa.String(length=20), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('draw', schema=None) as batch_op:
+        batch_op.drop_column('purge_state')
+        batch_op.drop_column('archived_at')
+    op.drop_table('draw_archive')
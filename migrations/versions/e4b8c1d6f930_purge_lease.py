@@ -0,0 +1,26 @@
+"""purge lease
+
+Revision ID: e4b8c1d6f930
+Revises: 47cd9a9c772a
+Create Date: 2026-10-17 09:12:27.406113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8c1d6f930'
+down_revision = '47cd9a9c772a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('draw', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('purge_lease_until', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('draw', schema=None) as batch_op:
+        batch_op.drop_column('purge_lease_until')
@@ -1,14 +1,18 @@
 # models.py
+import os
 from datetime import datetime, timedelta
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
+from flask_migrate import Migrate
 from datetime import datetime, timedelta # Make sure datetime and timedelta are imported if used here
 
 # Initialize these globally, but they will be initialized with the app
 # inside the create_app() function. This avoids circular imports.
 db = SQLAlchemy()
 bcrypt = Bcrypt()
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+migrate = Migrate(directory=MIGRATIONS_DIR, render_as_batch=True) # Schema changes go through Alembic revisions
 login_manager = None # Will be initialized in app.py
 
 # A placeholder for load_user before login_manager is fully set up
@@ -23,6 +27,25 @@ def init_login_manager(lm_instance):
         return AdminUser.query.get(int(user_id))
 
 
+# Revisions matching databases built by db.create_all() before migrations existed
+BASELINE_REVISION = '5aef7bbe5571'   # original four tables
+PRE_INDEX_REVISION = '3dacb5fc86d0'  # with ticket storage / outbox columns, before the hot-query indexes
+
+def upgrade_schema():
+    """
+    Brings the database to the latest migration. A database created by the old
+    create_all() has no alembic_version table, so it is stamped at the revision
+    its columns match before upgrading. Needs an app context.
+    """
+    from flask_migrate import upgrade, stamp
+    inspector = db.inspect(db.engine)
+    tables = inspector.get_table_names()
+    if 'draw' in tables and 'alembic_version' not in tables:
+        draw_columns = {column['name'] for column in inspector.get_columns('draw')}
+        stamp(revision=PRE_INDEX_REVISION if 'prize_tiers' in draw_columns else BASELINE_REVISION)
+    upgrade()
+
+
 class AdminUser(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
@@ -39,6 +62,14 @@ class AdminUser(db.Model, UserMixin):
         return f"AdminUser('{self.username}')"
 
 
+# Ticket status -> Draw counter column
+STATUS_COUNTER_COLUMNS = {
+    'pending_payment': 'pending_count',
+    'approved': 'approved_count',
+    'won': 'won_count',
+}
+
+
 class Draw(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -48,36 +79,77 @@ class Draw(db.Model):
     draw_time = db.Column(db.DateTime, nullable=True) # When the draw is executed
     is_active = db.Column(db.Boolean, default=True) # Can users buy tickets for it?
     is_drawn = db.Column(db.Boolean, default=False) # Has the draw been executed?
+    tickets_generated = db.Column(db.Integer, nullable=False, default=0) # Ticket rows created so far
+    sparse_tickets = db.Column(db.Boolean, nullable=False, default=False) # Only claimed tickets are stored as rows
+    tickets_version = db.Column(db.Integer, nullable=False, default=0) # Bumped on every ticket state change
+    availability_bitmap = db.deferred(db.Column(db.LargeBinary, nullable=True)) # Bit n-1 set = ticket n claimed
+    bitmap_version = db.Column(db.Integer, nullable=True) # tickets_version the stored bitmap was built from
+    # Denormalized ticket counters, kept in step by every write path (see ticket_store.mark_tickets_changed)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    won_count = db.Column(db.Integer, nullable=False, default=0)
+    # Commit-reveal fairness: the sha256 of server_seed is public from creation, the seed once drawn (see draw_engine)
+    server_seed = db.deferred(db.Column(db.String(64), nullable=True))
+    seed_commitment = db.Column(db.String(64), nullable=True)
+    prize_tiers = db.Column(db.String(100), nullable=False, default='40,20,10') # Percent of the pot per place
+    approved_at_draw = db.Column(db.Integer, nullable=True) # Approved ticket count the winners were drawn from
+    # Lifecycle of finished draws (see draw_archive): claimed tickets compacted into a DrawArchive,
+    # and 'resetting' / 'deleting' while a background purge removes the rows in batches
+    archived_at = db.Column(db.DateTime, nullable=True)
+    purge_state = db.Column(db.String(20), nullable=True)
+    purge_lease_until = db.Column(db.DateTime, nullable=True) # Held by the thread purging the rows (see finish_purge)
     tickets = db.relationship('Ticket', backref='draw', lazy=True)
     winners = db.relationship('Winner', backref='draw', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_draw_active_drawn_created', 'is_active', 'is_drawn', 'created_at'), # Home page listing
+        db.Index('ix_draw_draw_time', 'draw_time'), # Winners page
+    )
+
     def get_status_counts(self):
-        # Initialize all possible statuses to 0
+        # Read from the counter columns, so listing N draws costs no extra queries
         status_counts = {
             'available': 0,
-            'pending_payment': 0,
-            'approved': 0,
-            'won': 0,
-            'rejected': 0 # Ensure all possible Ticket statuses are listed here
+            'pending_payment': self.pending_count or 0,
+            'approved': self.approved_count or 0,
+            'won': self.won_count or 0,
+            'rejected': 0 # Rejected tickets go straight back to available
         }
- # Query counts from the database
-        # This performs a database query to get the count for each status.
-        ticket_counts = db.session.query(Ticket.status, db.func.count(Ticket.id))\
-                                  .filter_by(draw_id=self.id)\
-                                  .group_by(Ticket.status)\
-                                  .all()
-                                  # Update the initialized dictionary with actual counts from the query
-        for status, count in ticket_counts:
-            if status in status_counts: # Only update if the status is one we're tracking
-                status_counts[status] = count
-
+        # Sparse draws never store available rows; dense draws have as many rows as were generated
+        stored_tickets = self.total_tickets if self.sparse_tickets else (self.tickets_generated or 0)
+        claimed = status_counts['pending_payment'] + status_counts['approved'] + status_counts['won']
+        status_counts['available'] = max(stored_tickets - claimed, 0)
         return status_counts
 
+    @property
+    def is_generating(self):
+        if self.sparse_tickets:
+            return False
+        return (self.tickets_generated or 0) < self.total_tickets
+
+    @classmethod
+    def recount_status_counts(cls, draw_ids):
+        """
+        Rebuilds the counter columns for many draws with a single GROUP BY over
+        the ticket table. Used to repair or backfill counters; caller commits.
+        """
+        draw_ids = list(draw_ids)
+        if not draw_ids:
+            return
+        counts = {draw_id: {} for draw_id in draw_ids}
+        rows = db.session.query(Ticket.draw_id, Ticket.status, db.func.count(Ticket.id))\
+                         .filter(Ticket.draw_id.in_(draw_ids), Ticket.status != 'available')\
+                         .group_by(Ticket.draw_id, Ticket.status)\
+                         .all()
+        for draw_id, status, count in rows:
+            counts[draw_id][status] = count
+        for draw_id, by_status in counts.items():
+            values = {column: by_status.get(status, 0) for status, column in STATUS_COUNTER_COLUMNS.items()}
+            db.session.query(cls).filter(cls.id == draw_id).update(values, synchronize_session='fetch')
+
     # Make sure to also include the get_collected_pot method as it's used in admin_draw_details.html
     def get_collected_pot(self):
-        approved_tickets_count = db.session.query(db.func.count(Ticket.id))\
-                                          .filter_by(draw_id=self.id, status='approved')\
-                                          .scalar()
+        approved_tickets_count = self.approved_count or 0
         return approved_tickets_count * self.ticket_price if approved_tickets_count else 0.0
 
     # ... other methods and attributes of the Draw model ...
@@ -101,7 +173,12 @@ class Ticket(db.Model):
     reserved_at = db.Column(db.DateTime, nullable=True) # When reservation happened
     approved_at = db.Column(db.DateTime, nullable=True) # When admin approved payment
 
-    __table_args__ = (db.UniqueConstraint('draw_id', 'ticket_number', name='_draw_ticket_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('draw_id', 'ticket_number', name='_draw_ticket_uc'),
+        db.Index('ix_ticket_status_reserved_at', 'status', 'reserved_at'), # Expiry sweeper
+        db.Index('ix_ticket_draw_status_number', 'draw_id', 'status', 'ticket_number'), # Admin table, draw engine
+        db.Index('ix_ticket_user_telegram_id', 'user_telegram_id', 'draw_id'), # Per-user lookups
+    )
 
     def __repr__(self):
         return f"<Ticket {self.draw.name} #{self.ticket_number} - Status: {self.status}>"
@@ -118,3 +195,102 @@ class Winner(db.Model):
 
     def __repr__(self):
         return f"<Winner Draw {self.draw_id} - {self.place} Place - Ticket #{self.ticket.ticket_number}>"
+
+class WinnerSnapshot(db.Model):
+    """Public copy of a winner, written once at draw execution; the winners feed reads only this table."""
+    id = db.Column(db.Integer, primary_key=True)
+    winner_id = db.Column(db.Integer, db.ForeignKey('winner.id'), nullable=True)
+    draw_id = db.Column(db.Integer, db.ForeignKey('draw.id'), nullable=False)
+    draw_name = db.Column(db.String(100), nullable=False)
+    draw_time = db.Column(db.DateTime, nullable=False)
+    place = db.Column(db.Integer, nullable=False)
+    prize_amount = db.Column(db.Float, nullable=False)
+    ticket_number = db.Column(db.Integer, nullable=False)
+    masked_username = db.Column(db.String(80), nullable=False) # e.g. @ab***yz
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_winner_snapshot_feed', 'draw_time', 'draw_id', 'place'),)
+
+    def __repr__(self):
+        return f"<WinnerSnapshot {self.draw_name} - {self.place} Place - Ticket #{self.ticket_number}>"
+
+class DrawArchive(db.Model):
+    """Compressed NDJSON copy of an archived draw: a header with the draw and winners, then its claimed tickets."""
+    id = db.Column(db.Integer, primary_key=True)
+    draw_id = db.Column(db.Integer, db.ForeignKey('draw.id'), nullable=False, unique=True)
+    format = db.Column(db.Integer, nullable=False, default=1)
+    ticket_count = db.Column(db.Integer, nullable=False)
+    payload = db.deferred(db.Column(db.LargeBinary, nullable=False)) # zlib-compressed NDJSON
+    sha256 = db.Column(db.String(64), nullable=False) # Of the uncompressed NDJSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<DrawArchive Draw {self.draw_id} - {self.ticket_count} tickets>"
+
+class TicketEvent(db.Model):
+    """Append-only log of ticket status changes, one row per ticket per Draw.tickets_version."""
+    id = db.Column(db.Integer, primary_key=True)
+    draw_id = db.Column(db.Integer, db.ForeignKey('draw.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False) # Draw.tickets_version after the change
+    ticket_number = db.Column(db.Integer, nullable=True) # None for draw-wide events (reset)
+    status = db.Column(db.String(20), nullable=False) # New status, or 'reset'
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_ticket_event_draw_version', 'draw_id', 'version'),)
+
+    def __repr__(self):
+        return f"<TicketEvent Draw {self.draw_id} v{self.version} #{self.ticket_number} -> {self.status}>"
+
+class Notification(db.Model):
+    """Telegram message outbox. Web requests and the scheduler only insert rows; the dispatcher sends them."""
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.BigInteger, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Also the lease expiry while sending
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_notification_status_next_attempt', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f"<Notification {self.id} to {self.chat_id} - {self.status}>"
+
+class PaymentProof(db.Model):
+    """A payment screenshot sent to the bot. The file is stored once per content hash; resends point at the first."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_telegram_id = db.Column(db.BigInteger, nullable=False)
+    user_username = db.Column(db.String(80), nullable=True)
+    sha256 = db.Column(db.String(64), nullable=False) # Content address of the file
+    storage_path = db.Column(db.String(255), nullable=False) # Relative to PAYMENT_PROOF_DIR
+    thumbnail_path = db.Column(db.String(255), nullable=True) # None without Pillow or for unreadable images
+    size_bytes = db.Column(db.Integer, nullable=False)
+    telegram_file_unique_id = db.Column(db.String(64), nullable=True)
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('payment_proof.id'), nullable=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    duplicate_of = db.relationship('PaymentProof', remote_side=[id])
+
+    __table_args__ = (
+        db.Index('ix_payment_proof_sha256', 'sha256', 'id'), # Dedup lookup: first upload of a hash
+        db.Index('ix_payment_proof_user', 'user_telegram_id', 'received_at'),
+    )
+
+    def __repr__(self):
+        return f"<PaymentProof {self.id} from {self.user_telegram_id} - {self.sha256[:12]}>"
+
+class PaymentProofTicket(db.Model):
+    """
+    Links a proof to the tickets its sender had pending when it arrived. Keyed by
+    ticket number rather than ticket id: sparse tickets are deleted on release.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    proof_id = db.Column(db.Integer, db.ForeignKey('payment_proof.id'), nullable=False)
+    draw_id = db.Column(db.Integer, db.ForeignKey('draw.id'), nullable=False)
+    ticket_number = db.Column(db.Integer, nullable=False)
+
+    proof = db.relationship('PaymentProof', backref='ticket_links')
+
+    __table_args__ = (db.Index('ix_payment_proof_ticket_draw_number', 'draw_id', 'ticket_number'),)
@@ -0,0 +1,224 @@
+# notifications.py
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from telegram.error import RetryAfter, Forbidden, BadRequest, TelegramError
+
+from models import db, Notification
+
+
+# ---------------- Outbox ----------------
+def enqueue_notification(chat_id, text):
+    """
+    Queues a Telegram message in the outbox as part of the caller's transaction,
+    so it is only sent if the change that triggered it is committed.
+    """
+    if not chat_id:
+        return None
+    notification = Notification(chat_id=int(chat_id), text=text)
+    db.session.add(notification)
+    return notification
+
+
+def pending_notification_count():
+    return db.session.query(db.func.count(Notification.id))\
+                     .filter(Notification.status.in_(('pending', 'sending')))\
+                     .scalar()
+
+
+# ---------------- Rate Limiting ----------------
+class RateLimiter:
+    """Async token bucket: at most `rate` acquisitions per second, bursting up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ---------------- Dispatcher ----------------
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class NotificationDispatcher:
+    """
+    Drains the Notification outbox from a single asyncio task.
+
+    Due rows are leased in batches (status='sending', next_attempt_at pushed
+    past the lease), sent concurrently under a global token bucket and a
+    per-chat spacing that match Telegram's limits, and then marked sent,
+    rescheduled with exponential backoff, or failed for good. A crashed
+    dispatcher's leases simply expire and the rows are picked up again.
+    """
+
+    def __init__(self, flask_app, bot):
+        config = flask_app.config
+        self.app = flask_app
+        self.bot = bot
+        self.limiter = RateLimiter(config['NOTIFY_GLOBAL_RATE'])
+        self.per_chat_interval = config['NOTIFY_PER_CHAT_INTERVAL']
+        self.batch_size = config['NOTIFY_BATCH_SIZE']
+        self.max_attempts = config['NOTIFY_MAX_ATTEMPTS']
+        self.idle_seconds = config['NOTIFY_IDLE_SECONDS']
+        self.lease_seconds = 60
+        self._chat_next_send = {}
+        self._chat_locks = {}
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'queue_depth': 0, 'last_batch_per_second': 0.0}
+
+    # --- database side (runs in worker threads) ---
+    def _claim_batch(self):
+        """
+        Leases up to batch_size due notifications and returns only the rows this
+        dispatcher won. The UPDATE re-checks that each row is still due, so when
+        several dispatchers run (one per uvicorn worker, or `python notifications.py`
+        next to the web app) a message is never leased, and sent, twice.
+        """
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                table = Notification.__table__
+                due = (table.c.status.in_(('pending', 'sending')), table.c.next_attempt_at <= now)
+                candidates = select(table.c.id).where(*due)\
+                                               .order_by(table.c.next_attempt_at, table.c.id)\
+                                               .limit(self.batch_size)
+                if db.engine.dialect.name == 'postgresql':
+                    # Concurrent dispatchers take disjoint batches instead of racing for the same rows
+                    candidates = candidates.with_for_update(skip_locked=True)
+                ids = list(db.session.execute(candidates).scalars())
+                if not ids:
+                    self.stats['queue_depth'] = pending_notification_count()
+                    return []
+                lease = {'status': 'sending', 'next_attempt_at': now + timedelta(seconds=self.lease_seconds)}
+                columns = (table.c.id, table.c.chat_id, table.c.text, table.c.attempts)
+                if db.engine.dialect.update_returning:
+                    rows = db.session.execute(
+                        update(table).where(table.c.id.in_(ids), *due).values(lease).returning(*columns)
+                    ).all()
+                else:
+                    won = [notification_id for notification_id in ids
+                           if db.session.execute(update(table).where(table.c.id == notification_id, *due)
+                                                              .values(lease)).rowcount == 1]
+                    rows = db.session.execute(select(*columns).where(table.c.id.in_(won))).all() if won else []
+                db.session.commit()
+                self.stats['queue_depth'] = pending_notification_count()
+                return rows
+            finally:
+                db.session.remove()
+
+    def _record_results(self, results):
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                table = Notification.__table__
+                for notification_id, outcome, attempts, error, retry_in in results:
+                    if outcome == 'sent':
+                        values = {'status': 'sent', 'sent_at': now, 'attempts': attempts, 'last_error': None}
+                    elif outcome == 'retry':
+                        values = {'status': 'pending', 'attempts': attempts, 'last_error': error,
+                                  'next_attempt_at': now + timedelta(seconds=retry_in)}
+                    else:
+                        values = {'status': 'failed', 'attempts': attempts, 'last_error': error}
+                    db.session.execute(update(table).where(table.c.id == notification_id).values(values))
+                db.session.commit()
+            finally:
+                db.session.remove()
+
+    # --- sending side ---
+    async def _wait_for_chat(self, chat_id):
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            delay = self._chat_next_send.get(chat_id, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._chat_next_send[chat_id] = time.monotonic() + self.per_chat_interval
+
+    async def _send_one(self, row):
+        attempts = row.attempts + 1
+        await self._wait_for_chat(row.chat_id)
+        await self.limiter.acquire()
+        try:
+            await self.bot.send_message(chat_id=row.chat_id, text=row.text)
+            return row.id, 'sent', attempts, None, 0
+        except RetryAfter as e:
+            # Flood control: Telegram tells us exactly how long to back off
+            return row.id, 'retry', row.attempts, str(e)[:255], _seconds(e.retry_after)
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot, deleted chat, malformed text: retrying will not help
+            return row.id, 'failed', attempts, str(e)[:255], 0
+        except TelegramError as e:
+            if attempts >= self.max_attempts:
+                return row.id, 'failed', attempts, str(e)[:255], 0
+            return row.id, 'retry', attempts, str(e)[:255], min(2 ** attempts, 300)
+
+    async def dispatch_once(self):
+        """Sends one leased batch. Returns the number of notifications handled."""
+        rows = await asyncio.to_thread(self._claim_batch)
+        if not rows:
+            return 0
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._send_one(row) for row in rows))
+        await asyncio.to_thread(self._record_results, results)
+
+        for _, outcome, _, _, _ in results:
+            key = {'sent': 'sent', 'retry': 'retried'}.get(outcome, 'failed')
+            self.stats[key] += 1
+        elapsed = time.perf_counter() - started
+        self.stats['last_batch_per_second'] = round(len(rows) / elapsed, 1) if elapsed else 0.0
+        if len(self._chat_next_send) > 10000:
+            now = time.monotonic()
+            self._chat_next_send = {k: v for k, v in self._chat_next_send.items() if v > now}
+            self._chat_locks = {k: v for k, v in self._chat_locks.items() if k in self._chat_next_send}
+        return len(rows)
+
+    async def run_forever(self):
+        print("✅ Notification dispatcher started")
+        while True:
+            try:
+                handled = await self.dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Notification dispatch failed: {e}")
+                handled = 0
+            if not handled:
+                await asyncio.sleep(self.idle_seconds)
+
+
+def build_bot(flask_app):
+    """Standalone Bot for the dispatcher; TELEGRAM_API_BASE_URL points it at a local fake API."""
+    from telegram import Bot
+    token = flask_app.config.get('TELEGRAM_BOT_TOKEN')
+    if not token:
+        return None
+    base_url = flask_app.config.get('TELEGRAM_API_BASE_URL')
+    return Bot(token, base_url=base_url) if base_url else Bot(token)
+
+
+async def _run_standalone(flask_app):
+    bot = build_bot(flask_app)
+    if bot is None:
+        print("⚠️ TELEGRAM_BOT_TOKEN not set; nothing to dispatch with")
+        return
+    async with bot:
+        await NotificationDispatcher(flask_app, bot).run_forever()
+
+
+if __name__ == '__main__':
+    from app import app as flask_app
+    asyncio.run(_run_standalone(flask_app))
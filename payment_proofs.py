@@ -0,0 +1,129 @@
+# payment_proofs.py
+import os
+import asyncio
+import hashlib
+import tempfile
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.orm import joinedload
+
+from models import db, Draw, Ticket, PaymentProof, PaymentProofTicket
+
+# Pillow is optional: without it proofs are stored and linked, just shown full size in the admin
+THUMBNAILS_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+_thumbnail_pool = None
+_thumbnail_pool_lock = threading.Lock()
+
+
+# ---------------- Content-Addressed Storage ----------------
+def _write_atomically(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def store_proof_file(root, data, extension):
+    """
+    Stores a screenshot under its SHA-256 (`ab/abcdef....jpg`) and returns
+    (sha256, relative path). A resent file hashes to the same path and is not
+    written again. Blocking: run it off the event loop.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    relative_path = f"{sha256[:2]}/{sha256}{extension}"
+    path = os.path.join(root, relative_path)
+    if not os.path.exists(path):
+        _write_atomically(path, lambda f: f.write(data))
+    return sha256, relative_path
+
+
+# ---------------- Thumbnails ----------------
+def _make_thumbnail(source, target, size):
+    """Runs in a worker process: decoding and resizing a photo is CPU-bound."""
+    from PIL import Image, ImageOps
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image = image.convert('RGB')
+        _write_atomically(target, lambda f: image.save(f, 'JPEG', quality=80))
+
+
+def thumbnail_pool(flask_app):
+    global _thumbnail_pool
+    with _thumbnail_pool_lock:
+        if _thumbnail_pool is None:
+            # Spawned, not forked: a fork of this threaded process (event loop, bot-db threads) would inherit
+            # held locks and the engine's open connections; the workers only import this module
+            _thumbnail_pool = ProcessPoolExecutor(max_workers=flask_app.config['PAYMENT_PROOF_THUMBNAIL_WORKERS'],
+                                                  mp_context=multiprocessing.get_context('spawn'))
+        return _thumbnail_pool
+
+
+async def make_thumbnail(flask_app, sha256, relative_path):
+    """Relative path of the proof's JPEG thumbnail, made in the process pool; None without Pillow or on failure."""
+    if not THUMBNAILS_AVAILABLE:
+        return None
+    root = flask_app.config['PAYMENT_PROOF_DIR']
+    thumbnail_path = f"thumbs/{sha256[:2]}/{sha256}.jpg"
+    if not os.path.exists(os.path.join(root, thumbnail_path)):
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                thumbnail_pool(flask_app), _make_thumbnail, os.path.join(root, relative_path),
+                os.path.join(root, thumbnail_path), flask_app.config['PAYMENT_PROOF_THUMBNAIL_PX'])
+        except Exception as e:
+            print(f"Thumbnail of {relative_path} failed: {e}")
+            return None
+    return thumbnail_path
+
+
+# ---------------- Records ----------------
+def record_payment_proof(user_telegram_id, user_username, sha256, storage_path, thumbnail_path, size_bytes,
+                         telegram_file_unique_id=None):
+    """
+    Saves a received proof and links it to every ticket its sender has pending.
+    Returns (linked [(draw name, ticket number)], when the same file was first
+    received, or None if it is new).
+    """
+    first = PaymentProof.query.filter_by(sha256=sha256).order_by(PaymentProof.id).first()
+    proof = PaymentProof(user_telegram_id=user_telegram_id, user_username=user_username, sha256=sha256,
+                         storage_path=storage_path, thumbnail_path=thumbnail_path, size_bytes=size_bytes,
+                         telegram_file_unique_id=telegram_file_unique_id, duplicate_of=first)
+    db.session.add(proof)
+    # Tickets of draws being reset or deleted are about to be purged, links and all
+    pending = db.session.query(Ticket.draw_id, Ticket.ticket_number, Draw.name)\
+                        .join(Draw, Draw.id == Ticket.draw_id)\
+                        .filter(Ticket.user_telegram_id == user_telegram_id, Ticket.status == 'pending_payment',
+                                Draw.purge_state.is_(None))\
+                        .order_by(Ticket.draw_id, Ticket.ticket_number)\
+                        .all()
+    db.session.add_all(PaymentProofTicket(proof=proof, draw_id=draw_id, ticket_number=number)
+                       for draw_id, number, _ in pending)
+    db.session.commit()
+    return [(name, number) for _, number, name in pending], (first.received_at if first else None)
+
+
+def proofs_for_tickets(draw_id, tickets):
+    """{ticket_number: [PaymentProof]} for a page of the admin table, only proofs sent by the ticket's holder."""
+    holders = {ticket.ticket_number: ticket.user_telegram_id for ticket in tickets if ticket.user_telegram_id}
+    if not holders:
+        return {}
+    links = PaymentProofTicket.query.options(joinedload(PaymentProofTicket.proof).joinedload(PaymentProof.duplicate_of))\
+                                    .filter(PaymentProofTicket.draw_id == draw_id,
+                                            PaymentProofTicket.ticket_number.in_(holders))\
+                                    .order_by(PaymentProofTicket.proof_id)\
+                                    .all()
+    proofs = {}
+    for link in links:
+        # A released number may have been taken by someone else since
+        if link.proof.user_telegram_id == holders[link.ticket_number]:
+            proofs.setdefault(link.ticket_number, []).append(link.proof)
+    return proofs
@@ -0,0 +1,88 @@
+# query_plans.py
+# EXPLAIN checks for the hot queries: `flask check-query-plans` exits non-zero
+# when any of them would scan a whole table instead of using an index.
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, Draw, Ticket, TicketEvent, Notification, WinnerSnapshot
+
+
+def hot_queries(draw_id=1, user_telegram_id=1):
+    """(name, statement) for every query that runs per page view, reservation, sweep or dispatch."""
+    now = datetime.utcnow()
+    return [
+        ('home: active draws',
+         select(Draw).where(Draw.is_active.is_(True), Draw.is_drawn.is_(False)).order_by(Draw.created_at.desc())),
+        ('winners feed: next page',
+         select(WinnerSnapshot).where(WinnerSnapshot.draw_time < now)
+                               .order_by(WinnerSnapshot.draw_time.desc(), WinnerSnapshot.draw_id.desc(),
+                                         WinnerSnapshot.place).limit(31)),
+        ('bitmap: claimed tickets of a draw',
+         select(Ticket.ticket_number, Ticket.status).where(Ticket.draw_id == draw_id, Ticket.status != 'available')),
+        ('admin table: tickets by status',
+         select(Ticket).where(Ticket.draw_id == draw_id, Ticket.status == 'pending_payment', Ticket.ticket_number > 0)
+                       .order_by(Ticket.ticket_number).limit(101)),
+        ('draw engine: approved ticket at offset',
+         select(Ticket).where(Ticket.draw_id == draw_id, Ticket.status == 'approved')
+                       .order_by(Ticket.ticket_number).offset(1000).limit(1)),
+        ('bot: tickets of a user',
+         select(Ticket).where(Ticket.user_telegram_id == user_telegram_id)),
+        ('sweeper: expired reservations',
+         select(Ticket.id).where(Ticket.status == 'pending_payment', Ticket.reserved_at < now)
+                          .order_by(Ticket.reserved_at).limit(500)),
+        ('grid: changes since a version',
+         select(TicketEvent).where(TicketEvent.draw_id == draw_id, TicketEvent.version > 0)
+                            .order_by(TicketEvent.version)),
+        ('outbox: due notifications',
+         select(Notification.id).where(Notification.status.in_(('pending', 'sending')),
+                                       Notification.next_attempt_at <= now)
+                                .order_by(Notification.next_attempt_at).limit(100)),
+    ]
+
+
+def _explain(connection, statement):
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+        return [row[-1] for row in rows]
+    if dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + str(compiled), params).scalar()
+        return plan if isinstance(plan, list) else json.loads(plan)
+    raise RuntimeError(f"No query plan check for the {dialect.name} dialect")
+
+
+def _sequential_scans(dialect_name, plan):
+    """Table names the plan reads without an index."""
+    if dialect_name == 'sqlite':
+        # "SCAN ticket" is a full table scan; "SCAN ticket USING INDEX ..." walks an index in order
+        return [line.split()[1] for line in plan
+                if line.startswith('SCAN ') and 'INDEX' not in line and 'SUBQUERY' not in line]
+    scans = []
+    nodes = [entry['Plan'] for entry in plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            scans.append(node.get('Relation Name'))
+        nodes.extend(node.get('Plans', []))
+    return scans
+
+
+def check_query_plans():
+    """Returns [(name, plan, sequential_scans)] for every hot query. Needs an app context."""
+    results = []
+    with db.engine.connect() as connection:
+        dialect_name = connection.dialect.name
+        for name, statement in hot_queries():
+            with connection.begin():
+                if dialect_name == 'postgresql':
+                    # Tiny development tables always plan as seq scans; only flag queries with no usable index
+                    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+                plan = _explain(connection, statement)
+            results.append((name, plan, _sequential_scans(dialect_name, plan)))
+    return results
@@ -0,0 +1,132 @@
+# rendering.py
+# Template rendering for big draws: compiled templates persisted across worker boots, the ticket
+# grid built once per draw version, and compressed responses (gzip, or brotli when installed).
+import os
+import gzip
+import importlib.util
+
+from flask import current_app, request
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup, escape
+
+from metrics import RESPONSE_BYTES
+from response_cache import LRUCache
+from ticket_store import claimed_tickets
+
+# brotli is optional: without it every client that accepts gzip gets gzip
+BROTLI_AVAILABLE = importlib.util.find_spec('brotli') is not None
+CONTENT_CODINGS = ('br', 'gzip') if BROTLI_AVAILABLE else ('gzip',)
+
+COMPRESSIBLE_MIMETYPES = frozenset({'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript',
+                                    'application/javascript', 'application/json', 'application/x-ndjson'})
+GRID_FRAGMENT_TTL_SECONDS = 3600
+
+
+# ---------------- Ticket Grid Fragment ----------------
+# The Jinja loop this replaces took ~0.7 s per page at 50k tickets; one string template per status builds the
+# grid ~4x faster, and a cached fragment makes the page ~25x faster (lottery_benchmark.py page_* stages).
+# Styling lives on .ticket-btn in draw_public_details.html; the live-grid script only needs data-ticket
+_BUTTON = ('<div class="col-3 col-sm-2 col-md-1"><button type="button" class="btn btn-{color} ticket-btn w-100 py-3 '
+           'fw-bold" data-ticket="{{0}}" data-status="{status}"{disabled}>{{0}}</button></div>')
+
+
+def _button_template(status):
+    color = {'available': 'success', 'pending_payment': 'warning text-dark', 'generating': 'secondary'}.get(status, 'danger')
+    return _BUTTON.format(color=color, status=escape(status), disabled='' if status == 'available' else ' disabled')
+
+
+def render_ticket_grid(draw):
+    """
+    The grid's buttons, in ticket-number order, as one HTML string built from the claimed rows.
+    Numbers a dense draw has not generated rows for yet cannot be reserved; they show as 'generating'.
+    """
+    claimed = claimed_tickets(draw)
+    ready = (draw.tickets_generated or 0) if draw.is_generating else draw.total_tickets
+    available = _button_template('available').format
+    templates = {}
+    parts = []
+    for number in range(1, draw.total_tickets + 1):
+        status = claimed.get(number) if number <= ready else 'generating'
+        if status is None:
+            parts.append(available(number))
+        else:
+            template = templates.get(status)
+            if template is None:
+                template = templates[status] = _button_template(status).format
+            parts.append(template(number))
+    return ''.join(parts)
+
+
+def ticket_grid_fragment(draw):
+    """
+    The rendered grid for the draw's current version, from the worker's fragment
+    cache. Admins, flashed redirects and the page cache's misses all reuse it
+    until the next write bumps Draw.tickets_version. Grids of draws still
+    generating change with every chunk, so they are rendered but not cached.
+    """
+    fragments = current_app.extensions.get('grid_fragments') if not draw.is_generating else None
+    key = (draw.id, draw.tickets_version or 0, draw.tickets_generated or 0)
+    html = fragments.get(key) if fragments is not None else None
+    if html is None:
+        html = render_ticket_grid(draw)
+        if fragments is not None:
+            fragments.set(key, html)
+    return Markup(html)
+
+
+# ---------------- Compression ----------------
+def _encode(data, coding, config):
+    if coding == 'br':
+        import brotli
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+
+def compress_response(response):
+    """
+    after_request hook: encodes text bodies of at least COMPRESS_MIN_BYTES in the
+    client's preferred coding. Streamed responses (exports) go out as they are.
+    Bodies with a strong ETag (the response cache's pages) are encoded once per
+    ETag and coding and then served from memory.
+    """
+    config = current_app.config
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code < 200
+            or response.status_code in (204, 206, 304) or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.cache_control.no_transform):
+        return response
+    response.vary.add('Accept-Encoding')
+    size = response.content_length or len(response.get_data())
+    coding = request.accept_encodings.best_match(CONTENT_CODINGS)
+    if coding is None or size < config['COMPRESS_MIN_BYTES']:
+        RESPONSE_BYTES.inc(size, 'identity')
+        return response
+
+    etag, weak = response.get_etag()
+    encoded_bodies = current_app.extensions['encoded_bodies']
+    body = encoded_bodies.get((etag, coding)) if etag and not weak else None
+    if body is None:
+        body = _encode(response.get_data(), coding, config)
+        if etag and not weak:
+            encoded_bodies.set((etag, coding), body)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = coding
+    if etag and not weak:
+        # Another coding of the same page: still equivalent, no longer byte-identical
+        response.set_etag(etag, weak=True)
+    RESPONSE_BYTES.inc(len(body), coding)
+    return response
+
+
+def init_rendering(flask_app):
+    config = flask_app.config
+    bytecode_dir = config['JINJA_BYTECODE_CACHE_DIR']
+    if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        flask_app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+    if config['GRID_FRAGMENT_CACHE_ENTRIES'] > 0:
+        flask_app.extensions['grid_fragments'] = LRUCache(config['GRID_FRAGMENT_CACHE_ENTRIES'],
+                                                          GRID_FRAGMENT_TTL_SECONDS)
+    if config['COMPRESS_ENABLED']:
+        flask_app.extensions['encoded_bodies'] = LRUCache(config['COMPRESS_CACHE_MAX_ENTRIES'],
+                                                          config['RESPONSE_CACHE_TTL_SECONDS'])
+        flask_app.after_request(compress_response)
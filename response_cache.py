@@ -0,0 +1,158 @@
+# response_cache.py
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from werkzeug.utils import import_string
+
+from models import db, Draw
+
+
+# ---------------- Backends ----------------
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ---------------- Cache Keys ----------------
+# Every write path bumps Draw.tickets_version (ticket_store.mark_tickets_changed) or adds/removes a draw,
+# so keys built from these values change on every write and stale pages are never served, in any worker.
+def draw_page_key(draw_id):
+    row = db.session.query(Draw.tickets_version, Draw.tickets_generated).filter(Draw.id == draw_id).first()
+    if row is None:
+        return None  # Let the view answer 404
+    return f"draw:{draw_id}:v{row.tickets_version}:g{row.tickets_generated}"
+
+
+def all_draws_key(page):
+    row = db.session.query(db.func.count(Draw.id), db.func.max(Draw.id),
+                           db.func.sum(Draw.tickets_version), db.func.sum(Draw.tickets_generated)).one()
+    return f"{page}:n{row[0]}:m{row[1] or 0}:v{row[2] or 0}:g{row[3] or 0}"
+
+
+# ---------------- Response Cache ----------------
+class ResponseCache:
+    """
+    Caches rendered GET responses of anonymous visitors under version-derived
+    keys, and answers If-None-Match with 304 before anything is rendered. The
+    backend is any object with get/set/clear (the in-process LRUCache by
+    default; RESPONSE_CACHE_BACKEND names a factory for a shared one).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0,
+                      'hit_ms_total': 0.0, 'miss_ms_total': 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, outcome, elapsed_ms=None):
+        with self._lock:
+            self.stats[outcome] += 1
+            if elapsed_ms is not None:
+                self.stats['hit_ms_total' if outcome == 'hits' else 'miss_ms_total'] += elapsed_ms
+
+    def respond(self, key, render):
+        started = time.perf_counter()
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+        if request.if_none_match.contains_weak(etag):  # Compressed copies carry it as W/"..."
+            self._count('not_modified')
+            response = make_response('', 304)
+        else:
+            cached = self.backend.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                response = make_response(body)
+                response.mimetype = mimetype
+                self._count('hits', (time.perf_counter() - started) * 1000)
+            else:
+                response = make_response(render())
+                if response.status_code == 200:
+                    self.backend.set(key, (response.get_data(), response.mimetype))
+                self._count('misses', (time.perf_counter() - started) * 1000)
+        response.set_etag(etag)
+        # Browsers may keep the page but must revalidate; the 304 above makes that cheap
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def snapshot(self):
+        stats = dict(self.stats, hit_ms_total=round(self.stats['hit_ms_total'], 1),
+                     miss_ms_total=round(self.stats['miss_ms_total'], 1))
+        served = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / served, 3) if served else 0.0
+        stats['avg_hit_ms'] = round(stats['hit_ms_total'] / stats['hits'], 2) if stats['hits'] else 0.0
+        stats['avg_miss_ms'] = round(stats['miss_ms_total'] / stats['misses'], 2) if stats['misses'] else 0.0
+        if hasattr(self.backend, '__len__'):
+            stats['entries'] = len(self.backend)
+        return stats
+
+
+def init_response_cache(flask_app):
+    if not flask_app.config['RESPONSE_CACHE_ENABLED']:
+        return None
+    factory = flask_app.config.get('RESPONSE_CACHE_BACKEND')
+    if factory:
+        backend = import_string(factory)(flask_app)
+    else:
+        backend = LRUCache(flask_app.config['RESPONSE_CACHE_MAX_ENTRIES'], flask_app.config['RESPONSE_CACHE_TTL_SECONDS'])
+    cache = ResponseCache(backend)
+    flask_app.extensions['response_cache'] = cache
+    return cache
+
+
+def cached_page(key_func):
+    """
+    View decorator: serve the page from the response cache under key_func(**view_args).
+    Admins, visitors with pending flash messages and non-GET requests always get a fresh render.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or request.method != 'GET' or '_flashes' in session or current_user.is_authenticated:
+                if cache is not None:
+                    cache._count('bypassed')
+                return view(*args, **kwargs)
+            key = key_func(*args, **kwargs)
+            if key is None:
+                return view(*args, **kwargs)
+            return cache.respond(key, lambda: view(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,512 @@
+# ticket_store.py
+import io
+import time
+import threading
+from collections import namedtuple, defaultdict
+from datetime import datetime
+
+from sqlalchemy import insert, update, delete, select, func, or_
+from sqlalchemy.exc import IntegrityError
+from flask import current_app
+
+from models import db, Draw, Ticket, TicketEvent, STATUS_COUNTER_COLUMNS
+
+
+# ---------------- Bulk Ticket Generation ----------------
+def _insert_chunk(draw_id, start, stop):
+    """Insert ticket numbers [start, stop) as `available` rows with one executemany."""
+    rows = [{'draw_id': draw_id, 'ticket_number': n, 'status': 'available'} for n in range(start, stop)]
+    db.session.execute(insert(Ticket.__table__), rows)
+
+
+def _copy_chunk(draw_id, start, stop):
+    """PostgreSQL fast path: stream the chunk through COPY instead of INSERT."""
+    buf = io.StringIO(''.join(f"{draw_id}\t{n}\tavailable\n" for n in range(start, stop)))
+    raw_conn = db.session.connection().connection
+    cursor = raw_conn.cursor()
+    try:
+        cursor.copy_expert("COPY ticket (draw_id, ticket_number, status) FROM STDIN", buf)
+    finally:
+        cursor.close()
+
+
+def generate_tickets(draw_id, chunk_size=None, progress=None):
+    """
+    Creates the `available` ticket rows for a draw in fixed-size chunks.
+    Each chunk is committed on its own and `Draw.tickets_generated` is bumped so
+    progress is visible to other requests. The run resumes after the highest
+    ticket number already stored, so it is safe to call again after a crash.
+    """
+    draw = db.session.get(Draw, draw_id)
+    if draw is None:
+        return 0
+    total = draw.total_tickets
+    chunk_size = chunk_size or current_app.config.get('TICKET_INSERT_CHUNK_SIZE', 5000)
+
+    last_number = db.session.query(func.max(Ticket.ticket_number)).filter(Ticket.draw_id == draw_id).scalar() or 0
+    use_copy = db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2'
+    write_chunk = _copy_chunk if use_copy else _insert_chunk
+
+    start = last_number + 1
+    while start <= total:
+        stop = min(start + chunk_size, total + 1)
+        write_chunk(draw_id, start, stop)
+        db.session.execute(
+            update(Draw.__table__).where(Draw.id == draw_id).values(tickets_generated=stop - 1)
+        )
+        db.session.commit()
+        if progress:
+            progress(stop - 1, total)
+        start = stop
+
+    return total - last_number
+
+
+def start_background_generation(draw_id):
+    """Runs generate_tickets in a daemon thread with its own app context."""
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                generate_tickets(
+                    draw_id,
+                    progress=lambda done, total: print(f"Draw {draw_id}: generated {done}/{total} tickets")
+                )
+            except Exception as e:
+                db.session.rollback()
+                print(f"Ticket generation for draw {draw_id} failed: {e}")
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, name=f"ticket-gen-{draw_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------------- Sparse Storage & Availability Bitmap ----------------
+GridTicket = namedtuple('GridTicket', ['ticket_number', 'status'])
+
+# draw_id -> (tickets_version, bitmap bytes, monotonic time the version was last confirmed current);
+# shared by every request in this worker
+_bitmap_cache = {}
+_bitmap_lock = threading.Lock()
+BITMAP_CACHE_SIZE = 256
+
+
+def mark_tickets_changed(draw_id, changes=(), **status_deltas):
+    """
+    Bumps Draw.tickets_version (invalidating cached bitmaps) and applies
+    counter deltas keyed by ticket status, e.g. pending_payment=-1, approved=1,
+    in one UPDATE inside the caller's transaction. `changes` is a list of
+    (ticket_number, new_status) recorded in the TicketEvent log under the new
+    version. Returns the new version.
+    """
+    values = {'tickets_version': Draw.tickets_version + 1}
+    for status, delta in status_deltas.items():
+        column = STATUS_COUNTER_COLUMNS.get(status)
+        if column and delta:
+            values[column] = getattr(Draw, column) + delta
+    stmt = update(Draw.__table__).where(Draw.id == draw_id).values(values)
+    if db.engine.dialect.update_returning:
+        version = db.session.execute(stmt.returning(Draw.__table__.c.tickets_version)).scalar()
+    else:
+        db.session.execute(stmt)
+        version = db.session.query(Draw.tickets_version).filter(Draw.id == draw_id).scalar()
+
+    if changes:
+        db.session.execute(insert(TicketEvent.__table__), [
+            {'draw_id': draw_id, 'version': version, 'ticket_number': number, 'status': status,
+             'created_at': datetime.utcnow()}
+            for number, status in changes
+        ])
+    return version
+
+
+def lock_draws(draw_ids):
+    """
+    Row-locks the draws (SELECT ... FOR UPDATE, in id order) until the caller's transaction
+    ends and returns {draw_id: row with is_drawn, purge_state} as of the lock. Every payment
+    change takes it before checking the draw, and draw_engine.execute_draw's claim UPDATE takes
+    the same lock, so a change either commits before the approved tickets are counted or sees
+    the draw executed.
+    """
+    if not draw_ids:
+        return {}
+    draws = Draw.__table__
+    draw_ids = sorted(set(draw_ids))
+    if db.engine.dialect.name == 'sqlite':
+        # No row locks, and its SELECTs take none: a no-op UPDATE holds the database write lock instead
+        db.session.execute(update(draws).where(draws.c.id.in_(draw_ids)).values(id=draws.c.id))
+    rows = db.session.execute(select(draws.c.id, draws.c.is_drawn, draws.c.purge_state)
+                              .where(draws.c.id.in_(draw_ids))
+                              .order_by(draws.c.id)
+                              .with_for_update()).all()
+    return {row.id: row for row in rows}
+
+
+def claimed_tickets(draw):
+    """Returns {ticket_number: status} for every ticket that is not available."""
+    if draw.archived_at:
+        # Only the winning rows are left in the ticket table; the rest lives in the archive
+        from draw_archive import archived_claims
+        return archived_claims(draw)
+    rows = db.session.query(Ticket.ticket_number, Ticket.status)\
+                     .filter(Ticket.draw_id == draw.id, Ticket.status != 'available')\
+                     .all()
+    return dict(rows)
+
+
+def _build_bitmap(draw):
+    bitmap = bytearray((draw.total_tickets + 7) // 8)
+    for number in claimed_tickets(draw):
+        if 1 <= number <= draw.total_tickets:
+            bitmap[(number - 1) >> 3] |= 1 << ((number - 1) & 7)
+    return bytes(bitmap)
+
+
+def availability_bitmap(draw):
+    """
+    Compact claimed-ticket bitmap for a draw (bit n-1 set = ticket n is taken).
+    Looked up in the worker cache, then in the persisted copy on the Draw row,
+    and only rebuilt from the claimed rows when both are stale.
+    """
+    # Read before the commit below expires `draw`: touching it again under the lock would check out a
+    # connection while holding it, and every request waiting on the lock already holds one
+    draw_id, version = draw.id, draw.tickets_version or 0
+    cached = _bitmap_cache.get(draw_id)
+    if cached and cached[0] == version:
+        _bitmap_cache[draw_id] = (version, cached[1], time.monotonic())
+        return cached[1]
+
+    if draw.bitmap_version == version and draw.availability_bitmap is not None:
+        bitmap = bytes(draw.availability_bitmap)
+    else:
+        bitmap = _build_bitmap(draw)
+        # Only persist if nobody changed the draw while we were building it
+        db.session.execute(
+            update(Draw.__table__)
+            .where(Draw.id == draw_id, Draw.tickets_version == version)
+            .values(availability_bitmap=bitmap, bitmap_version=version)
+        )
+        db.session.commit()
+
+    with _bitmap_lock:
+        if len(_bitmap_cache) >= BITMAP_CACHE_SIZE:
+            _bitmap_cache.pop(next(iter(_bitmap_cache)))
+        _bitmap_cache[draw_id] = (version, bitmap, time.monotonic())
+    return bitmap
+
+
+def cached_availability_bitmap(draw_id, max_age):
+    """
+    The worker's bitmap of a draw if some request confirmed it current in the
+    last `max_age` seconds, else None. No query: admission control uses it to
+    turn away numbers that are already taken, accepting a staleness of max_age.
+    """
+    cached = _bitmap_cache.get(draw_id)
+    if cached and time.monotonic() - cached[2] <= max_age:
+        return cached[1]
+    return None
+
+
+def is_ticket_available(draw, ticket_number):
+    if not 1 <= ticket_number <= draw.total_tickets:
+        return False
+    bitmap = availability_bitmap(draw)
+    return not bitmap[(ticket_number - 1) >> 3] & (1 << ((ticket_number - 1) & 7))
+
+
+def ticket_grid(draw):
+    """All ticket numbers of a draw with their status, built from the claimed rows only."""
+    claimed = claimed_tickets(draw)
+    return [GridTicket(n, claimed.get(n, 'available')) for n in range(1, draw.total_tickets + 1)]
+
+
+def ticket_page(draw_id, filters, after=None, before=None, per_page=100):
+    """
+    One page of a draw's ticket rows for the admin table, keyset-paginated on
+    ticket_number so page N costs the same as page 1. `filters` may hold
+    status, username (case-insensitive prefix), telegram_id, reserved_from
+    and reserved_to. Returns (tickets, has_previous, has_next).
+    """
+    query = Ticket.query.filter(Ticket.draw_id == draw_id)
+    if filters.get('status'):
+        query = query.filter(Ticket.status == filters['status'])
+    if filters.get('username'):
+        prefix = filters['username'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Ticket.user_username.ilike(prefix + '%', escape='\\'))
+    if filters.get('telegram_id'):
+        query = query.filter(Ticket.user_telegram_id == int(filters['telegram_id']))
+    if filters.get('reserved_from'):
+        query = query.filter(Ticket.reserved_at >= filters['reserved_from'])
+    if filters.get('reserved_to'):
+        query = query.filter(Ticket.reserved_at <= filters['reserved_to'])
+
+    if before is not None:
+        rows = query.filter(Ticket.ticket_number < before)\
+                    .order_by(Ticket.ticket_number.desc())\
+                    .limit(per_page + 1)\
+                    .all()
+        return rows[:per_page][::-1], len(rows) > per_page, True
+    if after is not None:
+        query = query.filter(Ticket.ticket_number > after)
+    rows = query.order_by(Ticket.ticket_number).limit(per_page + 1).all()
+    return rows[:per_page], after is not None, len(rows) > per_page
+
+
+def _insert_ignoring_conflicts():
+    """Dialect INSERT that supports ON CONFLICT DO NOTHING, or None if unavailable."""
+    name = db.engine.dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(Ticket.__table__)
+
+
+def _claim_sparse(draw_id, numbers, values):
+    stmt = _insert_ignoring_conflicts()
+    rows = [dict(values, draw_id=draw_id, ticket_number=n) for n in numbers]
+    if stmt is not None and db.engine.dialect.insert_returning:
+        # One statement: INSERT ... ON CONFLICT (draw_id, ticket_number) DO NOTHING RETURNING ticket_number
+        stmt = stmt.values(rows)\
+                   .on_conflict_do_nothing(index_elements=['draw_id', 'ticket_number'])\
+                   .returning(Ticket.__table__.c.ticket_number)
+        return list(db.session.execute(stmt).scalars())
+
+    # Fallback: one savepoint per number, the unique constraint decides the winner
+    claimed = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Ticket.__table__).values(row))
+            claimed.append(row['ticket_number'])
+        except IntegrityError:
+            pass
+    return claimed
+
+
+def _claim_dense(draw_id, numbers, values):
+    table = Ticket.__table__
+    condition = (table.c.draw_id == draw_id) & (table.c.status == 'available')
+    if db.engine.dialect.update_returning:
+        # One statement: UPDATE ... WHERE status = 'available' AND ticket_number IN (...) RETURNING ticket_number
+        stmt = update(table).where(condition, table.c.ticket_number.in_(numbers))\
+                            .values(values).returning(table.c.ticket_number)
+        return list(db.session.execute(stmt).scalars())
+
+    claimed = []
+    for n in numbers:
+        result = db.session.execute(update(table).where(condition, table.c.ticket_number == n).values(values))
+        if result.rowcount == 1:
+            claimed.append(n)
+    return claimed
+
+
+def reserve_tickets(draw, ticket_numbers, user_telegram_id, user_username):
+    """
+    Atomically claims tickets as pending_payment and returns the numbers that
+    were actually reserved. Each number is won by exactly one caller: dense
+    draws use a conditional UPDATE on status='available', sparse draws an
+    INSERT that the (draw_id, ticket_number) unique constraint arbitrates.
+    Numbers already known to be taken are dropped via the bitmap first.
+    """
+    numbers = sorted({n for n in ticket_numbers if is_ticket_available(draw, n)})
+    if not numbers:
+        return []
+
+    values = {
+        'status': 'pending_payment',
+        'user_telegram_id': user_telegram_id,
+        'user_username': user_username,
+        'reserved_at': datetime.utcnow(),
+    }
+    try:
+        if draw.sparse_tickets:
+            claimed = _claim_sparse(draw.id, numbers, values)
+        else:
+            claimed = _claim_dense(draw.id, numbers, values)
+        if claimed:
+            mark_tickets_changed(draw.id, [(n, 'pending_payment') for n in claimed], pending_payment=len(claimed))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return sorted(claimed)
+
+
+def pending_reservation_count(draw_id, user_telegram_id):
+    """Tickets a user holds unpaid in a draw (ix_ticket_user_telegram_id)."""
+    return db.session.query(func.count(Ticket.id))\
+                     .filter(Ticket.user_telegram_id == user_telegram_id, Ticket.draw_id == draw_id,
+                             Ticket.status == 'pending_payment')\
+                     .scalar()
+
+
+def release_ticket(ticket):
+    """Returns a claimed ticket to the pool (rejection, expiry or deletion). Caller commits."""
+    previous_status = ticket.status
+    if ticket.draw.sparse_tickets:
+        db.session.delete(ticket)
+    else:
+        ticket.status = 'available'
+        ticket.user_telegram_id = None
+        ticket.user_username = None
+        ticket.reserved_at = None
+        ticket.approved_at = None
+    mark_tickets_changed(ticket.draw_id, [(ticket.ticket_number, 'available')], **{previous_status: -1})
+
+
+def _apply_to_candidates(statement, table, where):
+    """
+    Runs a conditional UPDATE/DELETE over the rows matching `where` and returns
+    the ones it touched as (id, draw_id, ticket_number, user_telegram_id). The
+    values are read before the change, so a reset row still reports its owner.
+    """
+    candidates = db.session.execute(
+        select(table.c.id, table.c.draw_id, table.c.ticket_number, table.c.user_telegram_id).where(*where)
+    ).all()
+    if not candidates:
+        return []
+    statement = statement.where(table.c.id.in_([row.id for row in candidates]), *where)
+    dialect = db.engine.dialect
+    if dialect.delete_returning if statement.is_delete else dialect.update_returning:
+        # Re-checked by the WHERE clause: a row changed in the meantime is skipped
+        touched = set(db.session.execute(statement.returning(table.c.id)).scalars())
+        return [row for row in candidates if row.id in touched]
+    db.session.execute(statement)
+    return candidates
+
+
+def review_payments(action, ticket_ids=None, draw_id=None, user_telegram_id=None):
+    """
+    Approves or rejects every pending_payment ticket matching the filters with
+    one candidate SELECT and one conditional statement per storage mode,
+    instead of one request and commit per ticket. Tickets that are no longer pending, or whose draw has
+    been executed or is being reset or deleted, are skipped by the WHERE clause, so double submits are harmless. Returns the affected rows
+    (id, draw_id, ticket_number, user_telegram_id). Caller commits.
+    """
+    if action not in ('approve', 'reject'):
+        raise ValueError(f"Unknown payment action: {action}")
+    table = Ticket.__table__
+    conditions = [table.c.status == 'pending_payment']
+    if ticket_ids is not None:
+        conditions.append(table.c.id.in_(list(ticket_ids)))
+    if draw_id is not None:
+        conditions.append(table.c.draw_id == draw_id)
+    if user_telegram_id is not None:
+        conditions.append(table.c.user_telegram_id == int(user_telegram_id))
+    if len(conditions) == 1:
+        raise ValueError("Refusing to review payments without a ticket, draw or user filter.")
+    # Executed draws keep the approved set their winners were picked from (draw_engine.verify_draw);
+    # draws being reset or deleted have zeroed counters and rows that are about to be purged.
+    # The draws involved are locked first, so none of them is executed while this runs
+    draw_ids = set(db.session.execute(select(table.c.draw_id).where(*conditions).distinct()).scalars())
+    locked = lock_draws(draw_ids | ({draw_id} if draw_id is not None else set()))
+    state = locked.get(draw_id)
+    if state is not None and state.is_drawn:
+        raise ValueError("This draw has been executed; its payments can no longer change.")
+    if state is not None and state.purge_state:
+        raise ValueError("This draw is being reset or deleted; its payments can no longer change.")
+    draws = Draw.__table__
+    conditions.append(table.c.draw_id.not_in(
+        select(draws.c.id).where(or_(draws.c.is_drawn.is_(True), draws.c.purge_state.isnot(None)))))
+
+    if action == 'approve':
+        statements = [(update(table).values(status='approved', approved_at=datetime.utcnow()), conditions)]
+        new_status = 'approved'
+    else:
+        # Rejected tickets go back to the pool: sparse draws drop the row, dense draws reset it
+        sparse_draws = select(Draw.__table__.c.id).where(Draw.__table__.c.sparse_tickets.is_(True))
+        statements = [
+            (delete(table), conditions + [table.c.draw_id.in_(sparse_draws)]),
+            (update(table).values(status='available', user_telegram_id=None, user_username=None, reserved_at=None),
+             conditions + [table.c.draw_id.not_in(sparse_draws)]),
+        ]
+        new_status = 'available'
+
+    rows = []
+    for statement, where in statements:
+        rows.extend(_apply_to_candidates(statement, table, where))
+
+    by_draw = defaultdict(list)
+    for row in rows:
+        by_draw[row.draw_id].append(row.ticket_number)
+    for changed_draw_id, numbers in by_draw.items():
+        deltas = {'pending_payment': -len(numbers)}
+        if action == 'approve':
+            deltas['approved'] = len(numbers)
+        mark_tickets_changed(changed_draw_id, [(n, new_status) for n in numbers], **deltas)
+    return rows
+
+
+def clear_draw_tickets(draw):
+    """
+    Starts a reset: counters go to zero and the draw is closed with purge_state
+    'resetting'. The ticket rows are deleted afterwards in bounded batches by
+    draw_archive.finish_purge, which reopens the draw. Caller commits.
+    """
+    draw.purge_state = 'resetting'
+    draw.archived_at = None
+    draw.tickets_generated = 0
+    for column in STATUS_COUNTER_COLUMNS.values():
+        setattr(draw, column, 0)
+    mark_tickets_changed(draw.id, [(None, 'reset')])
+
+
+# ---------------- Compact Grid Encoding ----------------
+# One-letter status codes used by the JSON grid API
+STATUS_CODES = {'available': 'a', 'pending_payment': 'p', 'approved': 'r', 'won': 'w'}
+MAX_CHANGES_PER_RESPONSE = 5000
+
+
+def encode_grid(draw):
+    """
+    Run-length encodes the whole ticket grid as [[code, length], ...] in
+    ticket-number order. Built from the claimed rows only, so the cost is
+    proportional to claimed tickets rather than draw size.
+    """
+    runs = []
+    position = 1  # next ticket number not yet encoded
+
+    def push(code, length):
+        if length <= 0:
+            return
+        if runs and runs[-1][0] == code:
+            runs[-1][1] += length
+        else:
+            runs.append([code, length])
+
+    for number, status in sorted(claimed_tickets(draw).items()):
+        if not 1 <= number <= draw.total_tickets:
+            continue
+        push('a', number - position)
+        push(STATUS_CODES.get(status, 'r'), 1)
+        position = number + 1
+    push('a', draw.total_tickets - position + 1)
+    return runs
+
+
+def changes_since(draw, since_version):
+    """
+    Ticket changes after `since_version` as (current_version, [[number, code], ...]).
+    Returns (current_version, None) when the client must reload the full grid:
+    the draw was reset, or too much changed to be worth sending as a delta.
+    """
+    current_version = draw.tickets_version or 0
+    if since_version >= current_version:
+        return current_version, []
+    events = db.session.query(TicketEvent.ticket_number, TicketEvent.status)\
+                       .filter(TicketEvent.draw_id == draw.id, TicketEvent.version > since_version)\
+                       .order_by(TicketEvent.version, TicketEvent.id)\
+                       .limit(MAX_CHANGES_PER_RESPONSE + 1)\
+                       .all()
+    if len(events) > MAX_CHANGES_PER_RESPONSE or any(number is None for number, _ in events):
+        return current_version, None
+    latest = {}
+    for number, status in events:
+        latest[number] = STATUS_CODES.get(status, 'r')
+    return current_version, [[number, code] for number, code in latest.items()]